@@ -0,0 +1,125 @@
+"""
+Benchmark of the graph construction in match_seller_with_nearest_buyer.
+
+Compares the nested loop over every sell order and buy order with the price sweep in
+get_price_compatible_edges and the NumPy cost matrix in get_compatible_edges, for increasing
+order counts.
+
+Usage: env PYTHONPATH=. python benchmarks/graph_build.py
+"""
+import random
+from time import perf_counter
+
+import networkx as nx
+
+from src.match import (
+    get_banned_pair_index,
+    get_compatible_edges,
+    get_order_books,
+    get_price_compatible_edges,
+)
+
+
+def generate_orders(prefix, count, rng):
+    return [
+        {
+            "id": f"{prefix}{i}",
+            "user_id": f"u{prefix}{i}",
+            "number_of_shares": rng.randint(1, 1000),
+            "price": rng.randint(1, 100),
+        }
+        for i in range(count)
+    ]
+
+
+def build_graph_nested(buy_orders, sell_orders, banned_user_matches):
+    max_number_of_shares = max(o["number_of_shares"] for o in buy_orders + sell_orders)
+    graph = nx.Graph()
+    for sell_order in sell_orders:
+        for buy_order in buy_orders:
+            if buy_order["price"] < sell_order["price"] or (
+                (buy_order["user_id"], sell_order["user_id"]) in banned_user_matches
+            ):
+                continue
+            cost = abs(
+                buy_order["price"] - sell_order["price"]
+            ) * max_number_of_shares * 2 + abs(
+                buy_order["number_of_shares"] - sell_order["number_of_shares"]
+            )
+            graph.add_edge(buy_order["id"], sell_order["id"], weight=-cost)
+    return graph
+
+
+def build_graph(get_edges, buy_orders, sell_orders, banned_user_matches):
+    """
+    Builds the graph from the edges given by get_edges on the order books of the orders, with
+    order numbers mapped back to IDs so that it can be compared with build_graph_nested.
+    """
+    max_number_of_shares = max(o["number_of_shares"] for o in buy_orders + sell_orders)
+    buy_book, sell_book = get_order_books(buy_orders, sell_orders)
+    banned = get_banned_pair_index(buy_book.users, banned_user_matches)
+    buy_ids = buy_book.orders.ids
+    sell_ids = sell_book.orders.ids
+    graph = nx.Graph()
+    graph.add_weighted_edges_from(
+        (buy_ids[buy_order], sell_ids[sell_order], -cost)
+        for buy_order, sell_order, cost in get_edges(
+            buy_book, sell_book, banned, max_number_of_shares
+        )
+    )
+    return graph
+
+
+def build_graph_sweep(buy_orders, sell_orders, banned_user_matches):
+    return build_graph(
+        get_price_compatible_edges, buy_orders, sell_orders, banned_user_matches
+    )
+
+
+def build_graph_matrix(buy_orders, sell_orders, banned_user_matches):
+    return build_graph(
+        get_compatible_edges, buy_orders, sell_orders, banned_user_matches
+    )
+
+
+def time_it(func, *args):
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+
+def main():
+    rng = random.Random(0)
+    print(
+        f"{'orders':>8} {'edges':>10} {'nested (s)':>12} {'sweep (s)':>12} "
+        f"{'matrix (s)':>12}"
+    )
+    for count in [250, 500, 1000, 2000, 4000]:
+        buy_orders = generate_orders("b", count, rng)
+        # Sellers ask for more than most buyers bid, as in a typical round
+        sell_orders = [
+            {**o, "price": o["price"] + 70} for o in generate_orders("s", count, rng)
+        ]
+        nested_time, nested_graph = time_it(
+            build_graph_nested, buy_orders, sell_orders, set()
+        )
+        sweep_time, sweep_graph = time_it(
+            build_graph_sweep, buy_orders, sell_orders, set()
+        )
+        matrix_time, matrix_graph = time_it(
+            build_graph_matrix, buy_orders, sell_orders, set()
+        )
+        assert nx.utils.edges_equal(
+            nested_graph.edges(data=True), sweep_graph.edges(data=True)
+        )
+        assert nx.utils.edges_equal(
+            nested_graph.edges(data=True), matrix_graph.edges(data=True)
+        )
+        print(
+            f"{count:>8} {sweep_graph.number_of_edges():>10} "
+            f"{nested_time:>12.3f} {sweep_time:>12.3f} {matrix_time:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
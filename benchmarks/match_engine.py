@@ -0,0 +1,250 @@
+"""
+Benchmark suite of the matching engine on synthetic order books.
+
+Each scenario generates a deterministic round and times the phases of match_buyers_and_sellers
+separately: building the graph, solving the first matching, and distributing the remaining
+buyers. The peak memory of a whole match is measured in a separate run, since tracing
+allocations slows everything down.
+
+Results are printed as a table and written as JSON, so that runs can be compared.
+
+Usage: env PYTHONPATH=. python benchmarks/match_engine.py [--output results.json] [--quick]
+"""
+import argparse
+import json
+import platform
+import random
+import tracemalloc
+from collections import Counter
+from itertools import chain
+from time import perf_counter
+
+from src.match import (
+    SOLVERS,
+    distribute_remaining_buyers,
+    get_banned_pair_index,
+    get_compatible_edges,
+    get_order_books,
+    match_buyers_and_sellers,
+    split_into_components,
+)
+
+DEFAULT_SCENARIO = {
+    "number_of_orders": 500,
+    # Sell prices are drawn from [100, 100 + price_spread], buy prices from
+    # [100 - price_spread / 2, 100 + price_spread / 2]
+    "price_spread": 20,
+    # "uniform" or "lognormal"
+    "share_distribution": "uniform",
+    # Fraction of all (buyer, seller) pairs that are banned
+    "banned_pair_density": 0.0,
+    # Fraction of sellers who place two sell orders instead of one
+    "two_sell_orders_ratio": 0.5,
+    "solver": "networkx",
+    "seed": 0,
+}
+
+SCENARIOS = [
+    {"number_of_orders": 100},
+    {"number_of_orders": 250},
+    {"number_of_orders": 500},
+    {"number_of_orders": 500, "solver": "assignment"},
+    {"number_of_orders": 500, "solver": "flow"},
+    {"number_of_orders": 2000, "solver": "assignment"},
+    {"number_of_orders": 500, "price_spread": 2},
+    {"number_of_orders": 500, "price_spread": 200},
+    {"number_of_orders": 500, "share_distribution": "lognormal"},
+    {"number_of_orders": 500, "banned_pair_density": 0.05},
+    {"number_of_orders": 500, "two_sell_orders_ratio": 0.0},
+    {"number_of_orders": 500, "two_sell_orders_ratio": 1.0},
+]
+
+QUICK_SCENARIOS = [
+    {"number_of_orders": 50},
+    {"number_of_orders": 50, "solver": "assignment"},
+]
+
+
+def generate_round(
+    number_of_orders,
+    price_spread,
+    share_distribution,
+    banned_pair_density,
+    two_sell_orders_ratio,
+    seed,
+    **_,
+):
+    """
+    Generates the arguments to match_buyers_and_sellers for a round with about
+    number_of_orders buy orders and as many sell orders. The same parameters always generate
+    the same round.
+
+    Returns:
+    (buy_orders, sell_orders, banned_user_matches), where sell orders are doubled the same way
+    as in MatchService._get_matching_params.
+    """
+    rng = random.Random(seed)
+
+    def number_of_shares():
+        if share_distribution == "uniform":
+            return float(rng.randint(1, 1000))
+        if share_distribution == "lognormal":
+            return float(max(1, round(rng.lognormvariate(4, 1.5))))
+        raise ValueError(f"Unknown share distribution {share_distribution}")
+
+    buy_orders = [
+        {
+            "id": f"b{i}",
+            "user_id": f"ub{i}",
+            "number_of_shares": number_of_shares(),
+            "price": round(100 + rng.uniform(-0.5, 0.5) * price_spread, 2),
+        }
+        for i in range(number_of_orders)
+    ]
+
+    sell_orders = []
+    seller = 0
+    while len(sell_orders) < number_of_orders:
+        count = 2 if rng.random() < two_sell_orders_ratio else 1
+        for _ in range(min(count, number_of_orders - len(sell_orders))):
+            sell_orders.append(
+                {
+                    "id": f"s{len(sell_orders)}",
+                    "user_id": f"us{seller}",
+                    "number_of_shares": number_of_shares(),
+                    "price": round(100 + rng.uniform(0, 1) * price_spread, 2),
+                }
+            )
+        seller += 1
+
+    buyers = sorted({o["user_id"] for o in buy_orders})
+    sellers = sorted({o["user_id"] for o in sell_orders})
+    number_of_banned_pairs = round(len(buyers) * len(sellers) * banned_pair_density)
+    banned_user_matches = {
+        (rng.choice(buyers), rng.choice(sellers)) for _ in range(number_of_banned_pairs)
+    }
+
+    return buy_orders, double_sell_orders(sell_orders), banned_user_matches
+
+
+def double_sell_orders(sell_orders):
+    seller_counts = Counter(o["user_id"] for o in sell_orders)
+    return list(
+        chain.from_iterable(
+            [o, o] if seller_counts[o["user_id"]] == 1 else [o] for o in sell_orders
+        )
+    )
+
+
+def time_phases(buy_orders, sell_orders, banned_user_matches, solver):
+    """
+    Runs the same steps as match_buyers_and_sellers, timing each of them.
+
+    Returns:
+    (dict of phase name to seconds, dict of graph and result sizes)
+    """
+    timings = {}
+
+    start = perf_counter()
+    buy_book, sell_book = get_order_books(buy_orders, sell_orders)
+    banned = get_banned_pair_index(buy_book.users, banned_user_matches)
+    max_number_of_shares = max(
+        chain(buy_book.number_of_shares, sell_book.number_of_shares), default=0
+    )
+    edges = get_compatible_edges(buy_book, sell_book, banned, max_number_of_shares)
+    components = split_into_components(edges)
+    timings["graph_build"] = perf_counter() - start
+
+    start = perf_counter()
+    first_iteration = set()
+    for component in components:
+        first_iteration |= SOLVERS[solver](component)
+    timings["first_matching"] = perf_counter() - start
+
+    start = perf_counter()
+    matched_buy_orders = {buy_order for buy_order, _ in first_iteration}
+    remaining_buy_rows = [
+        row
+        for row in range(len(buy_book))
+        if buy_book.order[row] not in matched_buy_orders
+    ]
+    subsequent = distribute_remaining_buyers(
+        buy_book, sell_book, banned, remaining_buy_rows
+    )
+    timings["distribute_remaining_buyers"] = perf_counter() - start
+
+    timings["total"] = sum(timings.values())
+    sizes = {
+        "edges": len(edges),
+        "components": len(components),
+        "largest_component_edges": max(map(len, components), default=0),
+        "first_matching": len(first_iteration),
+        "remaining_buyers_matched": len(subsequent),
+    }
+    return timings, sizes
+
+
+def measure_peak_memory(buy_orders, sell_orders, banned_user_matches, solver):
+    tracemalloc.start()
+    match_buyers_and_sellers(
+        buy_orders, sell_orders, banned_user_matches, solver=solver
+    )
+    _size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run_scenario(scenario):
+    scenario = {**DEFAULT_SCENARIO, **scenario}
+    buy_orders, sell_orders, banned_user_matches = generate_round(**scenario)
+    timings, sizes = time_phases(
+        buy_orders, sell_orders, banned_user_matches, scenario["solver"]
+    )
+    peak = measure_peak_memory(
+        buy_orders, sell_orders, banned_user_matches, scenario["solver"]
+    )
+    return {
+        "scenario": scenario,
+        "buy_orders": len(buy_orders),
+        "sell_orders": len(sell_orders),
+        "banned_pairs": len(banned_user_matches),
+        **sizes,
+        "seconds": timings,
+        "peak_memory_bytes": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default="match_engine_benchmark.json")
+    parser.add_argument("--quick", action="store_true", help="small scenarios only")
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'orders':>7} {'solver':>10} {'spread':>7} {'shares':>9} {'banned':>6} {'2 sells':>7} "
+        f"{'edges':>8} {'build (s)':>10} {'match (s)':>10} {'rest (s)':>9} {'peak MiB':>9}"
+    )
+    for scenario in QUICK_SCENARIOS if args.quick else SCENARIOS:
+        result = run_scenario(scenario)
+        results.append(result)
+        scenario, seconds = result["scenario"], result["seconds"]
+        print(
+            f"{scenario['number_of_orders']:>7} {scenario['solver']:>10} "
+            f"{scenario['price_spread']:>7} {scenario['share_distribution']:>9} "
+            f"{scenario['banned_pair_density']:>6} "
+            f"{scenario['two_sell_orders_ratio']:>7} {result['edges']:>8} "
+            f"{seconds['graph_build']:>10.3f} {seconds['first_matching']:>10.3f} "
+            f"{seconds['distribute_remaining_buyers']:>9.3f} "
+            f"{result['peak_memory_bytes'] / 2 ** 20:>9.1f}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {"python": platform.python_version(), "results": results}, f, indent=2
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
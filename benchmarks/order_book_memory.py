@@ -0,0 +1,71 @@
+"""
+Memory needed to hand 100k orders to the matcher, as the dicts produced by Base.asdict() (plus
+the deep copy the matcher used to make) and as an OrderBook.
+
+Usage: env PYTHONPATH=. python benchmarks/order_book_memory.py
+"""
+import random
+import tracemalloc
+import uuid
+from copy import deepcopy
+from datetime import datetime, timezone
+
+from src.order_book import OrderBook
+
+NUMBER_OF_ORDERS = 100000
+
+
+def generate_asdict_orders(count, rng):
+    user_ids = [str(uuid.uuid4()) for _ in range(count // 2)]
+    security_id = str(uuid.uuid4())
+    round_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "created_at": now.replace(microsecond=rng.randrange(1000000)),
+            "updated_at": now.replace(microsecond=rng.randrange(1000000)),
+            "user_id": rng.choice(user_ids),
+            "security_id": security_id,
+            "number_of_shares": float(rng.randint(1, 1000)),
+            "price": float(rng.randint(1, 100)),
+            "round_id": round_id,
+            "security_name": "Grab",
+        }
+        for _ in range(count)
+    ]
+
+
+def measure(func):
+    tracemalloc.start()
+    result = func()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    rng = random.Random(0)
+
+    dicts_size, orders = measure(lambda: generate_asdict_orders(NUMBER_OF_ORDERS, rng))
+    copy_size, _copy = measure(lambda: deepcopy(orders))
+    # Give the order book its own copies of the ID strings, as it gets when loading from the
+    # database, so that they are counted
+    book_size, _book = measure(
+        lambda: OrderBook.from_dicts(
+            {
+                **o,
+                "id": str(uuid.UUID(o["id"])),
+                "user_id": str(uuid.UUID(o["user_id"])),
+            }
+            for o in orders
+        )
+    )
+
+    print(f"asdict() dicts:          {dicts_size / 2 ** 20:8.1f} MiB")
+    print(f"asdict() dicts + copy:   {(dicts_size + copy_size) / 2 ** 20:8.1f} MiB")
+    print(f"OrderBook:               {book_size / 2 ** 20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
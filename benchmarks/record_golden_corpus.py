@@ -0,0 +1,187 @@
+"""
+Records the golden corpus of tests/test_match_golden.py: order books with their expected
+matching, and the time and memory budgets of every solver on them.
+
+Books are generated like the scenarios of benchmarks/match_engine.py, or with --from-db taken
+from the latest concluded rounds, one book per security, with IDs replaced by sequential ones.
+The expected matching is computed with the reference solver, and every other solver must find a
+first matching of the same size and cost before its budget is recorded.
+
+Budgets are a multiple of the time and peak memory measured on this machine, so record on a
+machine comparable to the one running the tests.
+
+Usage: env PYTHONPATH=. python benchmarks/record_golden_corpus.py [--from-db 3]
+"""
+import argparse
+import json
+import math
+import tracemalloc
+from itertools import chain
+from pathlib import Path
+from time import perf_counter
+
+from benchmarks.match_engine import DEFAULT_SCENARIO, generate_round
+
+CORPUS_DIR = Path(__file__).parent.parent / "tests" / "golden"
+
+REFERENCE_SOLVER = "assignment"
+TIME_BUDGET_FACTOR = 3
+MIN_TIME_BUDGET = 0.5
+MEMORY_BUDGET_FACTOR = 1.5
+
+# Solvers missing from a book are too slow for its size and are skipped by the tests
+BOOKS = {
+    "uniform_150": (
+        {"number_of_orders": 150, "banned_pair_density": 0.01},
+        ["networkx", "assignment", "flow", "auto"],
+    ),
+    "ties_300": (
+        {"number_of_orders": 300, "price_spread": 2, "share_distribution": "lognormal"},
+        ["assignment", "auto"],
+    ),
+    "banned_500": (
+        {"number_of_orders": 500, "banned_pair_density": 0.05, "seed": 1},
+        ["assignment", "auto"],
+    ),
+    "uniform_750": (
+        {"number_of_orders": 750, "two_sell_orders_ratio": 0.2, "seed": 2},
+        ["auto"],
+    ),
+}
+DB_BOOK_SOLVERS = ["assignment", "auto"]
+
+
+def measure(params, solver):
+    """
+    Returns:
+    (match results, first matching stats, seconds, peak memory in bytes)
+    """
+    from src.match import match_buyers_and_sellers
+
+    stats = {}
+    start = perf_counter()
+    results = match_buyers_and_sellers(*params, solver=solver, stats=stats)
+    seconds = perf_counter() - start
+
+    tracemalloc.start()
+    match_buyers_and_sellers(*params, solver=solver)
+    _size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return results, stats, seconds, peak
+
+
+def anonymize(buy_orders, sell_orders, banned_pairs):
+    """
+    Replaces order and user IDs with sequential ones. A doubled sell order keeps a single ID.
+    """
+    ids = {}
+
+    def get_id(prefix, id):
+        return ids.setdefault((prefix, id), f"{prefix}{len(ids)}")
+
+    def convert(orders, prefix):
+        return [
+            {
+                **order,
+                "id": get_id(prefix, order["id"]),
+                "user_id": get_id("u", order["user_id"]),
+            }
+            for order in orders
+        ]
+
+    buy_orders, sell_orders = convert(buy_orders, "b"), convert(sell_orders, "s")
+    banned_pairs = {
+        (ids[("u", buyer_id)], ids[("u", seller_id)])
+        for buyer_id, seller_id in banned_pairs
+        if ("u", buyer_id) in ids and ("u", seller_id) in ids
+    }
+    return buy_orders, sell_orders, banned_pairs
+
+
+def record_book(description, params, solvers):
+    buy_orders, sell_orders, banned_pairs = params
+    results, stats, _seconds, _peak = measure(params, REFERENCE_SOLVER)
+
+    budgets = {}
+    for solver in solvers:
+        _results, solver_stats, seconds, peak = measure(params, solver)
+        if solver_stats["matches"] != stats["matches"] or not math.isclose(
+            solver_stats["cost"], stats["cost"]
+        ):
+            raise ValueError(f"{solver} does not find an optimal first matching")
+        budgets[solver] = {
+            "seconds": round(max(seconds * TIME_BUDGET_FACTOR, MIN_TIME_BUDGET), 2),
+            "peak_memory_bytes": math.ceil(peak * MEMORY_BUDGET_FACTOR),
+        }
+        print(
+            f"{description:>40} {solver:>10} {seconds:>8.3f}s {peak / 2 ** 20:>7.1f} MiB"
+        )
+
+    return {
+        "description": description,
+        # [id, user_id, number_of_shares, price]
+        "buy_orders": [
+            [o["id"], o["user_id"], o["number_of_shares"], o["price"]]
+            for o in buy_orders
+        ],
+        "sell_orders": [
+            [o["id"], o["user_id"], o["number_of_shares"], o["price"]]
+            for o in sell_orders
+        ],
+        "banned_pairs": sorted(banned_pairs),
+        "expected": {
+            "matches": sorted(results),
+            "first_matching": {"matches": stats["matches"], "cost": stats["cost"]},
+        },
+        "budgets": budgets,
+    }
+
+
+def get_db_books(number_of_rounds):
+    from benchmarks.what_if import load_rounds
+
+    for round in load_rounds(number_of_rounds):
+        for security_id, (buy_orders, sell_orders) in round["securities"].items():
+            sell_orders = list(
+                chain.from_iterable(
+                    [order, order]
+                    if round["seller_counts"][order["user_id"]] == 1
+                    else [order]
+                    for order in sell_orders
+                )
+            )
+            name = f"round_{round['end_time']:%Y%m%d}_{security_id[:8]}"
+            yield name, anonymize(buy_orders, sell_orders, round["banned_pairs"])
+
+
+def write_book(name, book):
+    CORPUS_DIR.mkdir(exist_ok=True)
+    with open(CORPUS_DIR / f"{name}.json", "w") as f:
+        json.dump(book, f, separators=(",", ":"))
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--from-db",
+        type=int,
+        metavar="ROUNDS",
+        help="record the latest concluded rounds instead of generated books",
+    )
+    args = parser.parse_args()
+
+    if args.from_db:
+        for name, params in get_db_books(args.from_db):
+            write_book(name, record_book(name, params, DB_BOOK_SOLVERS))
+        return
+
+    for name, (scenario, solvers) in BOOKS.items():
+        scenario = {**DEFAULT_SCENARIO, **scenario}
+        params = anonymize(*generate_round(**scenario))
+        write_book(name, record_book(name, params, solvers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+What-if simulator, which replays past rounds through the matching engine under other
+parameters.
+
+The orders of every concluded round, and the bans, are loaded once. For each combination of
+round start cutoffs, the orders are replayed in the order they were placed: a round starts
+when the sell orders placed since the last round reach a cutoff, and orders placed while it is
+open join it, so the cutoffs change which rounds there are and which orders they hold. Each
+distinct replayed round is then matched in a worker process under every combination of the
+parameters that change matching: the weight of prices in the cost of a pair, the doubling of the
+sell orders of sellers with a single sell order, and the solver. Replayed rounds that several
+cutoff combinations share are only matched once, and the results are summed per combination
+as array operations.
+
+For each configuration, reports the number of rounds that would have started, the fraction of
+buy orders that are matched, the mean price spread of matches (buy price minus sell price) and
+the total solve time.
+
+Orders are replayed whether or not their users can currently buy or sell, since past approvals
+are not stored, and as they were last edited, since edits are not stored either. Users are
+assumed to have placed the same orders whenever rounds started. Replayed rounds that would not
+have ended by the end of the latest round are left out. Requires NumPy.
+
+Usage: env PYTHONPATH=. python benchmarks/what_if.py [--output what_if.json] [--workers 4]
+[--rounds 10]
+"""
+import argparse
+import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, product, repeat
+from time import perf_counter
+
+import numpy as np
+
+from src.config import APP_CONFIG
+from src.database import BannedPair, BuyOrder, Round, SellOrder, session_scope
+from src.match import PRICE_COST_WEIGHT, match_buyers_and_sellers
+
+CURRENT_CONFIGURATION = {
+    "number_of_sellers_cutoff": APP_CONFIG[
+        "ACQUITY_ROUND_START_NUMBER_OF_SELLERS_CUTOFF"
+    ],
+    "total_sell_shares_cutoff": APP_CONFIG[
+        "ACQUITY_ROUND_START_TOTAL_SELL_SHARES_CUTOFF"
+    ],
+    "price_weight": PRICE_COST_WEIGHT,
+    "double_single_sell_orders": True,
+    "solver": APP_CONFIG["ACQUITY_MATCH_SOLVER"],
+}
+
+SWEEP = {
+    "number_of_sellers_cutoff": [1, 2, 3, 5, 10],
+    "total_sell_shares_cutoff": [500, 1000, 2000, 5000],
+    "price_weight": [0.5, 1, 2, 4, 8],
+    "double_single_sell_orders": [True, False],
+    "solver": [APP_CONFIG["ACQUITY_MATCH_SOLVER"]],
+}
+
+# Parameters that change how a round is matched, as opposed to whether it starts
+MATCHING_PARAMETERS = ("price_weight", "double_single_sell_orders", "solver")
+CUTOFF_PARAMETERS = ("number_of_sellers_cutoff", "total_sell_shares_cutoff")
+
+STATISTICS = ("buy_orders", "matched_buy_orders", "matches", "price_spread", "seconds")
+
+
+def load_bans():
+    """
+    Returns:
+    List of (buyer ID, seller ID, time of the ban).
+    """
+    with session_scope() as session:
+        return [
+            (str(buyer_id), str(seller_id), created_at)
+            for buyer_id, seller_id, created_at in session.query(
+                BannedPair.buyer_id, BannedPair.seller_id, BannedPair.created_at
+            )
+        ]
+
+
+def load_rounds(limit=None, bans=None):
+    """
+    Params:
+    bans: result of load_bans, which is called if None
+
+    Returns:
+    List of the concluded rounds, latest first, as dicts of
+    id, end_time,
+    securities: dict of security ID to (buy_orders, sell_orders), as lists of order dicts with
+    the time they were placed as created_at
+    banned_pairs: set of (buyer ID, seller ID) banned before the round ended
+    seller_counts: Counter of user ID to number of sell orders in the round
+    """
+    if bans is None:
+        bans = load_bans()
+    with session_scope() as session:
+        query = (
+            session.query(Round)
+            .filter_by(is_concluded=True)
+            .order_by(Round.end_time.desc())
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        rounds = [
+            {"id": str(round.id), "end_time": round.end_time, "securities": {}}
+            for round in query
+        ]
+
+        for round in rounds:
+            for side, model in enumerate((BuyOrder, SellOrder)):
+                orders = session.query(
+                    model.id,
+                    model.user_id,
+                    model.price,
+                    model.number_of_shares,
+                    model.security_id,
+                    model.created_at,
+                ).filter(model.round_id == round["id"])
+                for id, user_id, price, shares, security_id, created_at in orders:
+                    round["securities"].setdefault(str(security_id), ([], []))[
+                        side
+                    ].append(
+                        {
+                            "id": str(id),
+                            "user_id": str(user_id),
+                            "price": price,
+                            "number_of_shares": shares,
+                            "created_at": created_at,
+                        }
+                    )
+            add_round_users(round, bans)
+    return rounds
+
+
+def add_round_users(round, bans):
+    """
+    Adds the seller counts and the banned pairs of a round, as in load_rounds, from its orders
+    and end time.
+    """
+    buy_orders, sell_orders = (
+        (
+            list(chain.from_iterable(orders))
+            for orders in zip(*round["securities"].values())
+        )
+        if round["securities"]
+        else ([], [])
+    )
+    buyer_ids = {order["user_id"] for order in buy_orders}
+    round["seller_counts"] = Counter(order["user_id"] for order in sell_orders)
+    round["banned_pairs"] = {
+        (buyer_id, seller_id)
+        for buyer_id, seller_id, created_at in bans
+        if created_at <= round["end_time"]
+        and buyer_id in buyer_ids
+        and seller_id in round["seller_counts"]
+    }
+
+
+def replay_rounds(rounds, bans, number_of_sellers_cutoff, total_sell_shares_cutoff):
+    """
+    Replays the orders of rounds in the order they were placed. Like
+    RoundService.should_round_start, a round starts when a sell order is placed and the sell
+    orders waiting for a round come from at least number_of_sellers_cutoff sellers, or add up to
+    at least total_sell_shares_cutoff shares. It ends ACQUITY_ROUND_LENGTH later.
+
+    Returns:
+    List of the replayed rounds that ended by the end of the latest round, in the format of
+    load_rounds. Their IDs are the time they ended followed by the sorted IDs of their orders,
+    which are the same for the same round replayed under other cutoffs.
+    """
+    orders = sorted(
+        (
+            (order["created_at"], side, security_id, order)
+            for round in rounds
+            for security_id, books in round["securities"].items()
+            for side, book in enumerate(books)
+            for order in book
+        ),
+        key=lambda item: item[0],
+    )
+    last_end_time = max(round["end_time"] for round in rounds)
+
+    replayed = []
+    waiting = []
+    waiting_sellers = set()
+    waiting_shares = 0
+    round = None
+    for created_at, side, security_id, order in orders:
+        if round is not None and created_at >= round["end_time"]:
+            replayed.append(round)
+            round = None
+        if round is not None:
+            round["securities"].setdefault(security_id, ([], []))[side].append(order)
+            continue
+
+        waiting.append((side, security_id, order))
+        if side == 0:
+            continue
+        waiting_sellers.add(order["user_id"])
+        waiting_shares += order["number_of_shares"]
+        if (
+            len(waiting_sellers) >= number_of_sellers_cutoff
+            or waiting_shares >= total_sell_shares_cutoff
+        ):
+            round = {
+                "end_time": created_at + APP_CONFIG["ACQUITY_ROUND_LENGTH"],
+                "securities": {},
+            }
+            for waiting_side, waiting_security_id, waiting_order in waiting:
+                round["securities"].setdefault(waiting_security_id, ([], []))[
+                    waiting_side
+                ].append(waiting_order)
+            waiting = []
+            waiting_sellers = set()
+            waiting_shares = 0
+    if round is not None and round["end_time"] <= last_end_time:
+        replayed.append(round)
+
+    for round in replayed:
+        add_round_users(round, bans)
+        round["id"] = (
+            round["end_time"],
+            tuple(
+                sorted(
+                    order["id"]
+                    for books in round["securities"].values()
+                    for book in books
+                    for order in book
+                )
+            ),
+        )
+    return replayed
+
+
+def simulate_round(round, matching_configurations):
+    """
+    Matches every security of a round under each matching configuration.
+
+    Returns:
+    List of Counters of STATISTICS, one per matching configuration.
+    """
+    results = []
+    for configuration in matching_configurations:
+        stats = Counter()
+        for buy_orders, sell_orders in round["securities"].values():
+            if configuration["double_single_sell_orders"]:
+                sell_orders = list(
+                    chain.from_iterable(
+                        [order, order]
+                        if round["seller_counts"][order["user_id"]] == 1
+                        else [order]
+                        for order in sell_orders
+                    )
+                )
+
+            start = perf_counter()
+            matches = match_buyers_and_sellers(
+                buy_orders,
+                sell_orders,
+                round["banned_pairs"],
+                solver=configuration["solver"],
+                price_weight=configuration["price_weight"],
+            )
+            stats["seconds"] += perf_counter() - start
+
+            prices = {
+                order["id"]: order["price"] for order in chain(buy_orders, sell_orders)
+            }
+            stats["buy_orders"] += len(buy_orders)
+            stats["matched_buy_orders"] += len({buy_order for buy_order, _ in matches})
+            stats["matches"] += len(matches)
+            stats["price_spread"] += sum(
+                prices[buy_order] - prices[sell_order]
+                for buy_order, sell_order in matches
+            )
+        results.append(stats)
+    return results
+
+
+def sweep(rounds, bans, max_workers):
+    """
+    Returns:
+    List of dicts with a configuration of SWEEP and its statistics over the rounds replayed
+    under its cutoffs.
+    """
+    matching_configurations = [
+        dict(zip(MATCHING_PARAMETERS, values))
+        for values in product(*(SWEEP[p] for p in MATCHING_PARAMETERS))
+    ]
+    cutoff_configurations = [
+        dict(zip(CUTOFF_PARAMETERS, values))
+        for values in product(*(SWEEP[p] for p in CUTOFF_PARAMETERS))
+    ]
+
+    replayed_rounds = [
+        replay_rounds(rounds, bans, **cutoff_configuration)
+        for cutoff_configuration in cutoff_configurations
+    ]
+    distinct_rounds = {
+        round["id"]: round for replayed in replayed_rounds for round in replayed
+    }
+    round_indexes = {id: i for i, id in enumerate(distinct_rounds)}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        round_results = list(
+            executor.map(
+                simulate_round,
+                distinct_rounds.values(),
+                repeat(matching_configurations),
+            )
+        )
+
+    # distinct rounds x matching configurations x statistics
+    totals = np.array(
+        [
+            [[stats[name] for name in STATISTICS] for stats in results]
+            for results in round_results
+        ],
+        dtype=float,
+    ).reshape(len(distinct_rounds), len(matching_configurations), len(STATISTICS))
+
+    # cutoff configurations x distinct rounds
+    started = np.zeros((len(cutoff_configurations), len(distinct_rounds)), dtype=bool)
+    for c, replayed in enumerate(replayed_rounds):
+        started[c, [round_indexes[round["id"]] for round in replayed]] = True
+
+    # cutoff configurations x matching configurations x statistics
+    summed = np.einsum("cr,rms->cms", started.astype(float), totals)
+
+    results = []
+    for c, cutoff_configuration in enumerate(cutoff_configurations):
+        for m, matching_configuration in enumerate(matching_configurations):
+            buy_orders, matched_buy_orders, matches, price_spread, seconds = summed[
+                c, m
+            ]
+            configuration = {**cutoff_configuration, **matching_configuration}
+            results.append(
+                {
+                    "configuration": configuration,
+                    "is_current": configuration == CURRENT_CONFIGURATION,
+                    "rounds_started": int(started[c].sum()),
+                    "match_rate": matched_buy_orders / buy_orders if buy_orders else 0,
+                    "mean_price_spread": price_spread / matches if matches else 0,
+                    "solve_seconds": seconds,
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default="what_if.json")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rounds", type=int, default=None, help="latest rounds only")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    bans = load_bans()
+    rounds = load_rounds(args.rounds, bans)
+    print(f"Loaded {len(rounds)} rounds in {perf_counter() - start:.1f}s")
+    if not rounds:
+        return
+
+    start = perf_counter()
+    results = sweep(rounds, bans, args.workers)
+    print(f"Simulated {len(results)} configurations in {perf_counter() - start:.1f}s")
+
+    print(
+        f"{'sellers':>7} {'shares':>7} {'weight':>6} {'double':>6} {'solver':>10} "
+        f"{'rounds':>6} {'match rate':>10} {'spread':>8} {'solve (s)':>9}"
+    )
+    for result in results:
+        configuration = result["configuration"]
+        print(
+            f"{configuration['number_of_sellers_cutoff']:>7} "
+            f"{configuration['total_sell_shares_cutoff']:>7} "
+            f"{configuration['price_weight']:>6} "
+            f"{str(configuration['double_single_sell_orders']):>6} "
+            f"{configuration['solver']:>10} {result['rounds_started']:>6} "
+            f"{result['match_rate']:>10.3f} {result['mean_price_spread']:>8.3f} "
+            f"{result['solve_seconds']:>9.3f}" + (" *" if result["is_current"] else "")
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
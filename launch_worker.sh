@@ -0,0 +1,6 @@
+#!/usr/bin/env bash
+if [ "$NO_POETRY" = "1" ]; then
+  python src/match_worker.py
+else
+  env PYTHONPATH=. poetry run python src/match_worker.py
+fi
@@ -1,4 +1,4 @@
-from functools import wraps
+from functools import partial, wraps
 
 from sanic import Blueprint
 from sanic.response import json
@@ -160,6 +160,46 @@ async def get_previous_round(request, security_id):
     )
 
 
+@blueprint.get("/round/active/preview")
+@auth_required
+async def preview_matches(request, user):
+    # Matching can take a while, so it runs outside of the event loop
+    return json(
+        await request.app.loop.run_in_executor(
+            None,
+            partial(request.app.match_service.preview_matches, subject_id=user["id"]),
+        )
+    )
+
+
+@blueprint.get("/round/<round_id>/match_job")
+@auth_required
+async def get_match_job(request, user, round_id):
+    return json(
+        request.app.match_job_service.get_job(round_id=round_id, subject_id=user["id"])
+    )
+
+
+@blueprint.post("/round/<round_id>/match_job")
+@auth_required
+async def resubmit_match_job(request, user, round_id):
+    return json(
+        request.app.match_job_service.resubmit_job(
+            round_id=round_id, subject_id=user["id"]
+        )
+    )
+
+
+@blueprint.delete("/round/<round_id>/match_job")
+@auth_required
+async def cancel_match_job(request, user, round_id):
+    return json(
+        request.app.match_job_service.cancel_job(
+            round_id=round_id, subject_id=user["id"]
+        )
+    )
+
+
 @blueprint.post("/ban/")
 @auth_required
 @expects_json_object
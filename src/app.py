@@ -20,6 +20,7 @@ from src.services import (
     ChatRoomService,
     ChatService,
     LinkedInLogin,
+    MatchJobService,
     MatchService,
     RoundService,
     SecurityService,
@@ -56,6 +57,7 @@ app.buy_order_service = BuyOrderService(app.config)
 app.security_service = SecurityService(app.config)
 app.round_service = RoundService(app.config)
 app.match_service = MatchService(app.config)
+app.match_job_service = MatchJobService(app.config)
 app.banned_pair_service = BannedPairService(app.config)
 app.chat_room_service = ChatRoomService(app.config)
 app.chat_service = ChatService(app.config)
@@ -92,5 +94,10 @@ async def start_scheduler(app, loop):
     scheduler.start()
 
 
+@app.listener("after_server_stop")
+async def stop_match_service(app, loop):
+    app.match_service.shutdown()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=app.config["PORT"])
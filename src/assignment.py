@@ -0,0 +1,69 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def linear_sum_assignment(cost):
+    """
+    Solves the rectangular linear assignment problem with the shortest augmenting path
+    (Hungarian / Jonker-Volgenant) algorithm.
+
+    Params:
+    cost: n x m NumPy array, with n <= m
+
+    Returns:
+    List of (row, column) pairs, one for every row, such that no column is used twice and the
+    total cost is minimal.
+    """
+    if np is None:
+        raise RuntimeError("The assignment solver requires NumPy")
+
+    n, m = cost.shape
+    if n > m:
+        return [(r, c) for c, r in linear_sum_assignment(cost.T)]
+
+    # Potentials of rows and columns. Column 0 is a dummy column used to start each search,
+    # so rows and columns are numbered from 1.
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # row_of[j] is the row assigned to column j, or 0 if the column is free
+    row_of = np.zeros(m + 1, dtype=np.intp)
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for i in range(1, n + 1):
+        row_of[0] = i
+        j0 = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        # Grow a tree of tight edges from row i until it reaches a free column
+        while True:
+            used[j0] = True
+            i0 = row_of[j0]
+            free = ~used[1:]
+            slack = cost[i0 - 1] - u[i0] - v[1:]
+            improved = free & (slack < min_slack[1:])
+            min_slack[1:][improved] = slack[improved]
+            way[1:][improved] = j0
+
+            candidates = np.where(free, min_slack[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            used_columns = np.nonzero(used)[0]
+            u[row_of[used_columns]] += delta
+            v[used_columns] -= delta
+            min_slack[1:][free] -= delta
+
+            j0 = j1
+            if row_of[j0] == 0:
+                break
+
+        # Flip the augmenting path
+        while j0 != 0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+
+    return [(int(row_of[j]) - 1, j - 1) for j in range(1, m + 1) if row_of[j] != 0]
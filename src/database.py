@@ -8,6 +8,8 @@ from sqlalchemy import (
     Enum,
     Float,
     ForeignKey,
+    Index,
+    Integer,
     String,
     Text,
     UniqueConstraint,
@@ -154,6 +156,61 @@ class Match(Base):
     buy_order = relationship("BuyOrder", back_populates="matches")
     sell_order = relationship("SellOrder", back_populates="matches")
 
+    __table_args__ = (UniqueConstraint("buy_order_id", "sell_order_id"),)
+
+
+class MatchJob(Base):
+    __tablename__ = "match_jobs"
+
+    round_id = Column(UUID, ForeignKey("rounds.id"), nullable=False)
+    run_at = Column(DateTime(timezone=True), nullable=False)
+    status = Column(
+        Enum(
+            "PENDING",
+            "RUNNING",
+            "DONE",
+            "FAILED",
+            "CANCELLED",
+            name="match_job_statuses",
+        ),
+        nullable=False,
+        server_default="PENDING",
+    )
+    phase = Column(String)
+    progress = Column(Float, nullable=False, server_default="0")
+    is_cancel_requested = Column(Boolean, nullable=False, server_default="f")
+    # Number of runs that failed. A failed run is retried until ACQUITY_MATCH_JOB_MAX_ATTEMPTS.
+    attempts = Column(Integer, nullable=False, server_default="0")
+    error = Column(Text)
+    # JSON of the metrics returned by MatchService.run_matches
+    metrics = Column(Text)
+
+
+class MatchResultCache(Base):
+    __tablename__ = "match_result_cache"
+
+    key = Column(String, nullable=False, unique=True)
+    results = Column(Text, nullable=False)
+
+
+# Provisional match results of one security of an open round (see src/provisional_match.py).
+# Version is bumped whenever the orders of the security change, and the match worker refreshes
+# the results until refreshed_version catches up. Fingerprint is the hash of the matching params
+# the results were computed from, and warm_start the state of the MinCostMatching that computed
+# them, as JSON.
+class ProvisionalMatch(Base):
+    __tablename__ = "provisional_matches"
+
+    round_id = Column(UUID, ForeignKey("rounds.id"), nullable=False)
+    security_id = Column(UUID, ForeignKey("securities.id"), nullable=False)
+    version = Column(Integer, nullable=False, server_default="1")
+    refreshed_version = Column(Integer)
+    fingerprint = Column(String)
+    results = Column(Text)
+    warm_start = Column(Text)
+
+    __table_args__ = (UniqueConstraint("round_id", "security_id"),)
+
 
 class Round(Base):
     __tablename__ = "rounds"
@@ -165,6 +222,34 @@ class Round(Base):
     sell_orders = relationship("SellOrder", back_populates="round")
 
 
+# Stages of closing a round, in order
+ROUND_CLOSE_STAGES = ("LOADED", "MATCHED", "PERSISTED", "NOTIFIED")
+
+
+# Last completed stage of closing a round, for one of its securities, or for the round as a
+# whole if security_id is null. Results are the match results of the security, as JSON, once it
+# is matched.
+class RoundCloseCheckpoint(Base):
+    __tablename__ = "round_close_checkpoints"
+
+    round_id = Column(UUID, ForeignKey("rounds.id"), nullable=False)
+    security_id = Column(UUID, ForeignKey("securities.id"))
+    stage = Column(Enum(*ROUND_CLOSE_STAGES, name="round_close_stages"), nullable=False)
+    results = Column(Text)
+
+    __table_args__ = (
+        UniqueConstraint("round_id", "security_id"),
+        # Nulls are distinct in the constraint above, so the checkpoint of the round as a whole
+        # needs its own index
+        Index(
+            "ix_round_close_checkpoints_round_id_round",
+            "round_id",
+            unique=True,
+            postgresql_where=security_id.is_(None),
+        ),
+    )
+
+
 class BannedPair(Base):
     __tablename__ = "banned_pairs"
 
@@ -222,7 +307,8 @@ class UserRequest(Base):
     closed_by_user_id = Column(UUID, ForeignKey("users.id"))
 
 
-engine = create_engine(APP_CONFIG["DATABASE_URL"])
+# Bulk inserts with many rows are sent as multi-row INSERTs through psycopg2's execute_values
+engine = create_engine(APP_CONFIG["DATABASE_URL"], executemany_mode="values")
 
 
 Session = sessionmaker(bind=engine)
@@ -1,131 +1,1009 @@
-from copy import deepcopy
+import multiprocessing
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from heapq import merge
+from itertools import chain, repeat
+from time import perf_counter, time
 
 import networkx as nx
 from networkx.algorithms.matching import max_weight_matching
 
+from src.assignment import linear_sum_assignment
+from src.min_cost_flow import solve_with_min_cost_flow
+from src.order_book import BannedPairIndex, EdgeList, OrderBook, unpack_user_pair
 
-def match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches):
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Cost of a price difference of 1 between a buy and a sell order, per share of the largest order
+# of the round. With more than 1, matching orders of close prices always comes before matching
+# orders of close sizes. See get_costs.
+PRICE_COST_WEIGHT = 2
+
+# Components with fewer edges than this are solved in the calling process, since sending them
+# to a worker process costs more than solving them
+PARALLEL_COMPONENT_MIN_EDGES = 1000
+
+# With the "auto" solver, rounds whose largest component has at most this many edges are solved
+# with networkx, which takes up to about a second
+AUTO_NETWORKX_MAX_EDGES = 5000
+# With the "auto" solver, rounds whose largest component has at most this many buy orders times
+# sell orders are solved with the assignment solver, i.e. up to 128 MiB of cost matrix
+AUTO_ASSIGNMENT_MAX_CELLS = 4000 * 4000
+
+# Number of sell order x buy order cells compared at a time when building the graph, which
+# bounds the memory of the temporary arrays on dense rounds
+EDGE_BLOCK_CELLS = 1 << 22
+
+# Number of edges sorted by cost that are turned into Python ints at a time by solve_greedily
+GREEDY_BLOCK_EDGES = 1 << 16
+
+
+def match_buyers_and_sellers(
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    solver="networkx",
+    max_workers=1,
+    deadline=None,
+    warm_start=None,
+    stats=None,
+    price_weight=PRICE_COST_WEIGHT,
+):
     """
     The matching algorithm.
 
     Currently, this operates on the assumption that all securities passed in are the same.
 
     Params:
-    buy_orders: e.g. [{'id': 'UUID', 'user_id': 'UUID', 'security_id': 'UUID',
-                       'number_of_shares': 20.0, 'price': 30.0}]
-    sell_orders: e.g. [{'id': 'UUID', 'user_id': 'UUID', 'security_id': 'UUID',
-                        'number_of_shares': 20.0, 'price': 30.0}]
-    banned_user_matches: users that cannot be matched together. Pass in enumerable of pairs.
+    buy_orders: OrderBook, or list of dicts e.g.
+                [{'id': 'UUID', 'user_id': 'UUID', 'number_of_shares': 20.0, 'price': 30.0}]
+    sell_orders: OrderBook sharing its users with buy_orders, or list of dicts e.g.
+                 [{'id': 'UUID', 'user_id': 'UUID', 'number_of_shares': 20.0, 'price': 30.0}]
+    banned_user_matches: users that cannot be matched together. Pass in a BannedPairIndex on
+    the order books' users, or enumerable of pairs.
     e.g. set(('buyer_uuid', 'seller_uuid'), ('buyer2_uuid', 'seller2_uuid'))
+    solver: name of the algorithm used for the first matching, one of SOLVERS, or "auto" to
+    choose it from the size of the round. See choose_solver.
+    max_workers: number of processes used to solve large independent components in parallel.
+    deadline: optional time.time() timestamp by which the first matching must be done. Every
+    component is first matched greedily, then solved exactly, smallest first, until the
+    deadline. Components that are not solved in time keep their greedy matching.
+    warm_start: optional MinCostMatching. The first matching is solved with it, starting from
+    the matching of its previous solve if any, so that only the orders and pairs that changed
+    since are repaired. It is left holding the new matching. Takes precedence over solver and
+    deadline.
+    stats: optional dict, filled with how far the first matching may be from the optimum (see
+    get_first_matching_stats), and the solver that was used along with the reasons for it. Also
+    filled with the size of the order books and of the graph (nodes and edges), the counters of
+    distribute_remaining_buyers, and under "seconds" the time spent in each phase: order_books,
+    graph_build, solve and distribute. Phases are not timed without stats.
+    price_weight: how much price differences weigh against differences in number of shares in
+    the cost of a pair. See PRICE_COST_WEIGHT.
 
     Returns:
     Set of pairs of order IDs as matches.
     e.g. set(('buy_order_uuid', 'sell_order_uuid'),
              ('buy_order2_uuid', 'sell_order2_uuid'))
     """
+    check_solver(solver)
 
-    max_number_of_shares = max(
-        [o["number_of_shares"] for o in buy_orders + sell_orders]
-    )
-    buy_orders_copy = deepcopy(buy_orders)
-    sell_orders_copy = deepcopy(sell_orders)
+    with timed(stats, "order_books"):
+        buy_orders, sell_orders = get_order_books(buy_orders, sell_orders)
+        banned_user_matches = get_banned_pair_index(
+            buy_orders.users, banned_user_matches
+        )
+        max_number_of_shares = max(
+            chain(buy_orders.number_of_shares, sell_orders.number_of_shares), default=0
+        )
+    if stats is not None:
+        stats.update(buy_orders=len(buy_orders), sell_orders=len(sell_orders))
 
     first_iteration = match_seller_with_nearest_buyer(
-        buy_orders_copy, sell_orders_copy, banned_user_matches, max_number_of_shares
+        buy_orders,
+        sell_orders,
+        banned_user_matches,
+        max_number_of_shares,
+        solver=solver,
+        max_workers=max_workers,
+        deadline=deadline,
+        warm_start=warm_start,
+        stats=stats,
+        price_weight=price_weight,
     )
 
-    matched_buy_order_ids = {
-        buy_order_id for buy_order_id in [p[0] for p in first_iteration]
-    }
-    remaining_buy_orders = []
-    for buy_order in buy_orders_copy:
-        if buy_order["id"] not in matched_buy_order_ids:
-            remaining_buy_orders.append(buy_order)
+    with timed(stats, "distribute"):
+        matched_buy_orders = {buy_order for buy_order, _ in first_iteration}
+        remaining_buy_rows = [
+            row
+            for row in range(len(buy_orders))
+            if buy_orders.order[row] not in matched_buy_orders
+        ]
+        subsequent = distribute_remaining_buyers(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            remaining_buy_rows,
+            stats=stats,
+        )
 
-    subsequent = distribute_remaining_buyers(
-        remaining_buy_orders, sell_orders_copy, banned_user_matches
-    )
+    return get_order_id_pairs(first_iteration | subsequent, buy_orders, sell_orders)
+
+
+def check_solver(solver):
+    """
+    Raises ValueError if the solver does not exist or cannot run here, so that a misconfigured
+    solver fails before any matching work starts.
+    """
+    if solver != "auto" and solver not in SOLVERS:
+        raise ValueError(f"Unknown matching solver {solver}")
+    if solver == "assignment" and np is None:
+        raise ValueError("The assignment solver needs NumPy, which is not installed")
+
+
+def get_order_books(buy_orders, sell_orders):
+    """
+    Converts buy and sell orders given as lists of dicts into OrderBooks sharing their users.
+    """
+    if not isinstance(buy_orders, OrderBook):
+        users = sell_orders.users if isinstance(sell_orders, OrderBook) else None
+        buy_orders = OrderBook.from_dicts(buy_orders, users=users)
+    if not isinstance(sell_orders, OrderBook):
+        sell_orders = OrderBook.from_dicts(sell_orders, users=buy_orders.users)
+    if buy_orders.users is not sell_orders.users:
+        raise ValueError("Buy and sell order books must share their users")
+    return buy_orders, sell_orders
 
-    return first_iteration | subsequent
+
+def get_banned_pair_index(users, banned_user_matches):
+    if not isinstance(banned_user_matches, BannedPairIndex):
+        return BannedPairIndex.from_pairs(users, banned_user_matches)
+    if banned_user_matches.users is not users:
+        raise ValueError("Banned pairs must share their users with the order books")
+    return banned_user_matches
 
 
 def match_seller_with_nearest_buyer(
-    buy_orders, sell_orders, banned_user_matches, max_number_of_shares
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    max_number_of_shares,
+    solver="networkx",
+    max_workers=1,
+    deadline=None,
+    warm_start=None,
+    stats=None,
+    price_weight=PRICE_COST_WEIGHT,
 ):
-    def get_cost(buy_order, sell_order):
-        if buy_order["price"] < sell_order["price"] or (
-            (buy_order["user_id"], sell_order["user_id"]) in banned_user_matches
-        ):
-            return None
-        return abs(
-            buy_order["price"] - sell_order["price"]
-        ) * max_number_of_shares * 2 + abs(
-            buy_order["number_of_shares"] - sell_order["number_of_shares"]
+    with timed(stats, "graph_build"):
+        edges = get_compatible_edges(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            max_number_of_shares,
+            price_weight=price_weight,
         )
+        components = split_into_components(edges)
+    if stats is not None:
+        stats.update(get_graph_stats(edges))
+    number_of_components = len(components)
+
+    with timed(stats, "solve"):
+        if warm_start is not None:
+            result = solve_with_warm_start(warm_start, edges, buy_orders, sell_orders)
+            if stats is not None:
+                stats.update(
+                    get_first_matching_stats(
+                        buy_orders,
+                        sell_orders,
+                        number_of_components,
+                        [],
+                        result,
+                        max_number_of_shares,
+                        price_weight,
+                    ),
+                    solver="warm_start",
+                    solver_reasons=[
+                        f"a warm start was given, so {warm_start.repriced_orders} orders and "
+                        f"{warm_start.repaired_edges} pairs were repaired with "
+                        f"{warm_start.searches} shortest path searches"
+                    ],
+                )
+            return result
+
+        reasons = [f"{solver} was requested"]
+        if solver == "auto":
+            solver, reasons = choose_solver(buy_orders, sell_orders, components)
+
+        if solver == "greedy":
+            # Greedy matchings are handled like components that were not solved in time, so that
+            # they are not reported as optimal
+            solutions = [None] * len(components)
+        elif deadline is None:
+            solutions = solve_components(components, solver, max_workers)
+        else:
+            solutions = solve_components_until(
+                components, solver, deadline, max_workers
+            )
 
+        result = set()
+        greedy_components = []
+        for component, solution in zip(components, solutions):
+            if solution is None:
+                greedy_components.append(component)
+                result |= solve_greedily(component)
+                continue
+            result |= solution
+
+        if stats is not None:
+            stats.update(
+                get_first_matching_stats(
+                    buy_orders,
+                    sell_orders,
+                    number_of_components,
+                    greedy_components,
+                    result,
+                    max_number_of_shares,
+                    price_weight,
+                ),
+                solver=solver,
+                solver_reasons=reasons,
+            )
+
+        return result
+
+
+def choose_solver(buy_orders, sell_orders, components):
+    """
+    Picks the solver for the first matching from the size of the problem: networkx's blossom
+    algorithm while it is cheap, then the bipartite assignment solver while its dense cost
+    matrix fits in memory, then the greedy matching. Without NumPy, the sparse min cost flow
+    solver is used instead of the assignment solver and of the greedy matching, so that the
+    matching stays exact. Only the largest component matters, since components are solved
+    independently.
+
+    Returns:
+    (name of the solver, list of reasons for the choice)
+    """
+    number_of_edges = sum(map(len, components))
+    largest_edges = max(map(len, components), default=0)
+    largest_cells = max(
+        (
+            len({b for b, _, _ in component}) * len({s for _, s, _ in component})
+            for component in components
+        ),
+        default=0,
+    )
+    number_of_pairs = len(buy_orders) * len(sell_orders)
+
+    reasons = [
+        f"{len(buy_orders)} buy orders and {len(sell_orders)} sell orders",
+        f"{number_of_edges} compatible pairs out of {number_of_pairs}",
+        f"{len(components)} components, the largest with {largest_edges} pairs and "
+        f"{largest_cells} cost matrix cells",
+    ]
+
+    if largest_edges <= AUTO_NETWORKX_MAX_EDGES:
+        reasons.append(
+            f"the largest component has at most {AUTO_NETWORKX_MAX_EDGES} pairs, so "
+            "networkx finds the exact matching quickly"
+        )
+        return "networkx", reasons
+
+    if np is None:
+        reasons.append(
+            "the assignment solver needs NumPy, which is not installed, so the min cost flow "
+            "solver finds the exact matching instead"
+        )
+        return "flow", reasons
+
+    if largest_cells <= AUTO_ASSIGNMENT_MAX_CELLS:
+        reasons.append(
+            f"the largest component has at most {AUTO_ASSIGNMENT_MAX_CELLS} cost matrix "
+            "cells, so the assignment solver finds the exact matching in memory"
+        )
+        return "assignment", reasons
+
+    reasons.append(
+        f"the largest component has more than {AUTO_ASSIGNMENT_MAX_CELLS} cost matrix "
+        "cells, too many for the assignment solver"
+    )
+    reasons.append(
+        "the round is too large to be matched exactly, so it is matched greedily"
+    )
+    return "greedy", reasons
+
+
+def get_first_matching_stats(
+    buy_orders,
+    sell_orders,
+    number_of_components,
+    greedy_components,
+    result,
+    max_number_of_shares,
+    price_weight=PRICE_COST_WEIGHT,
+):
+    """
+    Returns a dict describing the first matching:
+    components: number of connected components of the graph
+    greedy_components: number of components that were not solved exactly in time
+    optimal: whether the first matching is known to be optimal
+    matches, cost: size and total cost of the first matching
+    max_matches: upper bound on the size of the optimal first matching. This is the only bound
+    reported for a matching that is not optimal: its cost may be below or above the optimal
+    one, since the optimal matching maximises the number of matches first.
+    """
+    # A greedy component may be missing matches, but has at most one per buy or sell order
+    max_matches = len(result)
+    for component in greedy_components:
+        component_buy_orders = set(component.buy_order)
+        component_matches = sum(
+            1 for buy_order, _ in result if buy_order in component_buy_orders
+        )
+        max_matches += (
+            min(len(component_buy_orders), len(set(component.sell_order)))
+            - component_matches
+        )
+
+    return {
+        "components": number_of_components,
+        "greedy_components": len(greedy_components),
+        "optimal": not greedy_components,
+        "matches": len(result),
+        "max_matches": max_matches,
+        "cost": get_matching_cost(
+            buy_orders, sell_orders, result, max_number_of_shares, price_weight
+        ),
+    }
+
+
+def get_matching_cost(
+    buy_orders, sell_orders, pairs, max_number_of_shares, price_weight=PRICE_COST_WEIGHT
+):
+    """
+    Returns the total cost of the given (buy_order, sell_order) pairs. Costs are computed from
+    the order books rather than looked up in the edges, which are many more than the pairs.
+    """
+    buy_rows = get_order_rows(buy_orders, {buy_order for buy_order, _ in pairs})
+    sell_rows = get_order_rows(sell_orders, {sell_order for _, sell_order in pairs})
+    return sum(
+        abs(
+            buy_orders.price[buy_rows[buy_order]]
+            - sell_orders.price[sell_rows[sell_order]]
+        )
+        * max_number_of_shares
+        * price_weight
+        + abs(
+            buy_orders.number_of_shares[buy_rows[buy_order]]
+            - sell_orders.number_of_shares[sell_rows[sell_order]]
+        )
+        for buy_order, sell_order in pairs
+    )
+
+
+def get_order_rows(book, orders):
+    """
+    Returns dict of order number to the first row of that order in the order book, for the
+    given order numbers.
+    """
+    rows = {}
+    for row, order in enumerate(book.order):
+        if order in orders and order not in rows:
+            rows[order] = row
+    return rows
+
+
+def get_graph_stats(edges):
+    """
+    Returns a dict with the number of orders (nodes) and compatible pairs (edges) of the
+    matching graph. Orders are counted with NumPy if it is available.
+    """
+    if np is None:
+        nodes = len(set(edges.buy_order)) + len(set(edges.sell_order))
+    else:
+        nodes = sum(
+            len(np.unique(np.frombuffer(column, dtype=np.intc)))
+            for column in (edges.buy_order, edges.sell_order)
+        )
+    return {"nodes": nodes, "edges": len(edges)}
+
+
+@contextmanager
+def timed(stats, phase):
+    """
+    Adds the time spent in the block to stats["seconds"][phase]. Does nothing when stats is None,
+    so that instrumentation costs nothing unless it is asked for.
+    """
+    if stats is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = stats.setdefault("seconds", {})
+        seconds[phase] = seconds.get(phase, 0) + perf_counter() - start
+
+
+def solve_with_warm_start(warm_start, edges, buy_orders, sell_orders):
+    """
+    Solves the first matching with a MinCostMatching. Orders are given to it by ID, since
+    order numbers are not stable across order books.
+    """
+    buy_ids = buy_orders.orders.ids
+    sell_ids = sell_orders.orders.ids
+    matching = warm_start.solve(
+        (buy_ids[buy_order], sell_ids[sell_order], cost)
+        for buy_order, sell_order, cost in edges
+    )
+    return {
+        (buy_orders.orders.numbers[buy_id], sell_orders.orders.numbers[sell_id])
+        for buy_id, sell_id in matching
+    }
+
+
+def solve_components(components, solver, max_workers=1):
+    """
+    Returns the solution of each component, in the same order.
+    """
+    parallel_components = []
+    if max_workers > 1:
+        parallel_components = [
+            i
+            for i, c in enumerate(components)
+            if len(c) >= PARALLEL_COMPONENT_MIN_EDGES
+        ]
+    if len(parallel_components) < 2:
+        return [SOLVERS[solver](component) for component in components]
+
+    solutions = [None] * len(components)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            i: executor.submit(SOLVERS[solver], components[i])
+            for i in parallel_components
+        }
+        for i, component in enumerate(components):
+            if i not in futures:
+                solutions[i] = SOLVERS[solver](component)
+        for i, future in futures.items():
+            solutions[i] = future.result()
+    return solutions
+
+
+def solve_components_until(components, solver, deadline, max_workers=1):
+    """
+    Same as solve_components, but stops at the deadline. Components are solved smallest first
+    in worker processes, which are killed at the deadline, so a huge component cannot hold up
+    the others or the caller.
+
+    Returns:
+    The solution of each component, in the same order, or None for the components that were
+    not solved in time.
+    """
+    solutions = [None] * len(components)
+    if not components or deadline <= time():
+        return solutions
+
+    by_size = sorted(range(len(components)), key=lambda i: len(components[i]))
+    pool = multiprocessing.Pool(max(1, max_workers))
+    try:
+        results = [
+            (i, pool.apply_async(SOLVERS[solver], (components[i],))) for i in by_size
+        ]
+        for i, async_result in results:
+            try:
+                solutions[i] = async_result.get(timeout=max(0, deadline - time()))
+            except multiprocessing.TimeoutError:
+                break
+        # With several workers, larger components may have finished before a smaller one
+        for i, async_result in results:
+            if solutions[i] is None and async_result.ready():
+                solutions[i] = async_result.get()
+    finally:
+        pool.terminate()
+
+    return solutions
+
+
+def solve_greedily(edges):
+    """
+    Matches the cheapest pairs first, i.e. the nearest prices, then the nearest numbers of
+    shares. Fast, but neither the number of matches nor their total cost is optimal.
+
+    Params and Returns: same as solve_with_networkx
+    """
+    edges = as_edge_list(edges)
+    max_matches = min(len(set(edges.buy_order)), len(set(edges.sell_order)))
+
+    result = set()
+    matched_buy_orders = set()
+    matched_sell_orders = set()
+    for i in get_indexes_by_cost(edges):
+        buy_order = edges.buy_order[i]
+        sell_order = edges.sell_order[i]
+        if buy_order in matched_buy_orders or sell_order in matched_sell_orders:
+            continue
+        result.add((buy_order, sell_order))
+        matched_buy_orders.add(buy_order)
+        matched_sell_orders.add(sell_order)
+        if len(result) == max_matches:
+            break
+
+    return result
+
+
+def get_indexes_by_cost(edges):
+    """
+    Yields the indexes of the edges from the cheapest to the most expensive. Ties keep their
+    order in the edge list.
+    """
+    if np is None:
+        yield from sorted(range(len(edges)), key=edges.cost.__getitem__)
+        return
+
+    order = np.argsort(np.frombuffer(edges.cost, dtype=float), kind="stable")
+    for start in range(0, len(order), GREEDY_BLOCK_EDGES):
+        yield from order[start : start + GREEDY_BLOCK_EDGES].tolist()
+
+
+def get_order_id_pairs(pairs, buy_orders, sell_orders):
+    return {
+        (buy_orders.orders.ids[buy_order], sell_orders.orders.ids[sell_order])
+        for buy_order, sell_order in pairs
+    }
+
+
+def split_into_components(edges):
+    """
+    Groups edges by the connected component of the matching graph they belong to. No order can
+    be matched across components, so each of them can be solved on its own.
+
+    Params:
+    edges: EdgeList, or list of (buy_order, sell_order, cost) where orders are numbers in their
+    order books.
+
+    Returns:
+    List of EdgeLists. Edges keep their relative order within each component. A graph with a
+    single component is returned as is, without copying its edges.
+    """
+    edges = as_edge_list(edges)
+    buy_nodes = {}
+    sell_nodes = {}
+    parent = []
+
+    def get_node(nodes, order):
+        node = nodes.get(order)
+        if node is None:
+            node = nodes[order] = len(parent)
+            parent.append(node)
+        return node
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for buy_order, sell_order in zip(edges.buy_order, edges.sell_order):
+        buy_node = get_node(buy_nodes, buy_order)
+        sell_node = get_node(sell_nodes, sell_order)
+        parent[find(buy_node)] = find(sell_node)
+
+    roots = {buy_order: find(node) for buy_order, node in buy_nodes.items()}
+    if len(set(roots.values())) <= 1:
+        return [edges] if edges else []
+
+    indexes = defaultdict(lambda: array("q"))
+    for i, buy_order in enumerate(edges.buy_order):
+        indexes[roots[buy_order]].append(i)
+
+    return [edges.take(component) for component in indexes.values()]
+
+
+def solve_with_networkx(edges):
+    """
+    Maximum cardinality, minimum cost matching using networkx's general graph (blossom)
+    algorithm.
+
+    Params:
+    edges: EdgeList, or list of (buy_order, sell_order, cost) where orders are numbers in their
+    order books. A later edge between the same pair of orders replaces an earlier one. The
+    networkx graph is only built here, from the edges.
+
+    Returns:
+    Set of (buy_order, sell_order) pairs.
+    """
+    # Buy and sell orders are numbered separately, so sell orders are stored as negative nodes.
+    # Invert the cost, since the algorithm computes the maximum total instead of the minimum.
     graph = nx.Graph()
-    for sell_order in sell_orders:
-        for buy_order in buy_orders:
-            cost = get_cost(buy_order, sell_order)
-            if cost is not None:
-                # Invert the cost, since the algorithm computes the maximum total instead of the
-                # minimum
-                graph.add_edge(buy_order["id"], sell_order["id"], weight=-cost)
+    graph.add_weighted_edges_from(
+        (buy_order, ~sell_order, -cost) for buy_order, sell_order, cost in edges
+    )
 
     matching = max_weight_matching(graph, maxcardinality=True)
 
-    buy_order_ids = {buy_order["id"] for buy_order in buy_orders}
-
     result = set()
-    for pair in matching:
-        buy_order_id = pair[0] if pair[0] in buy_order_ids else pair[1]
-        sell_order_id = pair[1] if pair[0] in buy_order_ids else pair[0]
-        result.add((buy_order_id, sell_order_id))
+    for u, v in matching:
+        buy_order, sell_node = (u, v) if u >= 0 else (v, u)
+        result.add((buy_order, ~sell_node))
 
     return result
 
 
-def distribute_remaining_buyers(buy_orders, sell_orders, banned_user_matches):
+def solve_with_assignment(edges):
+    """
+    Same as solve_with_networkx, but uses a bipartite assignment solver on a dense cost matrix.
+
+    Pairs that cannot be matched are given a cost larger than any possible matching, so that the
+    minimum cost assignment first maximizes the number of real matches, then minimizes their
+    total cost. Those pairs are then dropped from the result.
+    """
+    if np is None:
+        raise RuntimeError("The assignment solver requires NumPy")
+    edges = as_edge_list(edges)
+    if not edges:
+        return set()
+
+    buy_orders, rows = get_first_seen_indexes(np.frombuffer(edges.buy_order, np.intc))
+    sell_orders, columns = get_first_seen_indexes(
+        np.frombuffer(edges.sell_order, np.intc)
+    )
+    values = np.frombuffer(edges.cost, dtype=float)
+
+    infeasible_cost = (values.max() + 1) * (min(len(buy_orders), len(sell_orders)) + 1)
+    cost_matrix = np.full((len(buy_orders), len(sell_orders)), infeasible_cost)
+    # A later edge between the same pair of orders replaces an earlier one
+    cost_matrix[rows, columns] = values
+    feasible = np.zeros(cost_matrix.shape, dtype=bool)
+    feasible[rows, columns] = True
+
+    return {
+        (buy_orders[i], sell_orders[j])
+        for i, j in linear_sum_assignment(cost_matrix)
+        if feasible[i, j]
+    }
+
+
+def get_first_seen_indexes(orders):
     """
-    NOTE: Mutates buy_orders by removing those that are matched.
+    Numbers the distinct orders of an array in order of first appearance.
+
+    Returns:
+    (list of the distinct orders, array of the number of each element of orders)
     """
+    distinct, first_seen, inverse = np.unique(
+        orders, return_index=True, return_inverse=True
+    )
+    by_first_seen = np.argsort(first_seen)
+    numbers = np.empty(len(distinct), dtype=np.intp)
+    numbers[by_first_seen] = np.arange(len(distinct))
+    return distinct[by_first_seen].tolist(), numbers[inverse.ravel()]
+
+
+def as_edge_list(edges):
+    return edges if isinstance(edges, EdgeList) else EdgeList(edges)
+
+
+SOLVERS = {
+    "networkx": solve_with_networkx,
+    "assignment": solve_with_assignment,
+    "greedy": solve_greedily,
+    "flow": solve_with_min_cost_flow,
+}
+
+
+def get_compatible_edges(
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    max_number_of_shares,
+    price_weight=PRICE_COST_WEIGHT,
+):
+    """
+    Returns an EdgeList of (buy_order, sell_order, cost) for every pair that can be matched,
+    ordered by sell order row then buy order row. Uses the vectorized cost kernel if NumPy is
+    available.
+
+    Params:
+    buy_orders, sell_orders: OrderBooks sharing their users
+    banned_user_matches: BannedPairIndex on the order books' users
+    """
+    if np is None:
+        return EdgeList(
+            get_price_compatible_edges(
+                buy_orders,
+                sell_orders,
+                banned_user_matches,
+                max_number_of_shares,
+                price_weight=price_weight,
+            )
+        )
 
-    def cmp(sell_order, buy_order):
-        return (
-            -buy_order["price"],  # most desperate: greatest price
-            abs(sell_order["number_of_shares"] - buy_order["number_of_shares"]),
+    buy_prices = np.asarray(buy_orders.price, dtype=float)
+    buy_shares = np.asarray(buy_orders.number_of_shares, dtype=float)
+    sell_prices = np.asarray(sell_orders.price, dtype=float)
+    sell_shares = np.asarray(sell_orders.number_of_shares, dtype=float)
+    buy_order_numbers = np.asarray(buy_orders.order, dtype=np.intc)
+    sell_order_numbers = np.asarray(sell_orders.order, dtype=np.intc)
+    if banned_user_matches:
+        # Same packing as pack_user_pair
+        buy_users = np.asarray(buy_orders.user, dtype=np.int64)
+        sell_users = np.asarray(sell_orders.user, dtype=np.int64)
+        banned = np.fromiter(
+            banned_user_matches.keys, dtype=np.int64, count=len(banned_user_matches)
         )
 
+    # Sell orders are compared with every buy order a block at a time, so that only one block
+    # of the seller x buyer matrix and of its feasible pairs is in memory besides the edges
+    edges = EdgeList()
+    block_rows = max(1, EDGE_BLOCK_CELLS // max(1, len(buy_orders)))
+    for start in range(0, len(sell_orders), block_rows):
+        stop = min(start + block_rows, len(sell_orders))
+        # Laid out seller x buyer so that np.nonzero walks sell orders in the outer loop. Costs
+        # are only computed for the feasible pairs, usually a small fraction of the matrix.
+        sell_rows, buy_rows = np.nonzero(
+            sell_prices[start:stop, None] <= buy_prices[None, :]
+        )
+        sell_rows += start
+
+        if banned_user_matches:
+            keys = (buy_users[buy_rows] << 32) | sell_users[sell_rows]
+            allowed = ~np.isin(keys, banned)
+            sell_rows, buy_rows = sell_rows[allowed], buy_rows[allowed]
+
+        costs = get_costs(
+            buy_prices[buy_rows],
+            buy_shares[buy_rows],
+            sell_prices[sell_rows],
+            sell_shares[sell_rows],
+            max_number_of_shares,
+            price_weight,
+        )
+        edges.frombytes(
+            buy_order_numbers[buy_rows].tobytes(),
+            sell_order_numbers[sell_rows].tobytes(),
+            costs.tobytes(),
+        )
+
+    return edges
+
+
+def get_costs(
+    buy_prices,
+    buy_shares,
+    sell_prices,
+    sell_shares,
+    max_number_of_shares,
+    price_weight=PRICE_COST_WEIGHT,
+):
+    """
+    Vectorized cost of matching buy orders with sell orders. The arrays are broadcast against
+    each other, so this works both on matching pairs of orders and on rows against columns.
+    """
+    return np.abs(
+        buy_prices - sell_prices
+    ) * max_number_of_shares * price_weight + np.abs(buy_shares - sell_shares)
+
+
+def get_price_compatible_edges(
+    buy_orders,
+    sell_orders,
+    banned_user_matches,
+    max_number_of_shares,
+    price_weight=PRICE_COST_WEIGHT,
+):
+    """
+    Yields (buy_order, sell_order, cost) for every pair that can be matched.
+
+    Buy orders are arranged once in a max-heap on price whose in-order traversal is row order
+    (see get_price_tree). For each sell order, only the part of the heap at or above its price
+    is walked, so each edge costs constant time and buy orders below the price are never
+    visited. Edges are yielded in the same order as a nested loop over sell orders then buy
+    orders, so that ties are broken the same way.
+    """
+    buy_prices = buy_orders.price
+    buy_shares = buy_orders.number_of_shares
+    buy_users = buy_orders.user
+    root, left, right = get_price_tree(buy_prices)
+    banned_buyers = defaultdict(set)
+    for key in banned_user_matches.keys:
+        buyer, seller = unpack_user_pair(key)
+        banned_buyers[seller].add(buyer)
+    no_buyers = frozenset()
+
+    for sell_row in range(len(sell_orders)):
+        sell_price = sell_orders.price[sell_row]
+        sell_shares = sell_orders.number_of_shares[sell_row]
+        sell_order = sell_orders.order[sell_row]
+        sell_banned_buyers = banned_buyers.get(sell_orders.user[sell_row], no_buyers)
+
+        # In-order walk of the heap, skipping subtrees whose root is below the sell price
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        buy_row = root
+        while True:
+            while buy_row >= 0 and buy_prices[buy_row] >= sell_price:
+                push(buy_row)
+                buy_row = left[buy_row]
+            if not stack:
+                break
+            buy_row = pop()
+            if buy_users[buy_row] not in sell_banned_buyers:
+                cost = abs(
+                    buy_prices[buy_row] - sell_price
+                ) * max_number_of_shares * price_weight + abs(
+                    buy_shares[buy_row] - sell_shares
+                )
+                yield buy_orders.order[buy_row], sell_order, cost
+            buy_row = right[buy_row]
+
+
+def get_price_tree(prices):
+    """
+    Builds the Cartesian tree of prices: a binary tree of rows where every row has a price at
+    least that of its descendants, and an in-order traversal visits rows in order.
+
+    Returns:
+    (root row, list of left child rows, list of right child rows), with -1 for no row.
+    """
+    left = [-1] * len(prices)
+    right = [-1] * len(prices)
+    # Rows on the right spine of the tree built so far, from the root down
+    spine = []
+    for row, price in enumerate(prices):
+        last = -1
+        while spine and prices[spine[-1]] < price:
+            last = spine.pop()
+        left[row] = last
+        if spine:
+            right[spine[-1]] = row
+        spine.append(row)
+    return (spine[0] if spine else -1), left, right
+
+
+def distribute_remaining_buyers(
+    buy_orders, sell_orders, banned_user_matches, buy_rows, stats=None
+):
+    """
+    Gives the buy orders left after the first matching to sell orders, most desperate first.
+
+    Params:
+    buy_orders, sell_orders: OrderBooks sharing their users
+    banned_user_matches: BannedPairIndex on the order books' users
+    buy_rows: rows of buy_orders that are still unmatched
+    stats: optional dict, filled with the number of remaining buy orders, of passes over the
+    sell orders, and of buy orders left without a match
+
+    Returns:
+    Set of (buy_order, sell_order) pairs, where orders are numbers in their order books.
+    """
     result = set()
+    index = RemainingBuyOrderIndex(buy_orders, buy_rows)
 
     # Sort by most --> least desperate: increasing price, then decreasing number of shares
-    sorted_sell_orders = sorted(
-        sell_orders, key=lambda o: (o["price"], -o["number_of_shares"])
+    sorted_sell_rows = sorted(
+        range(len(sell_orders)),
+        key=lambda row: (sell_orders.price[row], -sell_orders.number_of_shares[row]),
     )
 
-    while len(sorted_sell_orders) > 0:
-        unmatched_sell_orders = []
-
-        for sell_order in sorted_sell_orders:
-            eligible_buy_orders = [
-                buy_order
-                for buy_order in buy_orders
-                if (buy_order["price"] >= sell_order["price"])
-                and (
-                    (buy_order["user_id"], sell_order["user_id"])
-                    not in banned_user_matches
-                )
-            ]
-
-            if len(eligible_buy_orders) == 0:
-                unmatched_sell_orders.append(sell_order)
-                continue
+    passes = 0
+    while len(sorted_sell_rows) > 0:
+        passes += 1
+        matched_sell_rows = []
 
-            buy_order = min(eligible_buy_orders, key=lambda o: cmp(sell_order, o))
-            result.add((buy_order["id"], sell_order["id"]))
-            buy_orders.remove(buy_order)
+        for sell_row in sorted_sell_rows:
+            # Sell orders that find no buyer are dropped: the remaining buy orders only ever
+            # shrink, so they will not find one in a later pass either
+            buy_row = index.pop_most_desperate(
+                sell_orders.price[sell_row],
+                sell_orders.number_of_shares[sell_row],
+                sell_orders.user[sell_row],
+                banned_user_matches,
+            )
+            if buy_row is not None:
+                result.add((buy_orders.order[buy_row], sell_orders.order[sell_row]))
+                matched_sell_rows.append(sell_row)
 
-        for sell_order in unmatched_sell_orders:
-            sorted_sell_orders.remove(sell_order)
+        sorted_sell_rows = matched_sell_rows
 
+    if stats is not None:
+        stats.update(
+            remaining_buy_orders=len(buy_rows),
+            distribute_passes=passes,
+            leftover_buy_orders=len(buy_rows) - len(result),
+        )
     return result
+
+
+class RemainingBuyOrderIndex:
+    """
+    Buy orders that are still unmatched, grouped by price level then by number of shares, so
+    that the most desperate buyer for a sell order is found with binary searches.
+
+    The most desperate buyer is the one with the greatest price, then the nearest number of
+    shares to the sell order's, then the earliest row.
+    """
+
+    def __init__(self, buy_orders, buy_rows):
+        self.buy_users = buy_orders.user
+
+        # price -> number of shares -> rows, in increasing order
+        self.levels = defaultdict(lambda: defaultdict(list))
+        for row in buy_rows:
+            self.levels[buy_orders.price[row]][buy_orders.number_of_shares[row]].append(
+                row
+            )
+        self.prices = sorted(self.levels)
+        self.shares = {price: sorted(level) for price, level in self.levels.items()}
+
+    def pop_most_desperate(self, price, number_of_shares, seller, banned_user_matches):
+        """
+        Removes and returns the row of the most desperate buy order that can be matched with a
+        sell order, or None.
+        """
+        lowest = bisect_left(self.prices, price)
+        for i in range(len(self.prices) - 1, lowest - 1, -1):
+            level_price = self.prices[i]
+            for level_shares, row in self._by_nearest_shares(
+                level_price, number_of_shares
+            ):
+                if (self.buy_users[row], seller) not in banned_user_matches:
+                    self._remove(level_price, level_shares, row)
+                    return row
+        return None
+
+    def _by_nearest_shares(self, price, number_of_shares):
+        """
+        Yields (number_of_shares, row) of the buy orders at the given price level, ordered by
+        distance to number_of_shares, then by row.
+        """
+        shares = self.shares[price]
+        level = self.levels[price]
+        right = bisect_left(shares, number_of_shares)
+        left = right - 1
+
+        while left >= 0 or right < len(shares):
+            left_distance = number_of_shares - shares[left] if left >= 0 else None
+            right_distance = (
+                shares[right] - number_of_shares if right < len(shares) else None
+            )
+
+            if right_distance is None or (
+                left_distance is not None and left_distance < right_distance
+            ):
+                nearest = [shares[left]]
+                left -= 1
+            elif left_distance is None or right_distance < left_distance:
+                nearest = [shares[right]]
+                right += 1
+            else:
+                nearest = [shares[left], shares[right]]
+                left -= 1
+                right += 1
+
+            yield from merge(
+                *[zip(repeat(n), level[n]) for n in nearest], key=lambda c: c[1]
+            )
+
+    def _remove(self, price, number_of_shares, row):
+        level = self.levels[price]
+        level[number_of_shares].remove(row)
+        if level[number_of_shares]:
+            return
+
+        del level[number_of_shares]
+        shares = self.shares[price]
+        del shares[bisect_left(shares, number_of_shares)]
+        if shares:
+            return
+
+        del self.levels[price]
+        del self.shares[price]
+        del self.prices[bisect_left(self.prices, price)]
@@ -0,0 +1,32 @@
+"""
+Match worker, which closes rounds in its own process so that matching does not compete with
+API and chat traffic in the web process. Between round closes, it refreshes the provisional
+matches of the active round.
+
+Usage: env PYTHONPATH=. python src/match_worker.py
+"""
+from time import sleep
+
+from src.config import APP_CONFIG
+from src.services import MatchJobService, MatchService
+
+
+def main():
+    match_job_service = MatchJobService(APP_CONFIG)
+    match_service = MatchService(APP_CONFIG)
+    poll_interval = APP_CONFIG["ACQUITY_MATCH_WORKER_POLL_INTERVAL"].total_seconds()
+    while True:
+        job = match_job_service.run_next()
+        if job is not None:
+            print(f"Ran match job {job['id']} of round {job['round_id']}")
+        elif (
+            match_service.refresh_provisional_matches(
+                should_stop=match_job_service.has_due_job
+            )
+            == 0
+        ):
+            sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    main()
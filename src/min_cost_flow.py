@@ -0,0 +1,421 @@
+from collections import defaultdict
+from heapq import heapify, heappop, heappush
+from math import inf
+
+
+class MinCostMatching:
+    """
+    Maximum cardinality, minimum cost bipartite matching, which can be solved again after its
+    edges change, starting from the previous matching.
+
+    The matching is a flow from a source, through buy orders then sell orders, to a sink, and is
+    solved by successive shortest paths. Node potentials are kept between calls: they make the
+    reduced cost of every residual edge non-negative, which proves the matching optimal. After
+    the edges change, only the edges whose reduced cost became negative need to be repaired,
+    which takes one shortest path search each, instead of one per match for a new solve.
+
+    Cardinality comes first: every edge costs big_cost less than its actual cost, and big_cost
+    is larger than the total cost of any matching.
+    """
+
+    def __init__(self):
+        self.matching = set()
+        self.buy_potentials = {}
+        self.sell_potentials = {}
+        self.source_potential = 0
+        self.sink_potential = 0
+        self.big_cost = None
+        # Number of orders and edges that were repaired, and of shortest path searches, in the
+        # last solve
+        self.repriced_orders = 0
+        self.repaired_edges = 0
+        self.searches = 0
+
+    @property
+    def is_solved(self):
+        return self.big_cost is not None
+
+    def get_state(self):
+        """
+        Returns:
+        What a later solve starts from, as a JSON-serializable dict. Orders must be strings.
+        """
+        return {
+            "matching": sorted(self.matching),
+            "buy_potentials": self.buy_potentials,
+            "sell_potentials": self.sell_potentials,
+            "source_potential": self.source_potential,
+            "sink_potential": self.sink_potential,
+            "big_cost": self.big_cost,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Inverse of get_state.
+        """
+        matching = cls()
+        matching.matching = {tuple(pair) for pair in state["matching"]}
+        matching.buy_potentials = state["buy_potentials"]
+        matching.sell_potentials = state["sell_potentials"]
+        matching.source_potential = state["source_potential"]
+        matching.sink_potential = state["sink_potential"]
+        matching.big_cost = state["big_cost"]
+        return matching
+
+    def solve(self, edges):
+        """
+        Solves the matching, starting from the previous one if there is one.
+
+        Params:
+        edges: enumerable of (buy_order, sell_order, cost), where orders are any hashable keys.
+        A later edge between the same pair of orders replaces an earlier one.
+
+        Returns:
+        Set of (buy_order, sell_order) pairs.
+        """
+        costs = {(buy_order, sell_order): cost for buy_order, sell_order, cost in edges}
+        solver = _Solver(costs, self)
+        self.matching = solver.solve()
+        (
+            self.buy_potentials,
+            self.sell_potentials,
+            self.source_potential,
+            self.sink_potential,
+        ) = solver.get_potentials()
+        self.big_cost = solver.big_cost
+        self.repriced_orders = solver.repriced_orders
+        self.repaired_edges = solver.repaired_edges
+        self.searches = solver.searches
+        return set(self.matching)
+
+
+def solve_with_min_cost_flow(edges):
+    """
+    Same as solve_with_networkx, with successive shortest paths on a sparse graph.
+    """
+    return MinCostMatching().solve(edges)
+
+
+class _Solver:
+    """
+    Flow network of one solve. Buy orders are nodes 0 to number of buy orders - 1, sell orders
+    come next, then the source and the sink.
+    """
+
+    def __init__(self, costs, previous):
+        self.buy_orders = list(dict.fromkeys(b for b, _ in costs))
+        self.sell_orders = list(dict.fromkeys(s for _, s in costs))
+        buy_index = {b: i for i, b in enumerate(self.buy_orders)}
+        sell_index = {s: j for j, s in enumerate(self.sell_orders)}
+
+        self.number_of_buy_orders = len(self.buy_orders)
+        self.source = self.number_of_buy_orders + len(self.sell_orders)
+        self.sink = self.source + 1
+
+        max_cost = max(costs.values(), default=0)
+        min_big_cost = (max_cost + 1) * (
+            min(len(self.buy_orders), len(self.sell_orders)) + 1
+        )
+        warm = previous.big_cost is not None and previous.big_cost >= min_big_cost
+        # Leave room for the round to grow, since changing big_cost changes every edge
+        self.big_cost = previous.big_cost if warm else min_big_cost * 4
+        self.tolerance = self.big_cost * 1e-12
+
+        # Edge costs, by buy order then sell order node
+        self.edges = [{} for _ in self.buy_orders]
+        for (b, s), cost in costs.items():
+            self.edges[buy_index[b]][self.number_of_buy_orders + sell_index[s]] = (
+                cost - self.big_cost
+            )
+
+        # Flow: from the source to buy orders, buy orders to sell orders, sell orders to the
+        # sink. Before repairs are done, a node may have more flow in or out than it should.
+        self.from_source = [False] * len(self.buy_orders)
+        self.to_sink = [False] * len(self.sell_orders)
+        self.flow_out = [set() for _ in self.buy_orders]
+        self.flow_in = [set() for _ in self.sell_orders]
+        self.excess = [0] * (self.sink + 1)
+
+        self.repriced_orders = 0
+        self.repaired_edges = 0
+        self.searches = 0
+
+        if warm:
+            for b, s in previous.matching:
+                i, j = buy_index.get(b), sell_index.get(s)
+                if i is not None and j is not None and (b, s) in costs:
+                    self._flip(self.source, i)
+                    self._flip(i, self.number_of_buy_orders + j)
+                    self._flip(self.number_of_buy_orders + j, self.sink)
+            self.potentials = self._get_previous_potentials(previous)
+            self._reprice(self._get_changed_orders())
+            # Excess flows are counted from the remaining matching, which is balanced
+            self.excess = [0] * (self.sink + 1)
+        else:
+            self.potentials = self._get_cold_potentials()
+
+    def solve(self):
+        self._repair()
+
+        # Augment along shortest paths from the source to the sink while there is one. All of
+        # them have a negative cost, since they add a match.
+        while True:
+            target, parent = self._search([self.source], lambda v: v == self.sink)
+            if target is None:
+                break
+            self._augment(target, parent)
+
+        return {
+            (self.buy_orders[i], self.sell_orders[node - self.number_of_buy_orders])
+            for i, sell_nodes in enumerate(self.flow_out)
+            for node in sell_nodes
+        }
+
+    def get_potentials(self):
+        n = self.number_of_buy_orders
+        return (
+            dict(zip(self.buy_orders, self.potentials[:n])),
+            dict(zip(self.sell_orders, self.potentials[n : self.source])),
+            self.potentials[self.source],
+            self.potentials[self.sink],
+        )
+
+    def _get_cold_potentials(self):
+        """
+        Shortest distances from the source when there is no flow, so that every reduced cost
+        is non-negative.
+        """
+        potentials = [0] * (self.sink + 1)
+        for node in range(self.number_of_buy_orders, self.source):
+            potentials[node] = inf
+        for edges in self.edges:
+            for node, cost in edges.items():
+                potentials[node] = min(potentials[node], cost)
+        potentials[self.sink] = min(
+            potentials[self.number_of_buy_orders : self.source], default=0
+        )
+        return potentials
+
+    def _get_previous_potentials(self, previous):
+        n = self.number_of_buy_orders
+        potentials = [None] * (self.sink + 1)
+        potentials[self.source] = previous.source_potential
+        potentials[self.sink] = previous.sink_potential
+        for i, b in enumerate(self.buy_orders):
+            potentials[i] = previous.buy_potentials.get(b)
+        for j, s in enumerate(self.sell_orders):
+            potentials[n + j] = previous.sell_potentials.get(s)
+        return potentials
+
+    def _get_changed_orders(self):
+        """
+        Returns the nodes of the orders that are new, or whose edges no longer agree with their
+        potentials. A changed order breaks most of its edges, so the orders are picked greedily
+        by number of broken edges, until every broken edge has one of its orders picked.
+        """
+        potentials = self.potentials
+        changed = {v for v in range(self.source) if potentials[v] is None}
+
+        broken = defaultdict(set)
+        for i, edges in enumerate(self.edges):
+            if i in changed:
+                continue
+            flow_out = self.flow_out[i]
+            for node, cost in edges.items():
+                if node in changed:
+                    continue
+                reduced_cost = cost + potentials[i] - potentials[node]
+                if node in flow_out:
+                    reduced_cost = -reduced_cost
+                if reduced_cost < -self.tolerance:
+                    broken[i].add(node)
+                    broken[node].add(i)
+
+        heap = [(-len(others), v) for v, others in broken.items()]
+        heapify(heap)
+        while heap:
+            count, v = heappop(heap)
+            if not broken[v]:
+                continue
+            if -count != len(broken[v]):
+                heappush(heap, (-len(broken[v]), v))
+                continue
+            changed.add(v)
+            for other in broken.pop(v):
+                broken[other].discard(v)
+
+        return changed
+
+    def _reprice(self, orders):
+        """
+        Unmatches the given order nodes, and gives them the potential that makes all of their
+        edges between buy and sell orders valid again. Only their edges from the source or to
+        the sink may then need to be repaired.
+        """
+        n = self.number_of_buy_orders
+        potentials = self.potentials
+        self.repriced_orders = len(orders)
+
+        for v in orders:
+            if v < n:
+                for node in list(self.flow_out[v]):
+                    self._unmatch(v, node)
+            else:
+                for i in list(self.flow_in[v - n]):
+                    self._unmatch(i, v)
+
+        # Buy orders first, since the potentials of sell orders are then taken from them
+        for i in sorted(v for v in orders if v < n):
+            potentials[i] = max(
+                (
+                    potentials[node] - cost
+                    for node, cost in self.edges[i].items()
+                    if node not in orders
+                ),
+                default=potentials[self.source],
+            )
+
+        sell_potentials = {}
+        for i, edges in enumerate(self.edges):
+            for node, cost in edges.items():
+                if node in orders:
+                    sell_potentials[node] = min(
+                        sell_potentials.get(node, inf), cost + potentials[i]
+                    )
+        for node, potential in sell_potentials.items():
+            potentials[node] = potential
+
+    def _repair(self):
+        """
+        Pushes flow through every residual edge with a negative reduced cost, then sends the
+        resulting excess flows back to where flow is missing along shortest paths.
+        """
+        for u, v, cost in list(self._residual_edges()):
+            if cost + self.potentials[u] - self.potentials[v] < -self.tolerance:
+                self._flip(u, v)
+                self.repaired_edges += 1
+
+        while any(self.excess):
+            sources = [v for v, excess in enumerate(self.excess) if excess > 0]
+            target, parent = self._search(sources, lambda v: self.excess[v] < 0)
+            self._augment(target, parent)
+
+    def _residual_edges(self):
+        n = self.number_of_buy_orders
+        for i in range(n):
+            if self.from_source[i]:
+                yield i, self.source, 0
+            else:
+                yield self.source, i, 0
+            for node, cost in self.edges[i].items():
+                if node in self.flow_out[i]:
+                    yield node, i, -cost
+                else:
+                    yield i, node, cost
+        for j in range(len(self.sell_orders)):
+            if self.to_sink[j]:
+                yield self.sink, n + j, 0
+            else:
+                yield n + j, self.sink, 0
+
+    def _neighbours(self, u):
+        n = self.number_of_buy_orders
+        if u < n:
+            flow_out = self.flow_out[u]
+            for node, cost in self.edges[u].items():
+                if node not in flow_out:
+                    yield node, cost
+            if self.from_source[u]:
+                yield self.source, 0
+        elif u < self.source:
+            for i in self.flow_in[u - n]:
+                yield i, -self.edges[i][u]
+            if not self.to_sink[u - n]:
+                yield self.sink, 0
+        elif u == self.source:
+            for i in range(n):
+                if not self.from_source[i]:
+                    yield i, 0
+        else:
+            for j in range(len(self.sell_orders)):
+                if self.to_sink[j]:
+                    yield n + j, 0
+
+    def _search(self, sources, is_target):
+        """
+        Dijkstra on reduced costs from the sources to the nearest target, after which the
+        potentials are updated so that reduced costs stay non-negative.
+
+        Returns:
+        (target, dict of node to parent node on the shortest path), target is None if no target
+        can be reached.
+        """
+        self.searches += 1
+        potentials = self.potentials
+        distances = {}
+        best = {v: 0 for v in sources}
+        parent = {}
+        heap = [(0, v) for v in sources]
+
+        target = None
+        while heap:
+            distance, u = heappop(heap)
+            if u in distances:
+                continue
+            distances[u] = distance
+            if is_target(u):
+                target = u
+                break
+            for v, cost in self._neighbours(u):
+                if v in distances:
+                    continue
+                reduced_cost = max(0, cost + potentials[u] - potentials[v])
+                if distance + reduced_cost < best.get(v, inf):
+                    best[v] = distance + reduced_cost
+                    parent[v] = u
+                    heappush(heap, (distance + reduced_cost, v))
+
+        if target is not None:
+            # Nodes that were not reached keep their potentials, which is the same as adding
+            # the distance to the target to all of them
+            target_distance = distances[target]
+            for v, distance in distances.items():
+                potentials[v] += distance - target_distance
+
+        return target, parent
+
+    def _unmatch(self, buy_node, sell_node):
+        self._flip(sell_node, buy_node)
+        self._flip(buy_node, self.source)
+        self._flip(self.sink, sell_node)
+
+    def _augment(self, target, parent):
+        v = target
+        while v in parent:
+            u = parent[v]
+            self._flip(u, v)
+            v = u
+
+    def _flip(self, u, v):
+        """
+        Sends one unit of flow from u to v, through the edge between them or by cancelling the
+        flow on the opposite edge.
+        """
+        n = self.number_of_buy_orders
+        if u == self.source:
+            self.from_source[v] = True
+        elif v == self.source:
+            self.from_source[u] = False
+        elif v == self.sink:
+            self.to_sink[u - n] = True
+        elif u == self.sink:
+            self.to_sink[v - n] = False
+        elif u < n:
+            self.flow_out[u].add(v)
+            self.flow_in[v - n].add(u)
+        else:
+            self.flow_out[v].discard(u)
+            self.flow_in[u - n].discard(v)
+        self.excess[u] -= 1
+        self.excess[v] += 1
@@ -0,0 +1,192 @@
+from array import array
+
+
+class Interner:
+    """
+    Numbers distinct IDs in order of first appearance, so that they can be stored and compared
+    as small integers.
+    """
+
+    __slots__ = ("ids", "numbers")
+
+    def __init__(self):
+        self.ids = []
+        self.numbers = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, id):
+        number = self.numbers.get(id)
+        if number is None:
+            number = self.numbers[id] = len(self.ids)
+            self.ids.append(id)
+        return number
+
+
+class OrderBook:
+    """
+    Compact list of buy or sell orders, holding only what the matcher needs.
+
+    Orders are stored as rows of parallel columns. Order and user IDs are interned, so a row only
+    stores their numbers; prices and numbers of shares are contiguous arrays of doubles. The same
+    order may appear in several rows.
+
+    The buy and sell order books of a match share the same users, so that user numbers can be
+    compared across them.
+    """
+
+    __slots__ = ("orders", "users", "order", "user", "price", "number_of_shares")
+
+    def __init__(self, users=None):
+        self.orders = Interner()
+        self.users = Interner() if users is None else users
+        self.order = array("q")
+        self.user = array("q")
+        self.price = array("d")
+        self.number_of_shares = array("d")
+
+    @classmethod
+    def from_dicts(cls, orders, users=None):
+        """
+        Params:
+        orders: e.g. [{'id': 'UUID', 'user_id': 'UUID', 'number_of_shares': 20.0, 'price': 30.0}]
+        """
+        book = cls(users)
+        for order in orders:
+            book.append(
+                id=order["id"],
+                user_id=order["user_id"],
+                price=order["price"],
+                number_of_shares=order["number_of_shares"],
+            )
+        return book
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.get(row)
+
+    def get(self, row):
+        return {
+            "id": self.orders.ids[self.order[row]],
+            "user_id": self.users.ids[self.user[row]],
+            "price": self.price[row],
+            "number_of_shares": self.number_of_shares[row],
+        }
+
+    def append(self, id, user_id, price, number_of_shares):
+        self.order.append(self.orders.intern(id))
+        self.user.append(self.users.intern(user_id))
+        self.price.append(price)
+        self.number_of_shares.append(number_of_shares)
+
+
+class EdgeList:
+    """
+    Compact list of (buy_order, sell_order, cost) edges of the matching graph, where orders are
+    numbers in their order books.
+
+    Edges are stored as parallel columns: 16 bytes per edge, against well over 100 for a list of
+    tuples. Iterating yields tuples, so that a solver which needs a graph of its own, such as
+    networkx's, builds it from the edge list only when it is used.
+    """
+
+    __slots__ = ("buy_order", "sell_order", "cost")
+
+    def __init__(self, edges=()):
+        # Order numbers fit in 32 bits, as in pack_user_pair
+        self.buy_order = array("i")
+        self.sell_order = array("i")
+        self.cost = array("d")
+        for buy_order, sell_order, cost in edges:
+            self.append(buy_order, sell_order, cost)
+
+    def __len__(self):
+        return len(self.cost)
+
+    def __iter__(self):
+        return zip(self.buy_order, self.sell_order, self.cost)
+
+    def append(self, buy_order, sell_order, cost):
+        self.buy_order.append(buy_order)
+        self.sell_order.append(sell_order)
+        self.cost.append(cost)
+
+    def frombytes(self, buy_order, sell_order, cost):
+        """
+        Appends edges from the machine values of each column, e.g. NumPy arrays of C ints and
+        doubles turned into bytes.
+        """
+        self.buy_order.frombytes(buy_order)
+        self.sell_order.frombytes(sell_order)
+        self.cost.frombytes(cost)
+
+    def take(self, indexes):
+        """
+        Returns a new EdgeList of the edges at the given indexes, in that order.
+        """
+        edges = EdgeList()
+        edges.buy_order.extend(self.buy_order[i] for i in indexes)
+        edges.sell_order.extend(self.sell_order[i] for i in indexes)
+        edges.cost.extend(self.cost[i] for i in indexes)
+        return edges
+
+
+class BannedPairIndex:
+    """
+    Set of (buyer, seller) pairs of user numbers that cannot be matched together.
+
+    Each pair is packed into a single integer, so membership checks are one hash lookup and the
+    whole set can be handed to NumPy as an array.
+    """
+
+    __slots__ = ("users", "keys")
+
+    def __init__(self, users):
+        self.users = users
+        self.keys = set()
+
+    @classmethod
+    def from_pairs(cls, users, banned_user_matches):
+        """
+        Params:
+        users: Interner of the users of the order books being matched
+        banned_user_matches: enumerable of (buyer_id, seller_id) pairs of user IDs
+        """
+        index = cls(users)
+        for buyer_id, seller_id in banned_user_matches:
+            index.add(buyer_id, seller_id)
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, pair):
+        buyer, seller = pair
+        return pack_user_pair(buyer, seller) in self.keys
+
+    def __iter__(self):
+        for key in self.keys:
+            buyer, seller = unpack_user_pair(key)
+            yield self.users.ids[buyer], self.users.ids[seller]
+
+    def add(self, buyer_id, seller_id):
+        """
+        Bans a pair of user IDs. Pairs involving a user without orders are ignored, since they
+        can never be matched anyway.
+        """
+        buyer = self.users.numbers.get(buyer_id)
+        seller = self.users.numbers.get(seller_id)
+        if buyer is not None and seller is not None:
+            self.keys.add(pack_user_pair(buyer, seller))
+
+
+def pack_user_pair(buyer, seller):
+    return buyer << 32 | seller
+
+
+def unpack_user_pair(key):
+    return key >> 32, key & 0xFFFFFFFF
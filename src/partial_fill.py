@@ -0,0 +1,275 @@
+from bisect import bisect_right
+from collections import Counter, defaultdict
+
+import networkx as nx
+
+from src.match import get_banned_pair_index, get_order_books
+from src.order_book import unpack_user_pair
+
+# Costs and capacities are scaled to integers, since the network simplex is not reliable on
+# floats: prices to cents and numbers of shares to thousandths of a share
+PRICE_SCALE = 100
+SHARE_SCALE = 1000
+
+
+def match_with_partial_fills(buy_orders, sell_orders, banned_user_matches):
+    """
+    Matches numbers of shares instead of whole orders: a buy order may buy from several sell
+    orders and a sell order may sell to several buy orders, as long as no order trades more
+    shares than it has. The number of shares traded is maximised first, then the total price
+    difference of the trades, so that shares are traded between the nearest prices.
+
+    This is a min cost flow from sell orders to buy orders, solved with networkx's network
+    simplex. Instead of an edge for every pair of compatible orders, sell orders flow into a
+    ladder of price levels, up the ladder at the cost of each price step, and out to the buy
+    orders at or above their price, so the network grows linearly with the number of orders.
+
+    The ladder cannot tell who a share came from, so buy orders of buyers with banned sellers
+    take their shares from a segment tree over the sell orders sorted by price instead. Their
+    compatible sell orders are a few ranges of it, between the orders of their banned sellers,
+    and each range is covered by a logarithmic number of tree nodes.
+
+    Params:
+    buy_orders, sell_orders, banned_user_matches: same as match_buyers_and_sellers. An order in
+    several rows, such as a doubled sell order, is only counted once.
+
+    Returns:
+    Set of (buy_order_id, sell_order_id, number_of_shares, price) trades, where the price is
+    midway between the prices of both orders.
+    """
+    buy_orders, sell_orders = get_order_books(buy_orders, sell_orders)
+    banned_user_matches = get_banned_pair_index(buy_orders.users, banned_user_matches)
+
+    buy_rows = get_first_rows(buy_orders)
+    sell_rows = get_first_rows(sell_orders)
+    total_sell_shares = sum(
+        to_units(sell_orders.number_of_shares[row]) for row in sell_rows.values()
+    )
+    if not buy_rows or total_sell_shares == 0:
+        return set()
+
+    buy_nodes = {("b", order): row for order, row in buy_rows.items()}
+    sell_nodes = {("s", order): row for order, row in sell_rows.items()}
+    cents = {
+        node: to_cents(book.price[row])
+        for book, nodes in ((buy_orders, buy_nodes), (sell_orders, sell_nodes))
+        for node, row in nodes.items()
+    }
+    levels = sorted(set(cents.values()))
+
+    banned_sellers = defaultdict(set)
+    for key in banned_user_matches.keys:
+        buyer, seller = unpack_user_pair(key)
+        banned_sellers[buyer].add(seller)
+
+    graph = nx.DiGraph()
+    graph.add_node("source", demand=-total_sell_shares)
+    graph.add_node("sink", demand=total_sell_shares)
+    # Shares that cannot be traded bypass the orders, at a cost higher than any trade
+    graph.add_edge("source", "sink", weight=levels[-1] - levels[0] + 1)
+    graph.add_edges_from(
+        (("p", low), ("p", high), {"weight": high - low})
+        for low, high in zip(levels, levels[1:])
+    )
+    for node, row in sell_nodes.items():
+        graph.add_edge(
+            "source", node, capacity=to_units(sell_orders.number_of_shares[row])
+        )
+        graph.add_edge(node, ("p", cents[node]))
+    for node, row in buy_nodes.items():
+        graph.add_edge(
+            node, "sink", capacity=to_units(buy_orders.number_of_shares[row])
+        )
+        if buy_orders.user[row] not in banned_sellers:
+            graph.add_edge(("p", cents[node]), node)
+
+    tree = None
+    if banned_sellers:
+        tree = SellOrderTree(sell_orders, sell_nodes, cents)
+        tree.add_to(graph)
+        for node, row in buy_nodes.items():
+            sellers = banned_sellers.get(buy_orders.user[row])
+            if sellers is not None:
+                tree.connect(graph, node, cents[node], sellers)
+
+    _cost, flow = nx.network_simplex(graph)
+
+    trades = Counter()
+    for (buy_node, sell_node), units in decompose_ladder_flow(
+        flow, levels, buy_nodes, sell_nodes, cents
+    ):
+        trades[buy_node, sell_node] += units
+    if tree is not None:
+        for (buy_node, sell_node), units in tree.decompose_flow(flow, buy_nodes):
+            trades[buy_node, sell_node] += units
+
+    return {
+        (
+            buy_orders.orders.ids[buy_node[1]],
+            sell_orders.orders.ids[sell_node[1]],
+            units / SHARE_SCALE,
+            (
+                buy_orders.price[buy_nodes[buy_node]]
+                + sell_orders.price[sell_nodes[sell_node]]
+            )
+            / 2,
+        )
+        for (buy_node, sell_node), units in trades.items()
+    }
+
+
+def to_cents(price):
+    return round(price * PRICE_SCALE)
+
+
+def to_units(number_of_shares):
+    return round(number_of_shares * SHARE_SCALE)
+
+
+def get_first_rows(book):
+    """
+    Returns dict of order number to the first row of that order in the order book.
+    """
+    rows = {}
+    for row, order in enumerate(book.order):
+        rows.setdefault(order, row)
+    return rows
+
+
+def decompose_ladder_flow(flow, levels, buy_nodes, sell_nodes, cents):
+    """
+    Splits the flow through the price ladder into trades. Going up the ladder, the shares of
+    each sell order wait on a stack until a buy order takes them, from the nearest price first.
+    Any split costs the same, since a share pays for every price step between its orders.
+
+    Yields ((buy node, sell node), units of shares).
+    """
+    buy_nodes_at = defaultdict(list)
+    sell_nodes_at = defaultdict(list)
+    for node in buy_nodes:
+        buy_nodes_at[cents[node]].append(node)
+    for node in sell_nodes:
+        sell_nodes_at[cents[node]].append(node)
+
+    stack = []
+    for level in levels:
+        level_node = ("p", level)
+        for sell_node in sell_nodes_at[level]:
+            units = flow[sell_node].get(level_node, 0)
+            if units > 0:
+                stack.append([sell_node, units])
+        for buy_node in buy_nodes_at[level]:
+            units = flow[level_node].get(buy_node, 0)
+            while units > 0:
+                sell_node, available = stack[-1]
+                traded = min(units, available)
+                yield (buy_node, sell_node), traded
+                units -= traded
+                if traded == available:
+                    stack.pop()
+                else:
+                    stack[-1][1] -= traded
+
+
+class SellOrderTree:
+    """
+    Segment tree over the sell orders sorted by price, as part of the flow network. Shares flow
+    from each sell order into its leaf, up towards the root, and out to buy orders from the
+    nodes covering their compatible sell orders. Entering the tree costs minus the price of the
+    sell order and leaving it costs the price of the buy order, so that a share pays the
+    difference between them, as on the ladder.
+
+    Node i has children 2i and 2i + 1, and the sell order at index j has leaf size + j.
+    """
+
+    def __init__(self, sell_orders, sell_nodes, cents):
+        self.sorted_nodes = sorted(sell_nodes, key=lambda node: cents[node])
+        self.sorted_cents = [cents[node] for node in self.sorted_nodes]
+        self.size = 1
+        while self.size < len(self.sorted_nodes):
+            self.size *= 2
+        self.end = self.size + len(self.sorted_nodes)
+        # Indexes of the sell orders of each seller
+        self.indexes = defaultdict(list)
+        for index, node in enumerate(self.sorted_nodes):
+            self.indexes[sell_orders.user[sell_nodes[node]]].append(index)
+
+    def add_to(self, graph):
+        for index, (node, cents) in enumerate(
+            zip(self.sorted_nodes, self.sorted_cents)
+        ):
+            graph.add_edge(node, ("t", self.size + index), weight=-cents)
+        for i in range(self.end - 1, 1, -1):
+            graph.add_edge(("t", i), ("t", i // 2))
+
+    def connect(self, graph, buy_node, buy_cents, banned_sellers):
+        """
+        Lets a buy order take shares from every sell order at or below its price, except those
+        of the banned sellers.
+        """
+        stop = bisect_right(self.sorted_cents, buy_cents)
+        excluded = sorted(
+            index
+            for seller in banned_sellers
+            for index in self.indexes.get(seller, [])
+            if index < stop
+        )
+        start = 0
+        for end in excluded + [stop]:
+            for i in self._cover(start, end):
+                graph.add_edge(("t", i), buy_node, weight=buy_cents)
+            start = end + 1
+
+    def decompose_flow(self, flow, buy_nodes):
+        """
+        Splits the flow through the tree into trades, by following the shares that leave each
+        tree node down to the sell orders they came from.
+
+        Yields ((buy node, sell node), units of shares).
+        """
+        # Units of shares going up from each node that are not assigned to a trade yet
+        remaining = {
+            i: flow[("t", i)].get(("t", i // 2), 0) for i in range(2, self.end)
+        }
+
+        for i in range(1, self.end):
+            for buy_node, units in flow.get(("t", i), {}).items():
+                if buy_node in buy_nodes and units > 0:
+                    for sell_node, traded in self._take(remaining, i, units):
+                        yield (buy_node, sell_node), traded
+
+    def _cover(self, start, end):
+        """
+        Returns the tree nodes whose leaves are exactly the sell orders from start to end.
+        """
+        nodes = []
+        start += self.size
+        end += self.size
+        while start < end:
+            if start & 1:
+                nodes.append(start)
+                start += 1
+            if end & 1:
+                end -= 1
+                nodes.append(end)
+            start //= 2
+            end //= 2
+        return nodes
+
+    def _take(self, remaining, i, units):
+        """
+        Assigns units of shares leaving node i to the sell orders below it.
+
+        Yields (sell node, units of shares).
+        """
+        if i >= self.size:
+            yield self.sorted_nodes[i - self.size], units
+            return
+        for child in (2 * i, 2 * i + 1):
+            taken = min(units, remaining.get(child, 0))
+            if taken > 0:
+                remaining[child] -= taken
+                yield from self._take(remaining, child, taken)
+                units -= taken
+            if units == 0:
+                return
@@ -0,0 +1,55 @@
+"""
+Provisional matches: the match results of each security of an open round, kept up to date by
+the match worker as orders change, so that closing the round only has to check them. They are
+stored in the database (see ProvisionalMatch in src/database.py), so that the web process and
+the match worker see the same ones.
+"""
+import hashlib
+import json
+
+from src.match import match_buyers_and_sellers
+from src.min_cost_flow import MinCostMatching
+
+
+def rematch(params, warm_start_state=None):
+    """
+    Matches a security from its previous provisional matching, which only repairs the part of
+    the matching that its order changes touched.
+
+    Params:
+    params: (buy_orders, sell_orders, banned_pairs), the arguments to match_buyers_and_sellers
+    for the orders of that security
+    warm_start_state: state of the MinCostMatching of the previous provisional matching (see
+    MinCostMatching.get_state), or None to match from scratch
+
+    Returns:
+    (match results, state of the new MinCostMatching)
+    """
+    warm_start = (
+        MinCostMatching()
+        if warm_start_state is None
+        else MinCostMatching.from_state(warm_start_state)
+    )
+    results = match_buyers_and_sellers(*params, warm_start=warm_start)
+    return results, warm_start.get_state()
+
+
+def get_fingerprint(params):
+    """
+    Canonical form of matching params, which does not depend on the order in which the orders
+    were loaded.
+    """
+    buy_orders, sell_orders, banned_pairs = params
+    return (
+        sorted(tuple(order.values()) for order in buy_orders),
+        sorted(tuple(order.values()) for order in sell_orders),
+        sorted(banned_pairs),
+    )
+
+
+def get_fingerprint_hash(params):
+    """
+    Stable hash of get_fingerprint.
+    """
+    content = json.dumps(get_fingerprint(params), separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
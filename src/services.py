@@ -1,33 +1,52 @@
-from collections import defaultdict
+import hashlib
+import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timezone
+from itertools import chain
+from threading import Lock
+from time import perf_counter, time
+from uuid import UUID
 
 import requests
+from sqlalchemy import String, or_, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql import func
 
 from src.database import (
+    ROUND_CLOSE_STAGES,
     BannedPair,
     BuyOrder,
     Chat,
     ChatRoom,
     Match,
+    MatchJob,
+    MatchResultCache,
     Offer,
+    ProvisionalMatch,
     Round,
+    RoundCloseCheckpoint,
     Security,
     SellOrder,
     User,
     UserRequest,
+    engine,
     session_scope,
 )
 from src.email_service import EmailService
 from src.exceptions import (
     InvalidRequestException,
     InvisibleUnauthorizedException,
+    MatchJobCancelledException,
     ResourceNotFoundException,
     ResourceNotOwnedException,
     UnauthorizedException,
     UserProfileNotFoundException,
 )
-from src.match import match_buyers_and_sellers
+from src.match import check_solver, match_buyers_and_sellers, timed
+from src.order_book import BannedPairIndex, OrderBook
+from src.partial_fill import match_with_partial_fills
+from src.provisional_match import get_fingerprint, get_fingerprint_hash, rematch
 from src.schemata import (
     AUTHENTICATE_SCHEMA,
     CREATE_BUY_ORDER_SCHEMA,
@@ -40,6 +59,27 @@ from src.schemata import (
     validate_input,
 )
 
+# Number of orders fetched at a time from the server-side cursor when loading a round
+ORDER_LOAD_BATCH_SIZE = 10000
+
+# Columns of Match given by match results: pairs of order IDs, followed by the number of shares
+# and the price of the trade with partial fills
+MATCH_COLUMNS = ("buy_order_id", "sell_order_id", "number_of_shares", "price")
+
+# Stats of match_buyers_and_sellers that are summed over securities in the metrics of a run
+ENGINE_COUNTERS = (
+    "buy_orders",
+    "sell_orders",
+    "nodes",
+    "edges",
+    "components",
+    "greedy_components",
+    "matches",
+    "remaining_buy_orders",
+    "distribute_passes",
+    "leftover_buy_orders",
+)
+
 
 class UserService:
     def __init__(self, config):
@@ -142,6 +182,9 @@ class SellOrderService:
                 session.add(sell_order)
 
             session.commit()
+            self._mark_provisional_matches_stale(
+                sell_order.round_id, user_id, security_id
+            )
 
             self.email_service.send_email(
                 emails=[user.email], template="create_sell_order"
@@ -180,6 +223,9 @@ class SellOrderService:
                 sell_order.price = new_price
 
             session.commit()
+            self._mark_provisional_matches_stale(
+                sell_order.round_id, sell_order.user_id, sell_order.security_id
+            )
 
             user = session.query(User).get(sell_order.user_id)
             self.email_service.send_email(
@@ -197,9 +243,27 @@ class SellOrderService:
             if sell_order.user_id != subject_id:
                 raise ResourceNotOwnedException("You need to own this order.")
 
+            round_id = sell_order.round_id
+            security_id = sell_order.security_id
             session.delete(sell_order)
+
+        self._mark_provisional_matches_stale(round_id, subject_id, security_id)
         return {}
 
+    def _mark_provisional_matches_stale(self, round_id, user_id, security_id):
+        if round_id is None or not self.config["ACQUITY_MATCH_INCREMENTAL"]:
+            return
+
+        # The seller's orders in other securities may stop or start being doubled
+        with session_scope() as session:
+            security_ids = {security_id} | {
+                other_security_id
+                for (other_security_id,) in session.query(SellOrder.security_id)
+                .filter_by(user_id=user_id, round_id=round_id)
+                .all()
+            }
+        MatchService(self.config).mark_provisional_matches_stale(round_id, security_ids)
+
 
 class BuyOrderService:
     def __init__(self, config):
@@ -231,6 +295,7 @@ class BuyOrderService:
 
             session.add(buy_order)
             session.commit()
+            self._mark_provisional_matches_stale(buy_order.round_id, security_id)
 
             self.email_service.send_email(
                 emails=[user.email], template="create_buy_order"
@@ -269,6 +334,9 @@ class BuyOrderService:
                 buy_order.price = new_price
 
             session.commit()
+            self._mark_provisional_matches_stale(
+                buy_order.round_id, buy_order.security_id
+            )
 
             user = session.query(User).get(buy_order.user_id)
             self.email_service.send_email(
@@ -286,9 +354,19 @@ class BuyOrderService:
             if buy_order.user_id != subject_id:
                 raise ResourceNotOwnedException("You need to own this order.")
 
+            round_id = buy_order.round_id
+            security_id = buy_order.security_id
             session.delete(buy_order)
+
+        self._mark_provisional_matches_stale(round_id, security_id)
         return {}
 
+    def _mark_provisional_matches_stale(self, round_id, security_id):
+        if round_id is not None:
+            MatchService(self.config).mark_provisional_matches_stale(
+                round_id, [security_id]
+            )
+
 
 class SecurityService:
     def __init__(self, config):
@@ -371,10 +449,16 @@ class RoundService:
             for buy_order in session.query(BuyOrder).filter_by(round_id=None):
                 buy_order.round_id = str(new_round.id)
 
+            if self.config["ACQUITY_MATCH_IN_WORKER"]:
+                session.add(MatchJob(round_id=str(new_round.id), run_at=end_time))
+
             emails = [user.email for user in session.query(User).all()]
             self.email_service.send_email(emails, template="round_opened")
+            new_round_id = str(new_round.id)
 
-        if scheduler is not None:
+        MatchService(self.config).mark_provisional_matches_stale(new_round_id)
+
+        if not self.config["ACQUITY_MATCH_IN_WORKER"] and scheduler is not None:
             scheduler.add_job(
                 MatchService(self.config).run_matches, "date", run_date=end_time
             )
@@ -388,115 +472,1240 @@ class MatchService:
     def __init__(self, config):
         self.config = config
         self.email_service = EmailService(config)
+        # Process pool of previews, which is started by the first preview and shared by the
+        # following ones
+        self._preview_executor = None
+        self._preview_executor_lock = Lock()
+
+    def run_matches(self, round_id=None, progress=None, is_cancelled=None):
+        """
+        Matches the orders of a round, the active one by default, saves the matches, concludes
+        the round and notifies its users.
+
+        Every stage is checkpointed, for each security and for the round as a whole, so a run
+        that was interrupted can be run again: it resumes after the last completed stage,
+        without matching a security again or emailing a user twice.
+
+        Params:
+        progress: function called with (phase, fraction of the phase that is done) as the run
+        goes on, or None.
+        is_cancelled: function called with the session of the transaction that saves the first
+        matches, before they are saved, which returns whether the run should stop, or None. Once
+        the matches of a security are saved, the run always goes on until the round is closed,
+        so that a cancelled run never leaves it half closed.
+
+        Raises:
+        MatchJobCancelledException if the run was cancelled.
+
+        Returns:
+        Dict of metrics of the run, with the seconds spent loading orders, matching, writing to
+        the database and sending emails, how many orders, matches and emails there were, and
+        the stats of the matching engine summed over securities (see match_buyers_and_sellers).
+        None if ACQUITY_MATCH_METRICS is off or the round was already closed.
+        """
+        check_solver(self.config["ACQUITY_MATCH_SOLVER"])
+        if round_id is None:
+            round_id = RoundService(self.config).get_active()["id"]
+        if progress is None:
+            progress = ignore_progress
+        metrics = None
+        if self.config["ACQUITY_MATCH_METRICS"]:
+            metrics = {
+                "round_id": round_id,
+                "seconds": {},
+                "securities": 0,
+                "resumed_securities": 0,
+                "buy_orders": 0,
+                "sell_orders": 0,
+                "matches": 0,
+                "emails": 0,
+                "engine": {},
+            }
+        start = perf_counter()
+
+        checkpoints = self._get_checkpoints(round_id)
+        round_stage = checkpoints.pop(None, (None, None))[0]
+        if is_stage_reached(round_stage, "NOTIFIED"):
+            return None
+        if is_cancelled is None or any(
+            is_stage_reached(stage, "PERSISTED") for stage, _ in checkpoints.values()
+        ):
+            is_cancelled = is_never_cancelled
+
+        progress("loading", 0)
+        with timed(metrics, "loading"):
+            matching_params = self._get_matching_params(round_id)
+        self._save_checkpoint(round_id, None, "LOADED")
+        progress("matching", 0)
+
+        # Securities matched by a previous run reuse its results
+        matched_params = {}
+        unmatched_params = {}
+        for security_id, params in matching_params.items():
+            if is_stage_reached(checkpoints.get(security_id, (None,))[0], "MATCHED"):
+                matched_params[security_id] = params
+            else:
+                unmatched_params[security_id] = params
+        security_results = chain(
+            (
+                (security_id, params, checkpoints[security_id][1])
+                for security_id, params in matched_params.items()
+            ),
+            (
+                (security_id, params, results)
+                for security_id, params, results, _ in self._match_with_cache(
+                    round_id, unmatched_params, metrics=metrics
+                )
+            ),
+        )
+
+        # Each security is saved, and its matched users notified, as soon as it is matched. Only
+        # user IDs are kept across securities, to notify unmatched users at the end.
+        user_ids = set()
+        matched_user_ids = set()
+        notified_user_ids = set()
+        for security_id, (stage, results) in checkpoints.items():
+            if security_id in matching_params and is_stage_reached(stage, "NOTIFIED"):
+                notified_user_ids |= get_matched_user_ids(
+                    *matching_params[security_id][:2], results
+                )
+
+        for (
+            i,
+            (security_id, (security_buy_orders, security_sell_orders, _), results),
+        ) in enumerate(timed_iteration(security_results, metrics, "matching"), 1):
+            stage = checkpoints.get(security_id, (None,))[0]
+            if not is_stage_reached(stage, "MATCHED"):
+                self._save_checkpoint(round_id, security_id, "MATCHED", results)
+            if metrics is not None:
+                metrics["securities"] += 1
+                metrics["resumed_securities"] += security_id in matched_params
+                metrics["buy_orders"] += len(security_buy_orders)
+                metrics["sell_orders"] += len(security_sell_orders)
+                metrics["matches"] += len(results)
+
+            buy_order_to_buyer_dict = {
+                order["id"]: order["user_id"] for order in security_buy_orders
+            }
+            sell_order_to_seller_dict = {
+                order["id"]: order["user_id"] for order in security_sell_orders
+            }
+            if not is_stage_reached(stage, "PERSISTED"):
+                with timed(metrics, "db_write"), session_scope() as session:
+                    if is_cancelled(session):
+                        raise MatchJobCancelledException("Match job cancelled")
+                    self._add_db_objects(
+                        session,
+                        results,
+                        sell_order_to_seller_dict,
+                        buy_order_to_buyer_dict,
+                    )
+                    self._save_checkpoint(
+                        round_id, security_id, "PERSISTED", session=session
+                    )
+                is_cancelled = is_never_cancelled
+
+            security_matched_user_ids = get_matched_user_ids(
+                security_buy_orders, security_sell_orders, results
+            )
+            if not is_stage_reached(stage, "NOTIFIED"):
+                # Checkpointed before sending, so that emails are never sent twice
+                self._save_checkpoint(round_id, security_id, "NOTIFIED")
+                with timed(metrics, "emails"):
+                    self._send_emails(
+                        security_matched_user_ids - notified_user_ids,
+                        template="match_done_has_match",
+                    )
+                if metrics is not None:
+                    metrics["emails"] += len(
+                        security_matched_user_ids - notified_user_ids
+                    )
+                notified_user_ids |= security_matched_user_ids
+
+            matched_user_ids |= security_matched_user_ids
+            user_ids.update(buy_order_to_buyer_dict.values())
+            user_ids.update(sell_order_to_seller_dict.values())
+            progress("matching", i / len(matching_params))
+
+        self._save_checkpoint(round_id, None, "MATCHED")
+        with timed(metrics, "db_write"), session_scope() as session:
+            # A round without orders is concluded without saving matches first
+            if is_cancelled(session):
+                raise MatchJobCancelledException("Match job cancelled")
+            self._conclude_round(session, round_id)
+            self._save_checkpoint(round_id, None, "PERSISTED", session=session)
+
+        progress("notifying", 0)
+        self._save_checkpoint(round_id, None, "NOTIFIED")
+        with timed(metrics, "emails"):
+            self._send_emails(
+                user_ids - matched_user_ids, template="match_done_no_match"
+            )
+        progress("notifying", 1)
+
+        if metrics is None:
+            return None
+        metrics["emails"] += len(user_ids - matched_user_ids)
+        metrics["seconds"]["total"] = perf_counter() - start
+        print(f"Closed round {round_id}: {json.dumps(metrics, sort_keys=True)}")
+        return metrics
+
+    def _get_checkpoints(self, round_id):
+        """
+        Returns:
+        Dict of security ID, or None for the whole round, to (last completed stage, match
+        results or None).
+        """
+        with session_scope() as session:
+            return {
+                checkpoint.security_id: (
+                    checkpoint.stage,
+                    checkpoint.results
+                    and {tuple(pair) for pair in json.loads(checkpoint.results)},
+                )
+                for checkpoint in session.query(RoundCloseCheckpoint).filter_by(
+                    round_id=round_id
+                )
+            }
+
+    def _save_checkpoint(
+        self, round_id, security_id, stage, results=None, session=None
+    ):
+        """
+        Records that a stage of closing a round is completed. The stage only moves forward, so
+        that a run that resumes, or one racing another run, never undoes a later stage. With a
+        session, the checkpoint is part of its transaction.
+        """
+        if session is None:
+            with session_scope() as session:
+                return self._save_checkpoint(
+                    round_id, security_id, stage, results, session
+                )
+
+        if results is not None:
+            results = json.dumps(sorted(results), separators=(",", ":"))
+        statement = insert(RoundCloseCheckpoint).values(
+            round_id=round_id, security_id=security_id, stage=stage, results=results
+        )
+        if security_id is None:
+            conflict_target = {
+                "index_elements": ["round_id"],
+                "index_where": RoundCloseCheckpoint.security_id.is_(None),
+            }
+        else:
+            conflict_target = {"index_elements": ["round_id", "security_id"]}
+        # Stages are compared in the order of the enum
+        session.execute(
+            statement.on_conflict_do_update(
+                **conflict_target,
+                set_={
+                    "stage": statement.excluded.stage,
+                    "results": func.coalesce(
+                        statement.excluded.results, RoundCloseCheckpoint.results
+                    ),
+                    "updated_at": func.now(),
+                },
+                where=RoundCloseCheckpoint.stage < statement.excluded.stage,
+            )
+        )
+
+    @validate_input({"subject_id": UUID_RULE})
+    def preview_matches(self, subject_id):
+        """
+        Matches the orders of the active round without concluding it, so that the committee can
+        see the outcome before the round ends. Matching happens in the process pool of previews,
+        and securities whose orders did not change since the last preview are served from the
+        match result cache or from their provisional matches.
+
+        Returns:
+        Dict with the projected matches, the fraction of buy orders that are matched and the
+        time taken.
+        """
+        with session_scope() as session:
+            if not session.query(User).get(subject_id).is_committee:
+                raise InvisibleUnauthorizedException("Not committee")
+
+        check_solver(self.config["ACQUITY_MATCH_SOLVER"])
+        active_round = RoundService(self.config).get_active()
+        if active_round is None:
+            raise ResourceNotFoundException("No active round")
+
+        start = perf_counter()
+        matching_params = self._get_matching_params(active_round["id"])
+        matches = []
+        matched_buy_orders = set()
+        number_of_buy_orders = 0
+        cached_securities = 0
+        for (
+            security_id,
+            (buy_orders, _, _),
+            results,
+            is_cached,
+        ) in self._match_with_cache(
+            active_round["id"], matching_params, in_background=True
+        ):
+            matches += [
+                {"security_id": security_id, **dict(zip(MATCH_COLUMNS, match))}
+                for match in sorted(results)
+            ]
+            matched_buy_orders.update(buy_order_id for buy_order_id, *_ in results)
+            number_of_buy_orders += len(buy_orders)
+            cached_securities += is_cached
+
+        matches.sort(key=lambda match: (match["security_id"], match["buy_order_id"]))
+        return {
+            "round_id": active_round["id"],
+            "matches": matches,
+            "match_rate": len(matched_buy_orders) / number_of_buy_orders
+            if number_of_buy_orders > 0
+            else 0,
+            "securities": len(matching_params),
+            "cached_securities": cached_securities,
+            "seconds": perf_counter() - start,
+        }
 
-    def run_matches(self):
-        round_id = RoundService(self.config).get_active()["id"]
-        buy_orders, sell_orders, banned_pairs = self._get_matching_params(round_id)
+    def _match_with_cache(
+        self, round_id, matching_params, in_background=False, metrics=None
+    ):
+        """
+        Matches the orders of each security, reusing the cached match results of securities
+        whose orders and bans did not change, and caching the new ones. Results that may not be
+        optimal, e.g. because the time limit was reached, are not cached, so that they are
+        solved again next time instead of being served until the cache expires. With a metrics
+        dict,
+        counts the cached securities and sums the stats of the matching engine into it.
+
+        Yields (security ID, matching params, match results, whether they were cached).
+        """
+        deadline = None
+        if self.config["ACQUITY_MATCH_TIME_LIMIT"] is not None:
+            deadline = time() + self.config["ACQUITY_MATCH_TIME_LIMIT"]
+
+        cache_keys = {
+            security_id: self._get_cache_key(params)
+            for security_id, params in matching_params.items()
+        }
+        cached_results = self._get_cached_results(cache_keys)
+        if metrics is not None:
+            metrics["cached_securities"] = len(cached_results)
+        for security_id, results in cached_results.items():
+            yield security_id, matching_params[security_id], results, True
+
+        uncached_params = {
+            security_id: params
+            for security_id, params in matching_params.items()
+            if security_id not in cached_results
+        }
+        if (
+            self.config["ACQUITY_MATCH_INCREMENTAL"]
+            and not self.config["ACQUITY_MATCH_PARTIAL_FILLS"]
+        ):
+            new_results = self._match_provisionally(
+                round_id,
+                uncached_params,
+                deadline=deadline,
+                in_background=in_background,
+                metrics=metrics,
+            )
+        else:
+            new_results = self._match_securities(
+                uncached_params,
+                deadline=deadline,
+                in_background=in_background,
+                metrics=metrics,
+            )
+        for security_id, params, results, is_optimal in new_results:
+            if is_optimal:
+                self._cache_results(cache_keys[security_id], results)
+            yield security_id, params, results, False
 
-        match_results = match_buyers_and_sellers(buy_orders, sell_orders, banned_pairs)
+    def _match_securities(
+        self, matching_params, deadline=None, in_background=False, metrics=None
+    ):
+        """
+        Matches the orders of each security independently.
+
+        Yields (security ID, matching params, match results, whether they are known to be
+        optimal) for each security as soon as it is matched. With more than one worker, or in
+        the background, securities are matched in a process pool so that the calling process
+        stays responsive, and the order in which they are yielded is not deterministic. In the
+        background, that is the process pool of previews.
+        """
+        if not matching_params:
+            return
+        solver = self.config["ACQUITY_MATCH_SOLVER"]
+        max_workers = self.config["ACQUITY_MATCH_WORKERS"]
+        partial_fills = self.config["ACQUITY_MATCH_PARTIAL_FILLS"]
+
+        if not in_background and (max_workers <= 1 or len(matching_params) <= 1):
+            for security_id, params in matching_params.items():
+                results, stats = match_security(
+                    *params,
+                    partial_fills=partial_fills,
+                    with_stats=self._needs_stats(deadline, metrics),
+                    solver=solver,
+                    max_workers=max_workers,
+                    deadline=deadline,
+                )
+                self._log_match_stats(security_id, stats, metrics)
+                yield security_id, params, results, stats.get("optimal", True)
+            return
 
-        buy_order_to_buyer_dict = {
-            order["id"]: order["user_id"] for order in buy_orders
+        if in_background:
+            yield from self._match_in_pool(
+                self._get_preview_executor(), matching_params, deadline, metrics
+            )
+            return
+        with ProcessPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            yield from self._match_in_pool(executor, matching_params, deadline, metrics)
+
+    def _match_in_pool(self, executor, matching_params, deadline=None, metrics=None):
+        """
+        Same as _match_securities, in the given process pool.
+        """
+        futures = {
+            executor.submit(
+                match_security,
+                *params,
+                partial_fills=self.config["ACQUITY_MATCH_PARTIAL_FILLS"],
+                with_stats=self._needs_stats(deadline, metrics),
+                solver=self.config["ACQUITY_MATCH_SOLVER"],
+                deadline=deadline,
+            ): security_id
+            for security_id, params in matching_params.items()
         }
-        sell_order_to_seller_dict = {
-            order["id"]: order["user_id"] for order in sell_orders
+        try:
+            for future in as_completed(futures):
+                security_id = futures[future]
+                results, stats = future.result()
+                self._log_match_stats(security_id, stats, metrics)
+                yield (
+                    security_id,
+                    matching_params[security_id],
+                    results,
+                    stats.get("optimal", True),
+                )
+        finally:
+            # When the caller stops early, securities that are not being matched yet are
+            # dropped instead of being waited for
+            for future in futures:
+                future.cancel()
+
+    def _needs_stats(self, deadline, metrics):
+        """
+        Whether the matching engine should fill its stats: they are summed into metrics, and
+        tell whether a matching that may be cut short by the deadline, or be greedy, is
+        optimal. Otherwise the engine is not instrumented at all.
+        """
+        return (
+            metrics is not None
+            or deadline is not None
+            or self.config["ACQUITY_MATCH_SOLVER"] in ("auto", "greedy")
+        )
+
+    def _get_preview_executor(self):
+        # Previews run in threads of the web process, so the pool is started under a lock
+        with self._preview_executor_lock:
+            if self._preview_executor is None:
+                self._preview_executor = ProcessPoolExecutor(
+                    max_workers=max(self.config["ACQUITY_MATCH_WORKERS"], 1)
+                )
+            return self._preview_executor
+
+    def shutdown(self):
+        """
+        Stops the process pool of previews, if it was started.
+        """
+        with self._preview_executor_lock:
+            if self._preview_executor is not None:
+                self._preview_executor.shutdown()
+                self._preview_executor = None
+
+    def _get_cache_key(self, params):
+        """
+        Stable hash of the matching params of a security and of the settings of the matcher.
+        It does not depend on the order in which orders and banned pairs were loaded.
+        """
+        content = json.dumps(
+            [
+                get_fingerprint(params),
+                self.config["ACQUITY_MATCH_SOLVER"],
+                self.config["ACQUITY_MATCH_TIME_LIMIT"],
+                self.config["ACQUITY_MATCH_INCREMENTAL"],
+                self.config["ACQUITY_MATCH_PARTIAL_FILLS"],
+            ],
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _get_cached_results(self, cache_keys):
+        """
+        Params:
+        cache_keys: dict of security ID to cache key
+
+        Returns:
+        Dict of security ID to match results, for the securities whose results are cached.
+        """
+        min_created_at = (
+            datetime.now(timezone.utc) - self.config["ACQUITY_MATCH_CACHE_MAX_AGE"]
+        )
+        with session_scope() as session:
+            cached = {
+                entry.key: entry.results
+                for entry in session.query(MatchResultCache).filter(
+                    MatchResultCache.key.in_(list(cache_keys.values())),
+                    MatchResultCache.created_at >= min_created_at,
+                )
+            }
+        return {
+            security_id: {tuple(pair) for pair in json.loads(cached[key])}
+            for security_id, key in cache_keys.items()
+            if key in cached
         }
 
-        self._add_db_objects(
-            round_id, match_results, sell_order_to_seller_dict, buy_order_to_buyer_dict
+    def _cache_results(self, cache_key, match_results):
+        min_created_at = (
+            datetime.now(timezone.utc) - self.config["ACQUITY_MATCH_CACHE_MAX_AGE"]
+        )
+        with session_scope() as session:
+            session.query(MatchResultCache).filter(
+                MatchResultCache.created_at < min_created_at
+            ).delete(synchronize_session=False)
+            # The same results may be cached concurrently, e.g. by a preview and a round close
+            session.execute(
+                insert(MatchResultCache)
+                .values(
+                    key=cache_key,
+                    results=json.dumps(sorted(match_results), separators=(",", ":")),
+                )
+                .on_conflict_do_nothing(index_elements=["key"])
+            )
+
+    def _log_match_stats(self, security_id, stats, metrics=None):
+        if metrics is not None:
+            add_engine_stats(metrics["engine"], stats)
+        if stats.get("optimal", True):
+            return
+        print(
+            f"Matching of security {security_id} may not be optimal: "
+            f"{stats['greedy_components']} of {stats['components']} components were "
+            f"matched greedily, with {stats['matches']} first matches out of at most "
+            f"{stats['max_matches']}. Solver: {stats['solver']}, because "
+            + "; ".join(stats["solver_reasons"])
         )
-        self._send_emails(buy_orders, sell_orders, match_results)
 
-    def _get_matching_params(self, round_id):
+    def mark_provisional_matches_stale(self, round_id, security_ids=None):
+        """
+        Records that the orders of an open round changed, so that the match worker refreshes
+        the provisional matches of the given securities, or of all the securities with orders in
+        the round if security_ids is None. Nothing is matched here, since this is called on the
+        request path.
+        """
+        if (
+            not self.config["ACQUITY_MATCH_INCREMENTAL"]
+            or self.config["ACQUITY_MATCH_PARTIAL_FILLS"]
+        ):
+            return
+        active_round = RoundService(self.config).get_active()
+        if active_round is None or active_round["id"] != round_id:
+            return
+
+        with session_scope() as session:
+            if security_ids is None:
+                security_ids = [
+                    security_id
+                    for (security_id,) in session.query(BuyOrder.security_id)
+                    .filter_by(round_id=round_id)
+                    .union(
+                        session.query(SellOrder.security_id).filter_by(
+                            round_id=round_id
+                        )
+                    )
+                ]
+            if not security_ids:
+                return
+            # Rows are upserted in a fixed order, so that concurrent requests do not deadlock
+            # One multi-row statement, since psycopg2 cannot batch an upsert with parameters in
+            # its update
+            session.execute(
+                insert(ProvisionalMatch)
+                .values(
+                    [
+                        {"round_id": round_id, "security_id": security_id}
+                        for security_id in sorted(map(str, security_ids))
+                    ]
+                )
+                .on_conflict_do_update(
+                    index_elements=["round_id", "security_id"],
+                    set_={"version": ProvisionalMatch.version + 1},
+                )
+            )
+
+    def refresh_provisional_matches(self, should_stop=None):
+        """
+        Brings the provisional matches of the active round up to date with its orders. Each
+        security whose orders changed since its last refresh is rematched from its previous
+        provisional matching, which only repairs what changed. A security without one is
+        matched from scratch with the configured solver, within ACQUITY_MATCH_TIME_LIMIT, and
+        only keeps a matching to repair next time if it was matched with the "flow" solver
+        without a time limit. Run by the match worker.
+
+        Params:
+        should_stop: function called before each security, which returns whether to stop
+        refreshing, or None. Securities that are not reached stay stale.
+
+        Returns:
+        Number of securities that were stale, whether they were refreshed or not.
+        """
+        if (
+            not self.config["ACQUITY_MATCH_INCREMENTAL"]
+            or self.config["ACQUITY_MATCH_PARTIAL_FILLS"]
+        ):
+            return 0
+        active_round = RoundService(self.config).get_active()
+        if active_round is None:
+            return 0
+        round_id = active_round["id"]
+
         with session_scope() as session:
-            buy_orders = [
-                b.asdict()
-                for b in session.query(BuyOrder)
+            stale_matches = {
+                str(match.security_id): (
+                    match.version,
+                    match.fingerprint,
+                    match.warm_start,
+                )
+                for match in session.query(ProvisionalMatch).filter(
+                    ProvisionalMatch.round_id == round_id,
+                    or_(
+                        ProvisionalMatch.refreshed_version.is_(None),
+                        ProvisionalMatch.refreshed_version != ProvisionalMatch.version,
+                    ),
+                )
+            }
+        if not stale_matches:
+            return 0
+
+        matching_params = self._get_matching_params(round_id, list(stale_matches))
+        for security_id, (version, fingerprint, warm_start) in stale_matches.items():
+            if should_stop is not None and should_stop():
+                break
+            # Orders that change while the security is refreshed bump its version again, so
+            # that it is refreshed on the next call
+            values = {"refreshed_version": version}
+            params = matching_params.get(security_id)
+            if params is None:
+                # Securities without buy orders are not matched
+                values.update(fingerprint=None, results=None)
+            elif get_fingerprint_hash(params) != fingerprint:
+                values.update(self._refresh_provisional_match(params, warm_start))
+            with session_scope() as session:
+                session.query(ProvisionalMatch).filter_by(
+                    round_id=round_id, security_id=security_id
+                ).update(values, synchronize_session=False)
+        return len(stale_matches)
+
+    def _refresh_provisional_match(self, params, warm_start):
+        """
+        Rematches a security for refresh_provisional_matches.
+
+        Params:
+        params: matching params of the security
+        warm_start: stored state of its previous provisional matching, or None
+
+        Returns:
+        Dict of the columns of its ProvisionalMatch to update.
+        """
+        solver = self.config["ACQUITY_MATCH_SOLVER"]
+        deadline = None
+        if self.config["ACQUITY_MATCH_TIME_LIMIT"] is not None:
+            deadline = time() + self.config["ACQUITY_MATCH_TIME_LIMIT"]
+
+        if warm_start is not None or (solver == "flow" and deadline is None):
+            results, warm_start_state = rematch(
+                params, warm_start and json.loads(warm_start)
+            )
+            is_optimal = True
+            warm_start = json.dumps(warm_start_state, separators=(",", ":"))
+        else:
+            results, stats = match_security(
+                *params,
+                with_stats=self._needs_stats(deadline, None),
+                solver=solver,
+                max_workers=self.config["ACQUITY_MATCH_WORKERS"],
+                deadline=deadline,
+            )
+            is_optimal = stats.get("optimal", True)
+
+        if not is_optimal:
+            # Matched again on close, since it is not known to be optimal
+            return {"fingerprint": None, "results": None, "warm_start": None}
+        return {
+            "fingerprint": get_fingerprint_hash(params),
+            "results": json.dumps(sorted(results), separators=(",", ":")),
+            "warm_start": warm_start,
+        }
+
+    def _match_provisionally(
+        self,
+        round_id,
+        matching_params,
+        deadline=None,
+        in_background=False,
+        metrics=None,
+    ):
+        """
+        Same as _match_securities, but reuses the provisional matches of the round. Securities
+        whose provisional matches were not computed from their current orders and bans are
+        matched by _match_securities. With a metrics dict, counts the reused securities in it.
+        """
+        with session_scope() as session:
+            provisional_matches = {
+                str(match.security_id): (match.fingerprint, match.results)
+                for match in session.query(ProvisionalMatch).filter(
+                    ProvisionalMatch.round_id == round_id,
+                    ProvisionalMatch.security_id.in_(list(matching_params)),
+                    ProvisionalMatch.fingerprint.isnot(None),
+                )
+            }
+
+        unmatched_params = {}
+        for security_id, params in matching_params.items():
+            fingerprint, results = provisional_matches.get(security_id, (None, None))
+            if fingerprint == get_fingerprint_hash(params):
+                # Warm started matchings are exact
+                results = {tuple(pair) for pair in json.loads(results)}
+                yield security_id, params, results, True
+            else:
+                unmatched_params[security_id] = params
+        if metrics is not None:
+            metrics["provisional_securities"] = len(matching_params) - len(
+                unmatched_params
+            )
+
+        yield from self._match_securities(
+            unmatched_params,
+            deadline=deadline,
+            in_background=in_background,
+            metrics=metrics,
+        )
+
+    def _get_matching_params(self, round_id, security_ids=None):
+        """
+        Returns a dict of security ID to (buy_orders, sell_orders, banned_pairs), which are the
+        arguments to match_buyers_and_sellers for the orders of that security. Only loads the
+        given securities, or all of them if security_ids is None.
+        """
+        buy_orders = {}
+        sell_orders = {}
+
+        def get_order_books(security_id):
+            if security_id not in buy_orders:
+                buy_orders[security_id] = OrderBook()
+                sell_orders[security_id] = OrderBook(
+                    users=buy_orders[security_id].users
+                )
+            return buy_orders[security_id], sell_orders[security_id]
+
+        with session_scope() as session:
+            buy_order_query = (
+                session.query(BuyOrder)
                 .join(User, User.id == BuyOrder.user_id)
                 .filter(BuyOrder.round_id == round_id, User.can_buy)
-                .all()
-            ]
-            sell_orders = [
-                s.asdict()
-                for s in session.query(SellOrder)
+            )
+            sell_order_query = (
+                session.query(SellOrder)
                 .join(User, User.id == SellOrder.user_id)
                 .filter(SellOrder.round_id == round_id, User.can_sell)
-                .all()
-            ]
-            banned_pairs = [
-                (bp.buyer_id, bp.seller_id) for bp in session.query(BannedPair).all()
-            ]
+            )
 
-        return buy_orders, self._double_sell_orders(sell_orders), banned_pairs
+            round_sell_order_query = sell_order_query
+            if security_ids is not None:
+                buy_order_query = buy_order_query.filter(
+                    BuyOrder.security_id.in_(security_ids)
+                )
+                sell_order_query = sell_order_query.filter(
+                    SellOrder.security_id.in_(security_ids)
+                )
 
-    def _double_sell_orders(self, sell_orders):
-        seller_counts = defaultdict(lambda: 0)
-        for sell_order in sell_orders:
-            seller_counts[sell_order["user_id"]] += 1
+            # Sell orders are doubled based on their seller's orders across all securities
+            seller_counts = dict(
+                round_sell_order_query.filter(
+                    SellOrder.user_id.in_(
+                        sell_order_query.with_entities(SellOrder.user_id)
+                    )
+                )
+                .with_entities(SellOrder.user_id, func.count())
+                .group_by(SellOrder.user_id)
+                .all()
+            )
 
-        new_sell_orders = []
-        for sell_order in sell_orders:
-            new_sell_orders.append(sell_order)
-            if seller_counts[sell_order["user_id"]] == 1:
-                new_sell_orders.append(sell_order)
+            # Orders are streamed as plain rows of the columns the matcher needs, without
+            # building ORM objects. IDs are read as text, which skips building UUID objects.
+            order_rows = (
+                (
+                    0,
+                    buy_order_query.with_entities(
+                        BuyOrder.id.cast(String),
+                        BuyOrder.user_id.cast(String),
+                        BuyOrder.price,
+                        BuyOrder.number_of_shares,
+                        BuyOrder.security_id.cast(String),
+                    ),
+                ),
+                (
+                    1,
+                    sell_order_query.with_entities(
+                        SellOrder.id.cast(String),
+                        SellOrder.user_id.cast(String),
+                        SellOrder.price,
+                        SellOrder.number_of_shares,
+                        SellOrder.security_id.cast(String),
+                    ),
+                ),
+            )
+            for side, query in order_rows:
+                for rows in stream_rows(session, query):
+                    for id, user_id, price, number_of_shares, security_id in rows:
+                        book = get_order_books(security_id)[side]
+                        book.append(id, user_id, price, number_of_shares)
+                        # Sellers with only one sell order in the round get it twice
+                        if side == 1 and seller_counts[user_id] == 1:
+                            book.append(id, user_id, price, number_of_shares)
+
+            # Only bans between a buyer and a seller of this round can affect the matching
+            banned_pairs = (
+                session.query(BannedPair.buyer_id, BannedPair.seller_id)
+                .filter(
+                    BannedPair.buyer_id.in_(
+                        buy_order_query.with_entities(BuyOrder.user_id)
+                    ),
+                    BannedPair.seller_id.in_(
+                        sell_order_query.with_entities(SellOrder.user_id)
+                    ),
+                )
+                .all()
+            )
 
-        return new_sell_orders
+        return {
+            security_id: (
+                buy_orders[security_id],
+                sell_orders[security_id],
+                BannedPairIndex.from_pairs(buy_orders[security_id].users, banned_pairs),
+            )
+            for security_id in buy_orders
+        }
 
     def _add_db_objects(
         self,
-        round_id,
+        session,
         match_results,
         sell_order_to_seller_dict,
         buy_order_to_buyer_dict,
     ):
+        """
+        Inserts the matches and the chat rooms of their users with multi-row inserts. A match
+        that already exists, e.g. from a run racing this one, is kept as it is, and so is a
+        chat room that already exists between the same seller and buyer, e.g. from a previous
+        round or from a retried run.
+        """
+        matches = [dict(zip(MATCH_COLUMNS, match)) for match in sorted(match_results)]
+        chat_rooms = [
+            {"seller_id": seller_id, "buyer_id": buyer_id}
+            for seller_id, buyer_id in sorted(
+                {
+                    (
+                        sell_order_to_seller_dict[sell_order_id],
+                        buy_order_to_buyer_dict[buy_order_id],
+                    )
+                    for buy_order_id, sell_order_id, *_ in match_results
+                }
+            )
+        ]
+        if not matches:
+            return
+
+        session.execute(
+            insert(Match).on_conflict_do_nothing(
+                index_elements=["buy_order_id", "sell_order_id"]
+            ),
+            matches,
+        )
+        session.execute(
+            insert(ChatRoom).on_conflict_do_nothing(
+                index_elements=["seller_id", "buyer_id"]
+            ),
+            chat_rooms,
+        )
+
+    def _conclude_round(self, session, round_id):
+        session.query(Round).get(round_id).is_concluded = True
+        session.query(ProvisionalMatch).filter_by(round_id=round_id).delete(
+            synchronize_session=False
+        )
+
+    def _send_emails(self, user_ids, template):
+        if not user_ids:
+            return
         with session_scope() as session:
-            for buy_order_id, sell_order_id in match_results:
-                match = Match(buy_order_id=buy_order_id, sell_order_id=sell_order_id)
-                chat_room = ChatRoom(
-                    seller_id=sell_order_to_seller_dict[sell_order_id],
-                    buyer_id=buy_order_to_buyer_dict[buy_order_id],
+            emails = [
+                user.email
+                for user in session.query(User).filter(User.id.in_(user_ids)).all()
+            ]
+        self.email_service.send_email(emails, template=template)
+
+
+def ignore_progress(phase, fraction):
+    pass
+
+
+def is_never_cancelled(session):
+    return False
+
+
+def is_stage_reached(stage, target_stage):
+    """
+    Whether a round close whose last completed stage is stage, or None, has completed
+    target_stage.
+    """
+    return stage is not None and ROUND_CLOSE_STAGES.index(
+        stage
+    ) >= ROUND_CLOSE_STAGES.index(target_stage)
+
+
+def get_matched_user_ids(buy_orders, sell_orders, match_results):
+    matched_order_ids = set()
+    for buy_order_id, sell_order_id, *_ in match_results:
+        matched_order_ids.add(buy_order_id)
+        matched_order_ids.add(sell_order_id)
+    return {
+        order["user_id"]
+        for order in chain(buy_orders, sell_orders)
+        if order["id"] in matched_order_ids
+    }
+
+
+def match_security(
+    buy_orders,
+    sell_orders,
+    banned_pairs,
+    partial_fills=False,
+    with_stats=True,
+    **kwargs,
+):
+    """
+    Same as match_buyers_and_sellers, but also returns its stats, so that they can be sent back
+    from a worker process. Without with_stats, the stats are empty and are not collected. With
+    partial_fills, matches with match_with_partial_fills instead, which takes no other
+    arguments and has no stats.
+
+    Returns:
+    (match results, stats)
+    """
+    if partial_fills:
+        return match_with_partial_fills(buy_orders, sell_orders, banned_pairs), {}
+
+    stats = {}
+    results = match_buyers_and_sellers(
+        buy_orders,
+        sell_orders,
+        banned_pairs,
+        stats=stats if with_stats else None,
+        **kwargs,
+    )
+    return results, stats
+
+
+def add_engine_stats(totals, stats):
+    """
+    Adds the counters and phase timings of the stats of match_buyers_and_sellers to totals.
+    """
+    for key in ENGINE_COUNTERS:
+        if key in stats:
+            totals[key] = totals.get(key, 0) + stats[key]
+    seconds = totals.setdefault("seconds", {})
+    for phase, phase_seconds in stats.get("seconds", {}).items():
+        seconds[phase] = seconds.get(phase, 0) + phase_seconds
+
+
+def timed_iteration(iterable, metrics, phase):
+    """
+    Yields the items of iterable, adding the time spent getting each of them to the phase of
+    metrics, like timed.
+    """
+    iterator = iter(iterable)
+    while True:
+        with timed(metrics, phase):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+
+def get_lock_key(id):
+    """
+    Key of the Postgres advisory lock of a row, from its UUID.
+    """
+    return UUID(str(id)).int >> 65
+
+
+def stream_rows(session, query, batch_size=ORDER_LOAD_BATCH_SIZE):
+    """
+    Runs a query of columns with a server-side cursor, without going through the ORM.
+
+    Yields lists of at most batch_size rows.
+    """
+    result = session.execute(query.statement.execution_options(stream_results=True))
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+class MatchJobService:
+    """
+    Queue of round closes, which are run by the match worker (src/match_worker.py) in its own
+    process. A job is enqueued when a round is created, and is claimed once the round ends.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def run_next(self):
+        """
+        Claims the next job whose round has ended, and runs it.
+
+        Returns:
+        The job as it was claimed, or None if there is no job to run.
+        """
+        # The advisory lock of the job is held on this connection for as long as it runs
+        with engine.connect() as lock_connection:
+            job = self._claim(lock_connection)
+            if job is None:
+                return None
+
+            try:
+                metrics = MatchService(self.config).run_matches(
+                    round_id=job["round_id"],
+                    progress=lambda phase, fraction: self._report_progress(
+                        job["id"], phase, fraction
+                    ),
+                    is_cancelled=lambda session: self._is_cancel_requested(
+                        job["id"], session
+                    ),
+                )
+            except MatchJobCancelledException:
+                self._finish(job["id"], "CANCELLED")
+            except Exception:
+                self._fail(job["id"], error=traceback.format_exc())
+            else:
+                self._finish(job["id"], "DONE", metrics=metrics)
+            finally:
+                lock_connection.execute(
+                    select(
+                        [func.pg_advisory_unlock(get_lock_key(job["id"]))]
+                    ).execution_options(autocommit=True)
+                )
+            return job
+
+    def _claim(self, lock_connection):
+        """
+        Claims the next job whose round has ended, and takes its advisory lock on
+        lock_connection.
+
+        The worker running a job holds its lock until the job is finished. Postgres releases it
+        if the worker dies, however long the job has been running without reporting progress,
+        so a running job whose lock can be taken lost its worker, and is resumed.
+        """
+        now = datetime.now(timezone.utc)
+        with session_scope() as session:
+            # Skipping locked rows lets several workers poll the same queue
+            jobs = (
+                session.query(MatchJob)
+                .filter(
+                    MatchJob.status.in_(["PENDING", "RUNNING"]), MatchJob.run_at <= now
                 )
-                session.add_all([match, chat_room])
+                .order_by(MatchJob.run_at)
+                .with_for_update(skip_locked=True)
+            )
+            for job in jobs:
+                # Committed right away, so that the connection is not left idle in a
+                # transaction while the job runs
+                if lock_connection.execute(
+                    select(
+                        [func.pg_try_advisory_lock(get_lock_key(job.id))]
+                    ).execution_options(autocommit=True)
+                ).scalar():
+                    job.status = "RUNNING"
+                    job.updated_at = now
+                    return job.asdict()
+            return None
+
+    def _report_progress(self, id, phase, fraction):
+        with session_scope() as session:
+            job = session.query(MatchJob).get(id)
+            job.phase = phase
+            job.progress = fraction
+
+    @staticmethod
+    def _is_cancel_requested(id, session):
+        """
+        Locks the job until the end of the transaction of the session, so that cancel_job
+        either comes first and stops it, or sees what the transaction saved.
+        """
+        return (
+            session.query(MatchJob)
+            .filter_by(id=id)
+            .with_for_update()
+            .one()
+            .is_cancel_requested
+        )
 
-            session.query(Round).get(round_id).is_concluded = True
+    def has_due_job(self):
+        """
+        Whether a pending match job is due, which the match worker should run before anything
+        else.
+        """
+        with session_scope() as session:
+            return session.query(
+                session.query(MatchJob)
+                .filter(
+                    MatchJob.status == "PENDING",
+                    MatchJob.run_at <= datetime.now(timezone.utc),
+                )
+                .exists()
+            ).scalar()
 
-    def _send_emails(self, buy_orders, sell_orders, match_results):
-        matched_uuids = set()
-        for buy_order_uuid, sell_order_uuid in match_results:
-            matched_uuids.add(buy_order_uuid)
-            matched_uuids.add(sell_order_uuid)
+    def _finish(self, id, status, error=None, metrics=None):
+        with session_scope() as session:
+            job = session.query(MatchJob).get(id)
+            job.status = status
+            job.error = error
+            if metrics is not None:
+                job.metrics = json.dumps(metrics)
+
+    def _fail(self, id, error):
+        """
+        Records a failed run. The job is pending again, to be resumed from the checkpoints of
+        its round after a backoff, unless it failed ACQUITY_MATCH_JOB_MAX_ATTEMPTS times.
+        """
+        with session_scope() as session:
+            job = session.query(MatchJob).get(id)
+            job.attempts += 1
+            job.error = error
+            if job.attempts >= self.config["ACQUITY_MATCH_JOB_MAX_ATTEMPTS"]:
+                job.status = "FAILED"
+                return
+            job.status = "PENDING"
+            job.run_at = datetime.now(timezone.utc) + self.config[
+                "ACQUITY_MATCH_JOB_RETRY_DELAY"
+            ] * 2 ** (job.attempts - 1)
 
-        all_user_ids = set()
-        matched_user_ids = set()
-        for buy_order in buy_orders:
-            all_user_ids.add(buy_order["user_id"])
-            if buy_order["id"] in matched_uuids:
-                matched_user_ids.add(buy_order["user_id"])
-        for sell_order in sell_orders:
-            all_user_ids.add(sell_order["user_id"])
-            if sell_order["id"] in matched_uuids:
-                matched_user_ids.add(sell_order["user_id"])
+    @staticmethod
+    def _serialize_job(job):
+        return {**job.asdict(), "metrics": job.metrics and json.loads(job.metrics)}
 
+    @validate_input({"round_id": UUID_RULE, "subject_id": UUID_RULE})
+    def get_job(self, round_id, subject_id):
         with session_scope() as session:
-            matched_emails = [
-                user.email
-                for user in session.query(User)
-                .filter(User.id.in_(matched_user_ids))
-                .all()
-            ]
-            self.email_service.send_email(
-                matched_emails, template="match_done_has_match"
+            if not session.query(User).get(subject_id).is_committee:
+                raise InvisibleUnauthorizedException("Not committee")
+
+            job = (
+                session.query(MatchJob)
+                .filter_by(round_id=round_id)
+                .order_by(MatchJob.created_at.desc())
+                .first()
             )
+            if job is None:
+                raise ResourceNotFoundException("Match job not found")
+            return MatchJobService._serialize_job(job)
+
+    @validate_input({"round_id": UUID_RULE, "subject_id": UUID_RULE})
+    def cancel_job(self, round_id, subject_id):
+        """
+        Cancels the match job of a round. A pending job is cancelled right away, and a running
+        one stops before it saves the matches of its first security. A job that already saved
+        some cannot be cancelled, since the round would be left half closed.
+
+        A cancelled round is left ended but not concluded, without matches, until its job is
+        resubmitted (see resubmit_job).
+        """
+        with session_scope() as session:
+            if not session.query(User).get(subject_id).is_committee:
+                raise InvisibleUnauthorizedException("Not committee")
 
-            unmatched_emails = [
-                user.email
-                for user in session.query(User)
-                .filter(User.id.in_(all_user_ids - matched_user_ids))
-                .all()
-            ]
-            self.email_service.send_email(
-                unmatched_emails, template="match_done_no_match"
+            job = (
+                session.query(MatchJob)
+                .filter(
+                    MatchJob.round_id == round_id,
+                    MatchJob.status.in_(["PENDING", "RUNNING"]),
+                )
+                .with_for_update()
+                .one_or_none()
             )
+            if job is None:
+                raise ResourceNotFoundException("Match job not found")
+
+            # Read under the lock of the job, which the worker takes to save matches
+            if (
+                session.query(RoundCloseCheckpoint)
+                .filter(
+                    RoundCloseCheckpoint.round_id == round_id,
+                    RoundCloseCheckpoint.stage >= "PERSISTED",
+                )
+                .count()
+            ):
+                raise InvalidRequestException(
+                    "Match job already saved matches, and can no longer be cancelled"
+                )
+
+            job.is_cancel_requested = True
+            if job.status == "PENDING":
+                job.status = "CANCELLED"
+            return MatchJobService._serialize_job(job)
+
+    @validate_input({"round_id": UUID_RULE, "subject_id": UUID_RULE})
+    def resubmit_job(self, round_id, subject_id):
+        """
+        Runs the cancelled or failed match job of a round again, right away. Securities whose
+        matches were not saved yet are matched again from their current orders, and the run
+        resumes after the last completed stage of the others.
+        """
+        with session_scope() as session:
+            if not session.query(User).get(subject_id).is_committee:
+                raise InvisibleUnauthorizedException("Not committee")
+
+            job = (
+                session.query(MatchJob)
+                .filter_by(round_id=round_id)
+                .order_by(MatchJob.created_at.desc())
+                .with_for_update()
+                .first()
+            )
+            if job is None:
+                raise ResourceNotFoundException("Match job not found")
+            if job.status not in ("CANCELLED", "FAILED"):
+                raise InvalidRequestException(
+                    "Only a cancelled or failed match job can be resubmitted"
+                )
+            if session.query(Round).get(round_id).is_concluded:
+                raise InvalidRequestException("Round is already concluded")
+
+            session.query(RoundCloseCheckpoint).filter(
+                RoundCloseCheckpoint.round_id == round_id,
+                RoundCloseCheckpoint.stage < "PERSISTED",
+            ).delete(synchronize_session=False)
+
+            job.status = "PENDING"
+            job.run_at = datetime.now(timezone.utc)
+            job.is_cancel_requested = False
+            job.attempts = 0
+            job.phase = None
+            job.progress = 0
+            job.error = None
+            session.flush()
+            return MatchJobService._serialize_job(job)
 
 
 class BannedPairService:
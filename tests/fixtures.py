@@ -4,6 +4,7 @@ from src.database import (
     BannedPair,
     BuyOrder,
     Match,
+    MatchJob,
     Round,
     Security,
     SellOrder,
@@ -53,6 +54,10 @@ def attributes_for_match(id=0, **kwargs):
     return {"number_of_shares": 20 + int(id), "price": 30 + int(id), **kwargs}
 
 
+def attributes_for_match_job(id=0, **kwargs):
+    return {"run_at": datetime.now() - timedelta(minutes=1 + int(id)), **kwargs}
+
+
 def attributes_for_round(id=0, **kwargs):
     return {
         "end_time": datetime.now() + timedelta(days=1 + int(id)),
@@ -129,6 +134,19 @@ def create_match(id=0, **kwargs):
         return match.asdict()
 
 
+def create_match_job(id=0, **kwargs):
+    with session_scope() as session:
+        match_job = MatchJob(
+            **combine_dicts(
+                attributes_for_match_job(id, **kwargs),
+                {"round_id": lambda: create_round(id)["id"]},
+            )
+        )
+        session.add(match_job)
+        session.commit()
+        return match_job.asdict()
+
+
 def create_round(id=0, **kwargs):
     with session_scope() as session:
         round = Round(**attributes_for_round(id, **kwargs))
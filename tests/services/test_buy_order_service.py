@@ -200,3 +200,20 @@ def test_delete_order():
 
     with session_scope() as session:
         assert session.query(BuyOrder).filter_by(id=buy_order_id).count() == 0
+
+
+def test_edit_order__incremental_match():
+    incremental_buy_order_service = BuyOrderService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round_id = create_round()["id"]
+    user_id = create_user()["id"]
+    buy_order = create_buy_order(user_id=user_id, round_id=round_id)
+
+    with patch("src.services.EmailService.send_email"), patch(
+        "src.services.MatchService.mark_provisional_matches_stale"
+    ) as mock_update:
+        incremental_buy_order_service.edit_order(
+            id=buy_order["id"], subject_id=user_id, new_price=10
+        )
+        mock_update.assert_called_once_with(round_id, [buy_order["security_id"]])
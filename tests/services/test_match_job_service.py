@@ -0,0 +1,386 @@
+from datetime import datetime, timedelta
+from threading import Thread
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import func, select
+
+from src.config import APP_CONFIG
+from src.database import (
+    Match,
+    MatchJob,
+    Round,
+    RoundCloseCheckpoint,
+    Security,
+    engine,
+    session_scope,
+)
+from src.exceptions import (
+    InvalidRequestException,
+    InvisibleUnauthorizedException,
+    ResourceNotFoundException,
+)
+from src.services import MatchJobService, MatchService, get_lock_key
+from tests.fixtures import (
+    create_buy_order,
+    create_match_job,
+    create_round,
+    create_security,
+    create_sell_order,
+    create_user,
+)
+
+match_job_service = MatchJobService(config=APP_CONFIG)
+
+
+def create_matchable_round():
+    round = create_round(end_time=datetime.now() - timedelta(minutes=1))
+    security = create_security()
+    buy_order = create_buy_order(
+        "1",
+        round_id=round["id"],
+        user_id=create_user("1")["id"],
+        security_id=security["id"],
+    )
+    create_sell_order(
+        "2",
+        round_id=round["id"],
+        user_id=create_user("2")["id"],
+        security_id=security["id"],
+        price=buy_order["price"],
+    )
+    return round
+
+
+def test_run_next():
+    round = create_matchable_round()
+    match_job = create_match_job(round_id=round["id"])
+
+    with patch("src.services.EmailService.send_email"):
+        assert match_job_service.run_next()["id"] == match_job["id"]
+
+    with session_scope() as session:
+        job = session.query(MatchJob).get(match_job["id"])
+        assert job.status == "DONE"
+        assert job.phase == "notifying"
+        assert job.progress == 1
+        assert session.query(Match).count() == 1
+        assert session.query(Round).get(round["id"]).is_concluded
+
+    committee_user = create_user("3", is_committee=True)
+    metrics = match_job_service.get_job(
+        round_id=round["id"], subject_id=committee_user["id"]
+    )["metrics"]
+    assert metrics["round_id"] == round["id"]
+    assert metrics["matches"] == 1
+
+    assert match_job_service.run_next() is None
+
+
+def test_run_next__stale():
+    round = create_matchable_round()
+    running_job = create_match_job(round_id=round["id"], status="RUNNING")
+    lock_key = get_lock_key(running_job["id"])
+
+    # The worker running the job holds its lock, however long it has been running
+    with engine.connect() as worker_connection:
+        assert worker_connection.execute(
+            select([func.pg_try_advisory_lock(lock_key)])
+        ).scalar()
+        with session_scope() as session:
+            session.query(MatchJob).get(
+                running_job["id"]
+            ).updated_at = datetime.now() - timedelta(days=1)
+
+        with patch("src.services.MatchService.run_matches") as mock_run_matches:
+            assert match_job_service.run_next() is None
+            mock_run_matches.assert_not_called()
+
+        # The worker died, so another worker resumes the job
+        worker_connection.execute(select([func.pg_advisory_unlock(lock_key)]))
+
+    with patch("src.services.EmailService.send_email"):
+        assert match_job_service.run_next()["id"] == running_job["id"]
+
+    with session_scope() as session:
+        assert session.query(MatchJob).get(running_job["id"]).status == "DONE"
+        assert session.query(Round).get(round["id"]).is_concluded
+
+    # The lock is released once the job is finished
+    with engine.connect() as connection:
+        assert connection.execute(
+            select([func.pg_try_advisory_lock(lock_key)])
+        ).scalar()
+        connection.execute(select([func.pg_advisory_unlock(lock_key)]))
+
+
+def test_run_next__not_due():
+    create_match_job(run_at=datetime.now() + timedelta(days=1))
+
+    with patch("src.services.MatchService.run_matches") as mock_run_matches:
+        assert match_job_service.run_next() is None
+        mock_run_matches.assert_not_called()
+
+
+def test_run_next__cancelled():
+    round = create_matchable_round()
+    # Cancellation requested after the job was claimed
+    match_job = create_match_job(round_id=round["id"], is_cancel_requested=True)
+
+    with patch("src.services.EmailService.send_email"):
+        match_job_service.run_next()
+
+    with session_scope() as session:
+        assert session.query(MatchJob).get(match_job["id"]).status == "CANCELLED"
+        assert session.query(Match).count() == 0
+        assert not session.query(Round).get(round["id"]).is_concluded
+
+
+def test_run_next__failed():
+    match_job = create_match_job()
+
+    with patch("src.services.MatchService.run_matches", side_effect=RuntimeError):
+        match_job_service.run_next()
+
+    with session_scope() as session:
+        job = session.query(MatchJob).get(match_job["id"])
+        assert job.status == "PENDING"
+        assert job.attempts == 1
+        assert job.run_at > datetime.now(job.run_at.tzinfo)
+        assert "RuntimeError" in job.error
+
+    # Not due again until the retry delay has passed
+    assert match_job_service.run_next() is None
+
+
+def test_run_next__failed_too_often():
+    match_job = create_match_job()
+    config = {
+        **APP_CONFIG,
+        "ACQUITY_MATCH_JOB_MAX_ATTEMPTS": 2,
+        "ACQUITY_MATCH_JOB_RETRY_DELAY": timedelta(0),
+    }
+
+    with patch("src.services.MatchService.run_matches", side_effect=RuntimeError):
+        MatchJobService(config=config).run_next()
+        MatchJobService(config=config).run_next()
+        assert MatchJobService(config=config).run_next() is None
+
+    with session_scope() as session:
+        job = session.query(MatchJob).get(match_job["id"])
+        assert job.status == "FAILED"
+        assert job.attempts == 2
+        assert "RuntimeError" in job.error
+
+
+def test_run_next__retried():
+    round = create_matchable_round()
+    match_job = create_match_job(round_id=round["id"])
+    service = MatchJobService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_JOB_RETRY_DELAY": timedelta(0)}
+    )
+
+    with patch("src.services.MatchService._send_emails", side_effect=RuntimeError):
+        service.run_next()
+
+    with session_scope() as session:
+        job = session.query(MatchJob).get(match_job["id"])
+        assert job.status == "PENDING"
+        assert session.query(Match).count() == 1
+        assert not session.query(Round).get(round["id"]).is_concluded
+
+    # The retry resumes from the checkpoints, and finishes closing the round
+    with patch("src.services.EmailService.send_email"):
+        assert service.run_next()["id"] == match_job["id"]
+
+    with session_scope() as session:
+        job = session.query(MatchJob).get(match_job["id"])
+        assert job.status == "DONE"
+        assert session.query(Match).count() == 1
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_has_due_job():
+    assert not match_job_service.has_due_job()
+
+    match_job = create_match_job(run_at=datetime.now() + timedelta(minutes=1))
+    assert not match_job_service.has_due_job()
+
+    with session_scope() as session:
+        session.query(MatchJob).get(match_job["id"]).run_at = datetime.now()
+    assert match_job_service.has_due_job()
+
+
+def test_get_job():
+    committee_user = create_user("1", is_committee=True)
+    user = create_user("2", is_committee=False)
+    match_job = create_match_job()
+
+    assert (
+        match_job_service.get_job(
+            round_id=match_job["round_id"], subject_id=committee_user["id"]
+        )["id"]
+        == match_job["id"]
+    )
+    with pytest.raises(InvisibleUnauthorizedException):
+        match_job_service.get_job(round_id=match_job["round_id"], subject_id=user["id"])
+    with pytest.raises(ResourceNotFoundException):
+        match_job_service.get_job(
+            round_id=create_round("1")["id"], subject_id=committee_user["id"]
+        )
+
+
+def test_cancel_job():
+    committee_user = create_user("1", is_committee=True)
+    match_job = create_match_job()
+
+    cancelled_job = match_job_service.cancel_job(
+        round_id=match_job["round_id"], subject_id=committee_user["id"]
+    )
+    assert cancelled_job["status"] == "CANCELLED"
+
+    with patch("src.services.MatchService.run_matches") as mock_run_matches:
+        assert match_job_service.run_next() is None
+        mock_run_matches.assert_not_called()
+
+    with pytest.raises(ResourceNotFoundException):
+        match_job_service.cancel_job(
+            round_id=match_job["round_id"], subject_id=committee_user["id"]
+        )
+
+
+def test_cancel_job__running():
+    committee_user = create_user("1", is_committee=True)
+    match_job = create_match_job(status="RUNNING", phase="matching")
+
+    cancelled_job = match_job_service.cancel_job(
+        round_id=match_job["round_id"], subject_id=committee_user["id"]
+    )
+    assert cancelled_job["status"] == "RUNNING"
+    assert cancelled_job["is_cancel_requested"]
+
+    # Once matches are saved, the round has to be closed
+    with session_scope() as session:
+        session.add(
+            RoundCloseCheckpoint(
+                round_id=match_job["round_id"],
+                security_id=create_security()["id"],
+                stage="PERSISTED",
+            )
+        )
+    with pytest.raises(InvalidRequestException):
+        match_job_service.cancel_job(
+            round_id=match_job["round_id"], subject_id=committee_user["id"]
+        )
+
+
+def test_cancel_job__while_saving_matches():
+    committee_user = create_user("3", is_committee=True)
+    round = create_matchable_round()
+    match_job = create_match_job(round_id=round["id"])
+    add_db_objects = MatchService._add_db_objects
+    cancellations = []
+    threads = []
+
+    def cancel():
+        try:
+            match_job_service.cancel_job(
+                round_id=round["id"], subject_id=committee_user["id"]
+            )
+        except InvalidRequestException as e:
+            cancellations.append(e)
+
+    def add_db_objects_while_cancelling(self, *args, **kwargs):
+        # The cancel waits for the matches to be saved, and then sees them
+        thread = Thread(target=cancel)
+        threads.append(thread)
+        thread.start()
+        thread.join(timeout=0.5)
+        assert thread.is_alive()
+        return add_db_objects(self, *args, **kwargs)
+
+    with patch(
+        "src.services.MatchService._add_db_objects",
+        autospec=True,
+        side_effect=add_db_objects_while_cancelling,
+    ), patch("src.services.EmailService.send_email"):
+        match_job_service.run_next()
+    threads[0].join()
+
+    assert len(cancellations) == 1
+    with session_scope() as session:
+        assert session.query(MatchJob).get(match_job["id"]).status == "DONE"
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_resubmit_job():
+    committee_user = create_user("3", is_committee=True)
+    round = create_matchable_round()
+    match_job = create_match_job(round_id=round["id"])
+    match_job_service.cancel_job(round_id=round["id"], subject_id=committee_user["id"])
+
+    resubmitted_job = match_job_service.resubmit_job(
+        round_id=round["id"], subject_id=committee_user["id"]
+    )
+    assert resubmitted_job["id"] == match_job["id"]
+    assert resubmitted_job["status"] == "PENDING"
+    assert not resubmitted_job["is_cancel_requested"]
+
+    with patch("src.services.EmailService.send_email"):
+        assert match_job_service.run_next()["id"] == match_job["id"]
+
+    with session_scope() as session:
+        assert session.query(MatchJob).get(match_job["id"]).status == "DONE"
+        assert session.query(Match).count() == 1
+        assert session.query(Round).get(round["id"]).is_concluded
+
+    with pytest.raises(InvalidRequestException):
+        match_job_service.resubmit_job(
+            round_id=round["id"], subject_id=committee_user["id"]
+        )
+
+
+def test_resubmit_job__failed():
+    committee_user = create_user("3", is_committee=True)
+    round = create_matchable_round()
+    match_job = create_match_job(
+        round_id=round["id"], status="FAILED", attempts=5, error="RuntimeError"
+    )
+    # Unsaved results of the failed run are not reused
+    with session_scope() as session:
+        security_id = session.query(Security).one().id
+        session.add(
+            RoundCloseCheckpoint(
+                round_id=round["id"], security_id=str(security_id), stage="MATCHED"
+            )
+        )
+
+    resubmitted_job = match_job_service.resubmit_job(
+        round_id=round["id"], subject_id=committee_user["id"]
+    )
+    assert resubmitted_job["status"] == "PENDING"
+    assert resubmitted_job["attempts"] == 0
+    assert resubmitted_job["error"] is None
+
+    with patch("src.services.EmailService.send_email"):
+        assert match_job_service.run_next()["id"] == match_job["id"]
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 1
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_resubmit_job__invalid():
+    committee_user = create_user("3", is_committee=True)
+    match_job = create_match_job()
+
+    with pytest.raises(InvalidRequestException):
+        match_job_service.resubmit_job(
+            round_id=match_job["round_id"], subject_id=committee_user["id"]
+        )
+
+    with pytest.raises(InvisibleUnauthorizedException):
+        match_job_service.resubmit_job(
+            round_id=match_job["round_id"],
+            subject_id=create_user("4", is_committee=False)["id"],
+        )
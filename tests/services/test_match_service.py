@@ -1,12 +1,31 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 from unittest.mock import call, patch
 
+import pytest
+from sqlalchemy import String
+
 from src.config import APP_CONFIG
-from src.database import ChatRoom, Match, Round, session_scope
-from src.services import MatchService
+from src.database import (
+    BuyOrder,
+    ChatRoom,
+    Match,
+    MatchResultCache,
+    ProvisionalMatch,
+    Round,
+    RoundCloseCheckpoint,
+    SellOrder,
+    session_scope,
+)
+from src.exceptions import InvisibleUnauthorizedException, MatchJobCancelledException
+from src.provisional_match import rematch
+from src.services import MatchService, stream_rows
 from tests.fixtures import (
     create_banned_pair,
     create_buy_order,
     create_round,
+    create_security,
     create_sell_order,
     create_user,
 )
@@ -16,18 +35,27 @@ match_service = MatchService(config=APP_CONFIG)
 
 def test_run_matches():
     round = create_round()
+    security = create_security()
 
     buy_user = create_user("1")
     buy_user2 = create_user("2")
     sell_user = create_user("3")
     sell_user2 = create_user("4")
 
-    buy_order = create_buy_order("1", round_id=round["id"], user_id=buy_user["id"])
+    buy_order = create_buy_order(
+        "1", round_id=round["id"], user_id=buy_user["id"], security_id=security["id"]
+    )
     buy_order_id = buy_order["id"]
-    create_buy_order("2", round_id=round["id"], user_id=buy_user2["id"])
-    sell_order = create_sell_order("3", round_id=round["id"], user_id=sell_user["id"])
+    create_buy_order(
+        "2", round_id=round["id"], user_id=buy_user2["id"], security_id=security["id"]
+    )
+    sell_order = create_sell_order(
+        "3", round_id=round["id"], user_id=sell_user["id"], security_id=security["id"]
+    )
     sell_order_id = sell_order["id"]
-    create_sell_order("4", round_id=round["id"], user_id=sell_user2["id"])
+    create_sell_order(
+        "4", round_id=round["id"], user_id=sell_user2["id"], security_id=security["id"]
+    )
 
     with patch(
         "src.services.match_buyers_and_sellers",
@@ -57,7 +85,8 @@ def test_run_matches():
         assert set(u["user_id"] for u in mock_match.call_args[0][1]) == set(
             [sell_user["id"], sell_user2["id"]]
         )
-        assert mock_match.call_args[0][2] == []
+        assert list(mock_match.call_args[0][2]) == []
+        assert mock_match.call_args[1]["solver"] == APP_CONFIG["ACQUITY_MATCH_SOLVER"]
 
     with session_scope() as session:
         match = session.query(Match).one()
@@ -71,18 +100,176 @@ def test_run_matches():
         assert session.query(Round).get(round["id"]).is_concluded
 
 
+def test_run_matches__partial_fills():
+    round = create_round()
+    security = create_security()
+
+    buy_user = create_user("1")
+    buy_user2 = create_user("2")
+    sell_user = create_user("3")
+
+    buy_order = create_buy_order(
+        "1",
+        round_id=round["id"],
+        user_id=buy_user["id"],
+        security_id=security["id"],
+        number_of_shares=30,
+        price=6,
+    )
+    buy_order2 = create_buy_order(
+        "2",
+        round_id=round["id"],
+        user_id=buy_user2["id"],
+        security_id=security["id"],
+        number_of_shares=50,
+        price=5,
+    )
+    sell_order = create_sell_order(
+        "3",
+        round_id=round["id"],
+        user_id=sell_user["id"],
+        security_id=security["id"],
+        number_of_shares=100,
+        price=5,
+    )
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        MatchService(
+            config={**APP_CONFIG, "ACQUITY_MATCH_PARTIAL_FILLS": True}
+        ).run_matches()
+
+    # The seller sells to both buyers at once
+    with session_scope() as session:
+        assert {
+            (
+                match.buy_order_id,
+                match.sell_order_id,
+                match.number_of_shares,
+                match.price,
+            )
+            for match in session.query(Match)
+        } == {
+            (buy_order["id"], sell_order["id"], 30, 5.5),
+            (buy_order2["id"], sell_order["id"], 50, 5),
+        }
+        assert session.query(ChatRoom).count() == 2
+
+
+def test_run_matches__metrics():
+    round = create_round()
+    security = create_security()
+    buy_order = create_buy_order(
+        "1",
+        round_id=round["id"],
+        user_id=create_user("1")["id"],
+        security_id=security["id"],
+    )
+    create_buy_order(
+        "2",
+        round_id=round["id"],
+        user_id=create_user("2")["id"],
+        security_id=security["id"],
+        price=0,
+    )
+    create_sell_order(
+        "3",
+        round_id=round["id"],
+        user_id=create_user("3")["id"],
+        security_id=security["id"],
+        price=buy_order["price"],
+    )
+
+    with patch("src.services.EmailService.send_email"):
+        metrics = match_service.run_matches(round_id=round["id"])
+
+    assert metrics["round_id"] == round["id"]
+    assert metrics["securities"] == 1
+    assert metrics["cached_securities"] == 0
+    assert metrics["resumed_securities"] == 0
+    assert metrics["buy_orders"] == 2
+    # Sell orders of sellers with a single order are doubled
+    assert metrics["sell_orders"] == 2
+    assert metrics["matches"] == 1
+    assert metrics["emails"] == 3
+    assert set(metrics["seconds"]) == {
+        "loading",
+        "matching",
+        "db_write",
+        "emails",
+        "total",
+    }
+    # One edge to each row of the doubled sell order
+    assert metrics["engine"]["nodes"] == 2
+    assert metrics["engine"]["edges"] == 2
+    assert metrics["engine"]["leftover_buy_orders"] == 1
+    assert set(metrics["engine"]["seconds"]) == {
+        "order_books",
+        "graph_build",
+        "solve",
+        "distribute",
+    }
+
+    # Closing the round again does nothing
+    assert match_service.run_matches(round_id=round["id"]) is None
+
+
+def test_run_matches__metrics_disabled():
+    round, buy_order, sell_order = create_matchable_round()
+
+    # The matching engine is not instrumented either
+    with patch("src.services.EmailService.send_email"), patch(
+        "src.services.match_buyers_and_sellers",
+        return_value={(buy_order["id"], sell_order["id"])},
+    ) as mock_match:
+        assert (
+            MatchService(
+                config={**APP_CONFIG, "ACQUITY_MATCH_METRICS": False}
+            ).run_matches(round_id=round["id"])
+            is None
+        )
+        assert mock_match.call_args[1]["stats"] is None
+
+
+def test_run_matches__solver_unavailable(monkeypatch):
+    monkeypatch.setattr("src.match.np", None)
+    round, _, _ = create_matchable_round()
+
+    with patch("src.services.EmailService.send_email") as mock_email, pytest.raises(
+        ValueError, match="NumPy"
+    ):
+        MatchService(
+            config={**APP_CONFIG, "ACQUITY_MATCH_SOLVER": "assignment"}
+        ).run_matches(round_id=round["id"])
+
+    mock_email.assert_not_called()
+    with session_scope() as session:
+        assert session.query(RoundCloseCheckpoint).count() == 0
+        assert not session.query(Round).get(round["id"]).is_concluded
+
+
 def test_run_matches__cannot_buy_or_sell():
     round = create_round()
+    security = create_security()
 
     buy_user = create_user("1", can_buy=True)
     buy_user2 = create_user("2", can_buy=False)
     sell_user = create_user("3", can_sell=True)
     sell_user2 = create_user("4", can_sell=False)
 
-    create_buy_order("1", round_id=round["id"], user_id=buy_user["id"])
-    create_buy_order("2", round_id=round["id"], user_id=buy_user2["id"])
-    create_sell_order("3", round_id=round["id"], user_id=sell_user["id"])
-    create_sell_order("4", round_id=round["id"], user_id=sell_user2["id"])
+    create_buy_order(
+        "1", round_id=round["id"], user_id=buy_user["id"], security_id=security["id"]
+    )
+    create_buy_order(
+        "2", round_id=round["id"], user_id=buy_user2["id"], security_id=security["id"]
+    )
+    create_sell_order(
+        "3", round_id=round["id"], user_id=sell_user["id"], security_id=security["id"]
+    )
+    create_sell_order(
+        "4", round_id=round["id"], user_id=sell_user2["id"], security_id=security["id"]
+    )
 
     with patch("src.services.match_buyers_and_sellers") as mock_match, patch(
         "src.services.RoundService.get_active", return_value=round
@@ -95,11 +282,12 @@ def test_run_matches__cannot_buy_or_sell():
         assert set(u["user_id"] for u in mock_match.call_args[0][1]) == set(
             [sell_user["id"]]
         )
-        assert mock_match.call_args[0][2] == []
+        assert list(mock_match.call_args[0][2]) == []
 
 
 def test_run_matches__banned_pairs():
     round = create_round()
+    security = create_security()
 
     buy_user = create_user("1")
     buy_user2 = create_user("2")
@@ -109,10 +297,18 @@ def test_run_matches__banned_pairs():
     buy_user_id = buy_user["id"]
     sell_user_id = sell_user["id"]
 
-    create_buy_order("1", round_id=round["id"], user_id=buy_user["id"])
-    create_buy_order("2", round_id=round["id"], user_id=buy_user2["id"])
-    create_sell_order("3", round_id=round["id"], user_id=sell_user["id"])
-    create_sell_order("4", round_id=round["id"], user_id=sell_user2["id"])
+    create_buy_order(
+        "1", round_id=round["id"], user_id=buy_user["id"], security_id=security["id"]
+    )
+    create_buy_order(
+        "2", round_id=round["id"], user_id=buy_user2["id"], security_id=security["id"]
+    )
+    create_sell_order(
+        "3", round_id=round["id"], user_id=sell_user["id"], security_id=security["id"]
+    )
+    create_sell_order(
+        "4", round_id=round["id"], user_id=sell_user2["id"], security_id=security["id"]
+    )
 
     create_banned_pair(buyer_id=buy_user_id, seller_id=sell_user_id)
 
@@ -127,21 +323,68 @@ def test_run_matches__banned_pairs():
         assert set(u["user_id"] for u in mock_match.call_args[0][1]) == set(
             [sell_user_id, sell_user2["id"]]
         )
-        assert mock_match.call_args[0][2] == [(buy_user_id, sell_user_id)]
+        assert list(mock_match.call_args[0][2]) == [(buy_user_id, sell_user_id)]
+
+
+def test_run_matches__banned_pairs_outside_round():
+    round = create_round()
+    security = create_security()
+    other_round = create_round("1")
+
+    buy_user = create_user("1")
+    sell_user = create_user("2")
+    other_buy_user = create_user("3")
+    other_sell_user = create_user("4")
+    user_without_orders = create_user("5")
+
+    create_buy_order(
+        "1", round_id=round["id"], user_id=buy_user["id"], security_id=security["id"]
+    )
+    create_sell_order(
+        "2", round_id=round["id"], user_id=sell_user["id"], security_id=security["id"]
+    )
+    create_buy_order(
+        "3",
+        round_id=other_round["id"],
+        user_id=other_buy_user["id"],
+        security_id=security["id"],
+    )
+    create_sell_order(
+        "4",
+        round_id=other_round["id"],
+        user_id=other_sell_user["id"],
+        security_id=security["id"],
+    )
+
+    create_banned_pair(buyer_id=buy_user["id"], seller_id=user_without_orders["id"])
+    create_banned_pair(buyer_id=buy_user["id"], seller_id=other_sell_user["id"])
+    create_banned_pair(buyer_id=other_buy_user["id"], seller_id=sell_user["id"])
+    # The seller is not a buyer in this round
+    create_banned_pair(buyer_id=sell_user["id"], seller_id=buy_user["id"])
+
+    with patch("src.services.match_buyers_and_sellers") as mock_match, patch(
+        "src.services.RoundService.get_active", return_value=round
+    ), patch("src.services.EmailService.send_email"):
+        match_service.run_matches()
+
+        assert list(mock_match.call_args[0][2]) == []
 
 
 def test_run_matches__double_sell_orders():
     round = create_round()
+    security = create_security()
 
     sell_user = create_user("3")
     sell_user2 = create_user("4")
 
-    sell_order1 = create_sell_order("3", round_id=round["id"], user_id=sell_user["id"])
+    sell_order1 = create_sell_order(
+        "3", round_id=round["id"], user_id=sell_user["id"], security_id=security["id"]
+    )
     sell_order21 = create_sell_order(
-        "4", round_id=round["id"], user_id=sell_user2["id"]
+        "4", round_id=round["id"], user_id=sell_user2["id"], security_id=security["id"]
     )
     sell_order22 = create_sell_order(
-        "5", round_id=round["id"], user_id=sell_user2["id"]
+        "5", round_id=round["id"], user_id=sell_user2["id"], security_id=security["id"]
     )
 
     with patch("src.services.match_buyers_and_sellers") as mock_match, patch(
@@ -165,3 +408,825 @@ def test_run_matches__double_sell_orders():
             )
             == 1
         )
+
+
+def test_run_matches__per_security():
+    round = create_round()
+    security = create_security("1")
+    security2 = create_security("2")
+
+    buy_user = create_user("1")
+    buy_user2 = create_user("2")
+    sell_user = create_user("3")
+    sell_user2 = create_user("4")
+
+    create_buy_order(
+        "1", round_id=round["id"], user_id=buy_user["id"], security_id=security["id"]
+    )
+    create_buy_order(
+        "2", round_id=round["id"], user_id=buy_user2["id"], security_id=security2["id"]
+    )
+    create_sell_order(
+        "3", round_id=round["id"], user_id=sell_user["id"], security_id=security["id"]
+    )
+    create_sell_order(
+        "4", round_id=round["id"], user_id=sell_user2["id"], security_id=security2["id"]
+    )
+
+    with patch("src.services.match_buyers_and_sellers") as mock_match, patch(
+        "src.services.RoundService.get_active", return_value=round
+    ), patch("src.services.EmailService.send_email"):
+        match_service.run_matches()
+
+        assert sorted(
+            (
+                [u["user_id"] for u in call_args[0][0]],
+                [u["user_id"] for u in call_args[0][1]],
+            )
+            for call_args in mock_match.call_args_list
+        ) == sorted(
+            [
+                ([buy_user["id"]], [sell_user["id"]] * 2),
+                ([buy_user2["id"]], [sell_user2["id"]] * 2),
+            ]
+        )
+
+
+def test_run_matches__parallel_securities():
+    round = create_round()
+    securities = [create_security(str(i)) for i in range(3)]
+
+    expected_matches = set()
+    for i, security in enumerate(securities):
+        buy_order = create_buy_order(
+            str(2 * i),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i))["id"],
+            security_id=security["id"],
+        )
+        sell_order = create_sell_order(
+            str(2 * i + 1),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i + 1))["id"],
+            security_id=security["id"],
+            price=buy_order["price"],
+        )
+        expected_matches.add((buy_order["id"], sell_order["id"]))
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        MatchService(config={**APP_CONFIG, "ACQUITY_MATCH_WORKERS": 2}).run_matches()
+
+    with session_scope() as session:
+        assert {
+            (match.buy_order_id, match.sell_order_id)
+            for match in session.query(Match).all()
+        } == expected_matches
+        assert session.query(ChatRoom).count() == len(securities)
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_run_matches__incremental():
+    incremental_match_service = MatchService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round = create_round()
+    security = create_security()
+
+    buy_order = create_buy_order(
+        "1",
+        round_id=round["id"],
+        user_id=create_user("1")["id"],
+        security_id=security["id"],
+    )
+    sell_order = create_sell_order(
+        "2",
+        round_id=round["id"],
+        user_id=create_user("2")["id"],
+        security_id=security["id"],
+        price=buy_order["price"],
+    )
+
+    with patch("src.services.RoundService.get_active", return_value=round):
+        incremental_match_service.mark_provisional_matches_stale(round["id"])
+        assert incremental_match_service.refresh_provisional_matches() == 1
+        assert incremental_match_service.refresh_provisional_matches() == 0
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ), patch("src.services.match_security") as mock_match:
+        incremental_match_service.run_matches()
+        mock_match.assert_not_called()
+
+    with session_scope() as session:
+        assert [
+            (match.buy_order_id, match.sell_order_id)
+            for match in session.query(Match).all()
+        ] == [(buy_order["id"], sell_order["id"])]
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_run_matches__incremental_stale():
+    incremental_match_service = MatchService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round = create_round()
+    security = create_security()
+
+    buy_user = create_user("1")
+    sell_user = create_user("2")
+    buy_order = create_buy_order(
+        "1", round_id=round["id"], user_id=buy_user["id"], security_id=security["id"]
+    )
+    create_sell_order(
+        "2",
+        round_id=round["id"],
+        user_id=sell_user["id"],
+        security_id=security["id"],
+        price=buy_order["price"],
+    )
+
+    with patch("src.services.RoundService.get_active", return_value=round):
+        incremental_match_service.mark_provisional_matches_stale(round["id"])
+        incremental_match_service.refresh_provisional_matches()
+
+    # Bans do not update the provisional matching, so it is re-matched on close
+    create_banned_pair(buyer_id=buy_user["id"], seller_id=sell_user["id"])
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        incremental_match_service.run_matches()
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 0
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_refresh_provisional_matches():
+    incremental_match_service = MatchService(
+        config={
+            **APP_CONFIG,
+            "ACQUITY_MATCH_INCREMENTAL": True,
+            "ACQUITY_MATCH_SOLVER": "flow",
+        }
+    )
+    round = create_round()
+    security = create_security()
+    buy_order = create_buy_order(
+        "1",
+        round_id=round["id"],
+        user_id=create_user("1")["id"],
+        security_id=security["id"],
+    )
+    sell_order = create_sell_order(
+        "2",
+        round_id=round["id"],
+        user_id=create_user("2")["id"],
+        security_id=security["id"],
+        price=buy_order["price"],
+    )
+
+    def get_provisional_match():
+        with session_scope() as session:
+            match = session.query(ProvisionalMatch).one()
+            return (
+                match.version,
+                match.refreshed_version,
+                match.results and json.loads(match.results),
+            )
+
+    with patch("src.services.RoundService.get_active", return_value=round):
+        incremental_match_service.mark_provisional_matches_stale(round["id"])
+        assert get_provisional_match() == (1, None, None)
+
+        incremental_match_service.refresh_provisional_matches()
+        assert get_provisional_match() == (1, 1, [[buy_order["id"], sell_order["id"]]],)
+
+        # The price is raised above the buy order's
+        with session_scope() as session:
+            session.query(SellOrder).get(sell_order["id"]).price = (
+                buy_order["price"] + 1
+            )
+        incremental_match_service.mark_provisional_matches_stale(
+            round["id"], [security["id"]]
+        )
+        assert get_provisional_match()[:2] == (2, 1)
+
+        with patch("src.services.rematch", side_effect=rematch) as mock_rematch:
+            incremental_match_service.refresh_provisional_matches()
+            assert mock_rematch.call_args[0][1] is not None
+        assert get_provisional_match() == (2, 2, [])
+
+
+def test_refresh_provisional_matches__cold():
+    round = create_round()
+    security = create_security()
+    buy_order = create_buy_order(
+        "1",
+        round_id=round["id"],
+        user_id=create_user("1")["id"],
+        security_id=security["id"],
+    )
+    sell_order = create_sell_order(
+        "2",
+        round_id=round["id"],
+        user_id=create_user("2")["id"],
+        security_id=security["id"],
+        price=buy_order["price"],
+    )
+
+    def refresh(config):
+        incremental_match_service = MatchService(
+            config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True, **config}
+        )
+        with patch("src.services.RoundService.get_active", return_value=round):
+            incremental_match_service.mark_provisional_matches_stale(round["id"])
+            with patch("src.services.rematch") as mock_rematch:
+                incremental_match_service.refresh_provisional_matches()
+                mock_rematch.assert_not_called()
+        with session_scope() as session:
+            match = session.query(ProvisionalMatch).one()
+            return (
+                match.fingerprint is not None,
+                match.results and json.loads(match.results),
+                match.warm_start,
+            )
+
+    # Matchings cut short by the time limit are not kept
+    with patch("src.services.match_security", return_value=(set(), {"optimal": False})):
+        assert refresh(
+            {"ACQUITY_MATCH_SOLVER": "flow", "ACQUITY_MATCH_TIME_LIMIT": 0}
+        ) == (False, None, None)
+
+    # Matched with the configured solver, without a matching to repair
+    assert refresh({"ACQUITY_MATCH_SOLVER": "networkx"}) == (
+        True,
+        [[buy_order["id"], sell_order["id"]]],
+        None,
+    )
+
+
+def test_refresh_provisional_matches__should_stop():
+    incremental_match_service = MatchService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round = create_round()
+    for i in range(2):
+        create_buy_order(
+            str(i),
+            round_id=round["id"],
+            user_id=create_user(str(i))["id"],
+            security_id=create_security(str(i))["id"],
+        )
+
+    with patch("src.services.RoundService.get_active", return_value=round):
+        incremental_match_service.mark_provisional_matches_stale(round["id"])
+        should_stop = iter([False, True])
+        assert (
+            incremental_match_service.refresh_provisional_matches(
+                should_stop=lambda: next(should_stop)
+            )
+            == 2
+        )
+
+        with session_scope() as session:
+            assert (
+                session.query(ProvisionalMatch)
+                .filter(ProvisionalMatch.refreshed_version.isnot(None))
+                .count()
+                == 1
+            )
+
+        # The rest is refreshed on the next call
+        assert incremental_match_service.refresh_provisional_matches() == 1
+        assert incremental_match_service.refresh_provisional_matches() == 0
+
+
+def test_mark_provisional_matches_stale():
+    incremental_match_service = MatchService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round = create_round()
+    for i in range(2):
+        create_buy_order(
+            str(i),
+            round_id=round["id"],
+            user_id=create_user(str(i))["id"],
+            security_id=create_security(str(i))["id"],
+        )
+
+    with patch("src.services.RoundService.get_active", return_value=round):
+        incremental_match_service.mark_provisional_matches_stale(round["id"])
+        incremental_match_service.mark_provisional_matches_stale(round["id"])
+
+    with session_scope() as session:
+        assert [match.version for match in session.query(ProvisionalMatch)] == [2, 2]
+
+
+def test_mark_provisional_matches_stale__inactive_round():
+    incremental_match_service = MatchService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round = create_round()
+    create_buy_order(round_id=round["id"])
+
+    with patch("src.services.RoundService.get_active", return_value=None):
+        incremental_match_service.mark_provisional_matches_stale(round["id"])
+        assert incremental_match_service.refresh_provisional_matches() == 0
+
+    with session_scope() as session:
+        assert session.query(ProvisionalMatch).count() == 0
+
+
+def test_run_matches__time_limit():
+    round = create_round()
+    securities = [create_security(str(i)) for i in range(2)]
+
+    expected_matches = set()
+    for i, security in enumerate(securities):
+        buy_order = create_buy_order(
+            str(2 * i),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i))["id"],
+            security_id=security["id"],
+        )
+        sell_order = create_sell_order(
+            str(2 * i + 1),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i + 1))["id"],
+            security_id=security["id"],
+            price=buy_order["price"],
+        )
+        expected_matches.add((buy_order["id"], sell_order["id"]))
+
+    # Even when the deadline has already passed, every security gets its greedy matching
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        MatchService(
+            config={
+                **APP_CONFIG,
+                "ACQUITY_MATCH_WORKERS": 2,
+                "ACQUITY_MATCH_TIME_LIMIT": 0,
+            }
+        ).run_matches()
+
+    with session_scope() as session:
+        assert {
+            (match.buy_order_id, match.sell_order_id)
+            for match in session.query(Match).all()
+        } == expected_matches
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def create_matchable_round():
+    round = create_round()
+    security = create_security()
+    buy_order = create_buy_order(
+        "1",
+        round_id=round["id"],
+        user_id=create_user("1")["id"],
+        security_id=security["id"],
+    )
+    sell_order = create_sell_order(
+        "2",
+        round_id=round["id"],
+        user_id=create_user("2")["id"],
+        security_id=security["id"],
+        price=buy_order["price"],
+    )
+    return round, buy_order, sell_order
+
+
+def test_run_matches__cached():
+    round, buy_order, sell_order = create_matchable_round()
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        match_service.run_matches()
+
+    with session_scope() as session:
+        session.query(Match).delete()
+        session.query(ChatRoom).delete()
+        session.query(RoundCloseCheckpoint).delete()
+
+    # A retry on the same order book reuses the results without matching again
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ), patch("src.services.match_buyers_and_sellers") as mock_match:
+        match_service.run_matches()
+        mock_match.assert_not_called()
+
+    with session_scope() as session:
+        assert [
+            (match.buy_order_id, match.sell_order_id)
+            for match in session.query(Match).all()
+        ] == [(buy_order["id"], sell_order["id"])]
+        assert session.query(MatchResultCache).count() == 1
+
+
+def test_run_matches__cache_expired():
+    round, buy_order, sell_order = create_matchable_round()
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        match_service.run_matches()
+
+    with session_scope() as session:
+        session.query(MatchResultCache).update(
+            {
+                "created_at": datetime.now(timezone.utc)
+                - APP_CONFIG["ACQUITY_MATCH_CACHE_MAX_AGE"]
+                - timedelta(minutes=1)
+            }
+        )
+        session.query(Match).delete()
+        session.query(ChatRoom).delete()
+        session.query(RoundCloseCheckpoint).delete()
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ), patch(
+        "src.services.match_buyers_and_sellers",
+        return_value={(buy_order["id"], sell_order["id"])},
+    ) as mock_match:
+        match_service.run_matches()
+        mock_match.assert_called_once()
+
+    with session_scope() as session:
+        entry = session.query(MatchResultCache).one()
+        assert entry.created_at > datetime.now(timezone.utc) - timedelta(minutes=1)
+
+
+def test_run_matches__not_optimal():
+    round, buy_order, sell_order = create_matchable_round()
+
+    # Past the deadline, the matching is greedy and may not be optimal
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        MatchService(config={**APP_CONFIG, "ACQUITY_MATCH_TIME_LIMIT": 0}).run_matches()
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 1
+        assert session.query(MatchResultCache).count() == 0
+
+
+def test_cache_results__existing_key():
+    match_service._cache_results("key", {("1", "2")})
+    match_service._cache_results("key", {("3", "4")})
+
+    with session_scope() as session:
+        assert session.query(MatchResultCache).one().results == '[["1","2"]]'
+
+
+def test_save_checkpoint__forward_only():
+    round = create_round()
+    security = create_security()
+
+    for security_id in [None, security["id"]]:
+        match_service._save_checkpoint(
+            round["id"], security_id, "MATCHED", {("1", "2")}
+        )
+        match_service._save_checkpoint(round["id"], security_id, "NOTIFIED")
+        # A run that is behind does not undo the stages of another one
+        match_service._save_checkpoint(round["id"], security_id, "LOADED")
+
+    assert match_service._get_checkpoints(round["id"]) == {
+        None: ("NOTIFIED", {("1", "2")}),
+        security["id"]: ("NOTIFIED", {("1", "2")}),
+    }
+
+
+def test_add_db_objects__existing_match():
+    round, buy_order, sell_order = create_matchable_round()
+    results = {(buy_order["id"], sell_order["id"])}
+    buyers = {buy_order["id"]: buy_order["user_id"]}
+    sellers = {sell_order["id"]: sell_order["user_id"]}
+
+    # A run racing another one inserts the same matches
+    for _ in range(2):
+        with session_scope() as session:
+            match_service._add_db_objects(session, results, sellers, buyers)
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 1
+        assert session.query(ChatRoom).count() == 1
+
+
+def test_get_cache_key():
+    buy_orders = [
+        {"id": "b1", "user_id": "u1", "number_of_shares": 10, "price": 5},
+        {"id": "b2", "user_id": "u2", "number_of_shares": 20, "price": 6},
+    ]
+    sell_orders = [{"id": "s1", "user_id": "u3", "number_of_shares": 10, "price": 4}]
+    banned_pairs = [("u1", "u3"), ("u2", "u3")]
+
+    key = match_service._get_cache_key((buy_orders, sell_orders, banned_pairs))
+    assert key == match_service._get_cache_key(
+        (buy_orders[::-1], sell_orders, banned_pairs[::-1])
+    )
+    assert key != match_service._get_cache_key(
+        (buy_orders[:1], sell_orders, banned_pairs)
+    )
+    assert key != MatchService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_SOLVER": "flow"}
+    )._get_cache_key((buy_orders, sell_orders, banned_pairs))
+
+
+def test_preview_matches():
+    round, buy_order, sell_order = create_matchable_round()
+    committee_user = create_user("3", is_committee=True)
+
+    with patch("src.services.RoundService.get_active", return_value=round):
+        preview = match_service.preview_matches(subject_id=committee_user["id"])
+
+    assert preview["round_id"] == round["id"]
+    assert preview["matches"] == [
+        {
+            "security_id": buy_order["security_id"],
+            "buy_order_id": buy_order["id"],
+            "sell_order_id": sell_order["id"],
+        }
+    ]
+    assert preview["match_rate"] == 1
+    assert preview["cached_securities"] == 0
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 0
+        assert not session.query(Round).get(round["id"]).is_concluded
+
+    # Previewing the same order book again does not match again
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.match_security"
+    ) as mock_match:
+        second_preview = match_service.preview_matches(subject_id=committee_user["id"])
+        mock_match.assert_not_called()
+
+    assert second_preview["matches"] == preview["matches"]
+    assert second_preview["cached_securities"] == 1
+
+
+def test_preview_matches__shared_pool():
+    incremental_match_service = MatchService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round, buy_order, _ = create_matchable_round()
+    committee_user = create_user("3", is_committee=True)
+
+    # Incremental previews are matched in the pool too, which is started once
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.ProcessPoolExecutor", wraps=ProcessPoolExecutor
+    ) as mock_executor:
+        preview = incremental_match_service.preview_matches(
+            subject_id=committee_user["id"]
+        )
+        with session_scope() as session:
+            session.query(BuyOrder).get(buy_order["id"]).number_of_shares += 1
+        second_preview = incremental_match_service.preview_matches(
+            subject_id=committee_user["id"]
+        )
+        mock_executor.assert_called_once()
+    incremental_match_service.shutdown()
+
+    assert preview["matches"] == second_preview["matches"]
+    assert preview["cached_securities"] == second_preview["cached_securities"] == 0
+
+
+def test_preview_matches__not_committee():
+    round, _, _ = create_matchable_round()
+    user = create_user("3", is_committee=False)
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.match_security"
+    ) as mock_match, pytest.raises(InvisibleUnauthorizedException):
+        match_service.preview_matches(subject_id=user["id"])
+    mock_match.assert_not_called()
+
+
+def test_stream_rows():
+    round = create_round()
+    security = create_security()
+    buy_orders = [
+        create_buy_order(
+            str(i),
+            round_id=round["id"],
+            user_id=create_user(str(i))["id"],
+            security_id=security["id"],
+        )
+        for i in range(5)
+    ]
+
+    with session_scope() as session:
+        query = session.query(BuyOrder).with_entities(
+            BuyOrder.id.cast(String), BuyOrder.number_of_shares
+        )
+        batches = list(stream_rows(session, query, batch_size=2))
+
+    assert [len(rows) for rows in batches] == [2, 2, 1]
+    assert sorted(tuple(row) for rows in batches for row in rows) == sorted(
+        (buy_order["id"], buy_order["number_of_shares"]) for buy_order in buy_orders
+    )
+
+
+def test_run_matches__existing_chat_room():
+    round, buy_order, sell_order = create_matchable_round()
+    with session_scope() as session:
+        session.add(
+            ChatRoom(seller_id=sell_order["user_id"], buyer_id=buy_order["user_id"])
+        )
+
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ):
+        match_service.run_matches()
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 1
+        assert session.query(ChatRoom).count() == 1
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_run_matches__streamed():
+    round = create_round()
+    securities = [create_security(str(i)) for i in range(2)]
+
+    users = []
+    for i, security in enumerate(securities):
+        buy_user = create_user(str(2 * i))
+        sell_user = create_user(str(2 * i + 1))
+        buy_order = create_buy_order(
+            str(2 * i),
+            round_id=round["id"],
+            user_id=buy_user["id"],
+            security_id=security["id"],
+        )
+        create_sell_order(
+            str(2 * i + 1),
+            round_id=round["id"],
+            user_id=sell_user["id"],
+            security_id=security["id"],
+            price=buy_order["price"],
+        )
+        users.append((buy_user, sell_user))
+
+    # Each security is saved and notified before the round is concluded
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ) as mock_email, patch(
+        "src.services.MatchService._conclude_round", side_effect=RuntimeError
+    ), pytest.raises(
+        RuntimeError
+    ):
+        match_service.run_matches()
+
+    assert sorted(sorted(c[0][0]) for c in mock_email.call_args_list) == sorted(
+        sorted([buy_user["email"], sell_user["email"]]) for buy_user, sell_user in users
+    )
+    assert all(
+        c[1]["template"] == "match_done_has_match" for c in mock_email.call_args_list
+    )
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 2
+        assert session.query(ChatRoom).count() == 2
+        assert not session.query(Round).get(round["id"]).is_concluded
+
+
+def test_run_matches__resumed():
+    round = create_round()
+    securities = [create_security(str(i)) for i in range(2)]
+    unmatched_user = create_user("9")
+    create_buy_order(
+        "9",
+        round_id=round["id"],
+        user_id=unmatched_user["id"],
+        security_id=securities[0]["id"],
+        price=0,
+    )
+    for i, security in enumerate(securities):
+        buy_order = create_buy_order(
+            str(2 * i),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i))["id"],
+            security_id=security["id"],
+        )
+        create_sell_order(
+            str(2 * i + 1),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i + 1))["id"],
+            security_id=security["id"],
+            price=buy_order["price"],
+        )
+
+    # The first run stops after saving and notifying every security
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ), patch(
+        "src.services.MatchService._conclude_round", side_effect=RuntimeError
+    ), pytest.raises(
+        RuntimeError
+    ):
+        match_service.run_matches()
+
+    # The second run only concludes the round and notifies unmatched users
+    with patch("src.services.EmailService.send_email") as mock_email, patch(
+        "src.services.match_security"
+    ) as mock_match:
+        match_service.run_matches(round_id=round["id"])
+        mock_match.assert_not_called()
+        mock_email.assert_called_once_with(
+            [unmatched_user["email"]], template="match_done_no_match"
+        )
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 2
+        assert session.query(Round).get(round["id"]).is_concluded
+
+    # Running a closed round again does nothing
+    with patch("src.services.EmailService.send_email") as mock_email, patch(
+        "src.services.match_security"
+    ) as mock_match:
+        match_service.run_matches(round_id=round["id"])
+        mock_match.assert_not_called()
+        mock_email.assert_not_called()
+
+
+def test_run_matches__resumed_after_matching():
+    round, buy_order, sell_order = create_matchable_round()
+
+    # The first run stops after matching, before saving anything
+    with patch("src.services.RoundService.get_active", return_value=round), patch(
+        "src.services.EmailService.send_email"
+    ) as mock_email, patch(
+        "src.services.MatchService._add_db_objects", side_effect=RuntimeError
+    ), pytest.raises(
+        RuntimeError
+    ):
+        match_service.run_matches()
+    mock_email.assert_not_called()
+
+    with patch("src.services.EmailService.send_email") as mock_email, patch(
+        "src.services.match_security"
+    ) as mock_match:
+        match_service.run_matches(round_id=round["id"])
+        mock_match.assert_not_called()
+        assert [c[1]["template"] for c in mock_email.call_args_list] == [
+            "match_done_has_match"
+        ]
+
+    with session_scope() as session:
+        assert [
+            (match.buy_order_id, match.sell_order_id)
+            for match in session.query(Match).all()
+        ] == [(buy_order["id"], sell_order["id"])]
+        assert session.query(Round).get(round["id"]).is_concluded
+
+
+def test_run_matches__cancelled():
+    round = create_round()
+    securities = [create_security(str(i)) for i in range(2)]
+    for i, security in enumerate(securities):
+        buy_order = create_buy_order(
+            str(2 * i),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i))["id"],
+            security_id=security["id"],
+        )
+        create_sell_order(
+            str(2 * i + 1),
+            round_id=round["id"],
+            user_id=create_user(str(2 * i + 1))["id"],
+            security_id=security["id"],
+            price=buy_order["price"],
+        )
+
+    # Cancelled before anything is saved
+    with patch("src.services.EmailService.send_email") as mock_email, pytest.raises(
+        MatchJobCancelledException
+    ):
+        match_service.run_matches(
+            round_id=round["id"], is_cancelled=lambda session: True
+        )
+    mock_email.assert_not_called()
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 0
+        assert sorted(
+            checkpoint.stage for checkpoint in session.query(RoundCloseCheckpoint).all()
+        ) == ["LOADED", "MATCHED"]
+
+    # Cancelled once the first security is saved, which is too late
+    cancellations = iter([False, True])
+    with patch("src.services.EmailService.send_email"):
+        match_service.run_matches(
+            round_id=round["id"], is_cancelled=lambda session: next(cancellations)
+        )
+
+    with session_scope() as session:
+        assert session.query(Match).count() == 2
+        assert session.query(Round).get(round["id"]).is_concluded
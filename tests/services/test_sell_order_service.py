@@ -4,11 +4,12 @@ import pytest
 from apscheduler.schedulers.base import BaseScheduler
 
 from src.config import APP_CONFIG
-from src.database import BuyOrder, Round, SellOrder, session_scope
+from src.database import BuyOrder, MatchJob, Round, SellOrder, session_scope
 from src.exceptions import ResourceNotOwnedException, UnauthorizedException
 from src.services import SellOrderService
 from tests.fixtures import (
     create_buy_order,
+    create_round,
     create_security,
     create_sell_order,
     create_user,
@@ -146,9 +147,10 @@ def test_create_order__add_new_round():
             wakeup = MagicMock()
             add_job = scheduler_mock
 
-        sell_order_id2 = sell_order_service.create_order(
-            **sell_order_params, scheduler=SchedulerMock()
-        )["id"]
+        # Without the match worker, the round is closed by the web process scheduler
+        sell_order_id2 = SellOrderService(
+            config={**APP_CONFIG, "ACQUITY_MATCH_IN_WORKER": False}
+        ).create_order(**sell_order_params, scheduler=SchedulerMock())["id"]
 
         email_mock.assert_any_call([user["email"]], template="round_opened")
         email_mock.assert_any_call(emails=[user["email"]], template="create_sell_order")
@@ -170,6 +172,36 @@ def test_create_order__add_new_round():
     assert buy_order["round_id"] is not None
 
 
+def test_create_order__add_new_round_in_worker():
+    user_id = create_user()["id"]
+    security_id = create_security()["id"]
+    sell_order_params = {
+        "user_id": user_id,
+        "number_of_shares": 20,
+        "price": 30,
+        "security_id": security_id,
+    }
+    scheduler_mock = MagicMock()
+
+    class SchedulerMock(BaseScheduler):
+        shutdown = MagicMock()
+        wakeup = MagicMock()
+        add_job = scheduler_mock
+
+    with patch("src.services.RoundService.get_active", return_value=None), patch(
+        "src.services.RoundService.should_round_start", return_value=True
+    ), patch("src.services.EmailService.send_email"):
+        sell_order_service.create_order(**sell_order_params, scheduler=SchedulerMock())
+
+    scheduler_mock.assert_not_called()
+    with session_scope() as session:
+        round = session.query(Round).one()
+        match_job = session.query(MatchJob).one()
+        assert match_job.round_id == str(round.id)
+        assert match_job.run_at == round.end_time
+        assert match_job.status == "PENDING"
+
+
 def test_create_order__unauthorized():
     user_id = create_user(can_sell=False)["id"]
     security_id = create_security()["id"]
@@ -237,3 +269,33 @@ def test_delete_order():
 
     with session_scope() as session:
         assert session.query(SellOrder).filter_by(id=sell_order_id).count() == 0
+
+
+def test_edit_order__incremental_match():
+    incremental_sell_order_service = SellOrderService(
+        config={**APP_CONFIG, "ACQUITY_MATCH_INCREMENTAL": True}
+    )
+    round_id = create_round()["id"]
+    user_id = create_user()["id"]
+    security_id = create_security("1")["id"]
+    other_security_id = create_security("2")["id"]
+    sell_order = create_sell_order(
+        "1", user_id=user_id, round_id=round_id, security_id=security_id
+    )
+    create_sell_order(
+        "2", user_id=user_id, round_id=round_id, security_id=other_security_id
+    )
+
+    with patch("src.services.EmailService.send_email"), patch(
+        "src.services.MatchService.mark_provisional_matches_stale"
+    ) as mock_update:
+        incremental_sell_order_service.edit_order(
+            id=sell_order["id"], subject_id=user_id, new_number_of_shares=50
+        )
+        mock_update.assert_called_once_with(round_id, {security_id, other_security_id})
+
+        mock_update.reset_mock()
+        incremental_sell_order_service.delete_order(
+            id=sell_order["id"], subject_id=user_id
+        )
+        mock_update.assert_called_once_with(round_id, {security_id, other_security_id})
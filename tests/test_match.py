@@ -1,6 +1,32 @@
+import random
+from copy import deepcopy
+from time import sleep, time
+
 import pytest
 
-from src.match import match_buyers_and_sellers
+from src.match import (
+    SOLVERS,
+    choose_solver,
+    distribute_remaining_buyers,
+    get_banned_pair_index,
+    get_compatible_edges,
+    get_matching_cost,
+    get_order_books,
+    get_price_compatible_edges,
+    match_buyers_and_sellers,
+    solve_greedily,
+    solve_with_assignment,
+    solve_with_min_cost_flow,
+    solve_with_networkx,
+    split_into_components,
+)
+from src.min_cost_flow import MinCostMatching
+from src.order_book import EdgeList
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # fmt: off
 TRIVIAL_CASE = (
@@ -332,3 +358,513 @@ def test_match_buyers_and_sellers(
         match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches)
         == match_result
     )
+
+
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches,match_result", TEST_CASES
+)
+def test_match_buyers_and_sellers__without_numpy(
+    buy_orders, sell_orders, banned_user_matches, match_result, monkeypatch
+):
+    monkeypatch.setattr("src.match.np", None)
+    assert (
+        match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches)
+        == match_result
+    )
+
+
+def get_matching_params(buy_orders, sell_orders, banned_user_matches):
+    buy_orders, sell_orders = get_order_books(buy_orders, sell_orders)
+    return (
+        buy_orders,
+        sell_orders,
+        get_banned_pair_index(buy_orders.users, banned_user_matches),
+    )
+
+
+@pytest.mark.parametrize("buy_orders,sell_orders,banned_user_matches,_", TEST_CASES)
+def test_get_compatible_edges(buy_orders, sell_orders, banned_user_matches, _):
+    buy_orders, sell_orders, banned_user_matches = get_matching_params(
+        buy_orders, sell_orders, banned_user_matches
+    )
+    assert list(
+        get_compatible_edges(buy_orders, sell_orders, banned_user_matches, 2000)
+    ) == list(
+        get_price_compatible_edges(buy_orders, sell_orders, banned_user_matches, 2000)
+    )
+
+
+@pytest.mark.parametrize("buy_orders,sell_orders,banned_user_matches,_", TEST_CASES)
+def test_get_compatible_edges__blocks(
+    monkeypatch, buy_orders, sell_orders, banned_user_matches, _
+):
+    pytest.importorskip("numpy")
+    params = get_matching_params(buy_orders, sell_orders, banned_user_matches)
+    edges = list(get_compatible_edges(*params, 2000))
+
+    # One sell order at a time
+    monkeypatch.setattr("src.match.EDGE_BLOCK_CELLS", 1)
+    assert list(get_compatible_edges(*params, 2000)) == edges
+
+
+@pytest.mark.parametrize("price_weight,cost", [(0, 5), (1, 2005), (2, 4005)])
+def test_get_compatible_edges__price_weight(price_weight, cost):
+    buy_orders, sell_orders, banned_user_matches = get_matching_params(
+        [{"id": "b1", "user_id": "X", "number_of_shares": 20, "price": 6}],
+        [{"id": "s1", "user_id": "Y", "number_of_shares": 15, "price": 5}],
+        [],
+    )
+
+    assert list(
+        get_compatible_edges(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            2000,
+            price_weight=price_weight,
+        )
+    ) == [(0, 0, cost)]
+    assert list(
+        get_price_compatible_edges(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            2000,
+            price_weight=price_weight,
+        )
+    ) == [(0, 0, cost)]
+
+
+def generate_random_case(seed):
+    rng = random.Random(seed)
+    buy_orders = [
+        {
+            "id": f"b{i}",
+            "user_id": f"u{rng.randrange(10)}",
+            "number_of_shares": rng.randint(1, 50),
+            "price": rng.randint(1, 10),
+        }
+        for i in range(rng.randint(0, 30))
+    ]
+    sell_orders = [
+        {
+            "id": f"s{i}",
+            "user_id": f"u{rng.randrange(10)}",
+            "number_of_shares": rng.randint(1, 50),
+            "price": rng.randint(1, 10),
+        }
+        for i in range(rng.randint(0, 30))
+    ]
+    banned_user_matches = {
+        (f"u{rng.randrange(10)}", f"u{rng.randrange(10)}") for _ in range(5)
+    }
+    return buy_orders, sell_orders, banned_user_matches
+
+
+def get_matching_size_and_cost(edges, matching):
+    costs = {(b, s): c for b, s, c in edges}
+    return len(matching), sum(costs[pair] for pair in matching)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_get_price_compatible_edges__nested_loop(seed):
+    buy_orders, sell_orders, banned_user_matches = get_matching_params(
+        *generate_random_case(seed)
+    )
+
+    assert list(
+        get_price_compatible_edges(buy_orders, sell_orders, banned_user_matches, 50)
+    ) == [
+        (
+            buy_orders.order[buy_row],
+            sell_orders.order[sell_row],
+            abs(buy_orders.price[buy_row] - sell_orders.price[sell_row]) * 50 * 2
+            + abs(
+                buy_orders.number_of_shares[buy_row]
+                - sell_orders.number_of_shares[sell_row]
+            ),
+        )
+        for sell_row in range(len(sell_orders))
+        for buy_row in range(len(buy_orders))
+        if buy_orders.price[buy_row] >= sell_orders.price[sell_row]
+        and (buy_orders.user[buy_row], sell_orders.user[sell_row])
+        not in banned_user_matches
+    ]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_get_matching_cost(seed):
+    buy_orders, sell_orders, banned_user_matches = get_matching_params(
+        *generate_random_case(seed)
+    )
+    edges = get_compatible_edges(buy_orders, sell_orders, banned_user_matches, 50)
+    pairs = solve_with_networkx(edges)
+    costs = {(buy_order, sell_order): cost for buy_order, sell_order, cost in edges}
+
+    assert get_matching_cost(buy_orders, sell_orders, pairs, 50) == pytest.approx(
+        sum(costs[pair] for pair in pairs)
+    )
+
+
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches",
+    [case[:3] for case in TEST_CASES] + [generate_random_case(i) for i in range(50)],
+)
+def test_solve_with_assignment__same_as_networkx(
+    buy_orders, sell_orders, banned_user_matches
+):
+    pytest.importorskip("numpy")
+
+    edges = get_compatible_edges(
+        *get_matching_params(buy_orders, sell_orders, banned_user_matches), 50
+    )
+
+    networkx_matching = solve_with_networkx(edges)
+    assignment_matching = solve_with_assignment(edges)
+
+    # Both are optimal, but may break ties between equal cost matchings differently
+    networkx_size, networkx_cost = get_matching_size_and_cost(edges, networkx_matching)
+    assignment_size, assignment_cost = get_matching_size_and_cost(
+        edges, assignment_matching
+    )
+    assert assignment_size == networkx_size
+    assert assignment_cost == pytest.approx(networkx_cost)
+
+
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches",
+    [case[:3] for case in TEST_CASES] + [generate_random_case(i) for i in range(50)],
+)
+def test_solve_with_min_cost_flow__same_as_networkx(
+    buy_orders, sell_orders, banned_user_matches
+):
+    edges = get_compatible_edges(
+        *get_matching_params(buy_orders, sell_orders, banned_user_matches), 50
+    )
+
+    networkx_size, networkx_cost = get_matching_size_and_cost(
+        edges, solve_with_networkx(edges)
+    )
+    flow_size, flow_cost = get_matching_size_and_cost(
+        edges, solve_with_min_cost_flow(edges)
+    )
+    assert flow_size == networkx_size
+    assert flow_cost == pytest.approx(networkx_cost)
+
+
+def test_match_buyers_and_sellers__warm_start():
+    rng = random.Random(0)
+    buy_orders, sell_orders, banned_user_matches = generate_random_case(2)
+    warm_start = MinCostMatching()
+
+    for _ in range(10):
+        stats = {}
+        warm_result = match_buyers_and_sellers(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            warm_start=warm_start,
+            stats=stats,
+        )
+        cold_stats = {}
+        match_buyers_and_sellers(
+            buy_orders, sell_orders, banned_user_matches, stats=cold_stats
+        )
+
+        assert stats["solver"] == "warm_start"
+        assert stats["matches"] == cold_stats["matches"]
+        assert stats["cost"] == pytest.approx(cold_stats["cost"])
+        buy_order_ids = [buy_order_id for buy_order_id, _ in warm_result]
+        assert len(buy_order_ids) == len(set(buy_order_ids))
+
+        # A late edit and a new ban
+        buy_orders = deepcopy(buy_orders)
+        rng.choice(buy_orders)["price"] = rng.randint(1, 10)
+        banned_user_matches = banned_user_matches | {
+            (rng.choice(buy_orders)["user_id"], rng.choice(sell_orders)["user_id"])
+        }
+
+
+def test_match_buyers_and_sellers__unknown_solver():
+    with pytest.raises(ValueError):
+        match_buyers_and_sellers(*TRIVIAL_CASE[:3], solver="foo")
+
+
+def test_match_buyers_and_sellers__assignment_without_numpy(monkeypatch):
+    monkeypatch.setattr("src.match.np", None)
+    with pytest.raises(ValueError, match="NumPy"):
+        match_buyers_and_sellers(*TRIVIAL_CASE[:3], solver="assignment")
+
+
+def test_split_into_components():
+    edges = [(1, 1, 0), (2, 2, 1), (3, 3, 2), (1, 3, 3), (2, 4, 4)]
+    assert sorted(map(list, split_into_components(edges))) == [
+        [(1, 1, 0), (3, 3, 2), (1, 3, 3)],
+        [(2, 2, 1), (2, 4, 4)],
+    ]
+
+
+def test_split_into_components__single_component():
+    edges = EdgeList([(1, 1, 0), (2, 1, 1), (2, 2, 2)])
+    assert split_into_components(edges) == [edges]
+    assert split_into_components(EdgeList()) == []
+
+
+def test_match_buyers_and_sellers__parallel(monkeypatch):
+    monkeypatch.setattr("src.match.PARALLEL_COMPONENT_MIN_EDGES", 1)
+
+    # Independent copies of some cases, with every user banned from the other copies' users
+    cases = [
+        PERFECT_MATCHING_CASE,
+        EXTRA_MATCHES_CASE,
+        POPULATED_MARKET_CASE,
+        BANNED_PAIR_OTHER_PAIR_MATCH_RESULT_CASE,
+    ]
+    buy_orders, sell_orders, banned_user_matches, match_result = [], [], [], set()
+    users = set()
+    for k, (buys, sells, banned, result) in enumerate(cases):
+        buy_orders += [
+            {**o, "id": f"{k}{o['id']}", "user_id": f"{k}{o['user_id']}"} for o in buys
+        ]
+        sell_orders += [
+            {**o, "id": f"{k}{o['id']}", "user_id": f"{k}{o['user_id']}"} for o in sells
+        ]
+        banned_user_matches += [(f"{k}{b}", f"{k}{s}") for b, s in banned]
+        match_result |= {(f"{k}{b}", f"{k}{s}") for b, s in result}
+        users |= {o["user_id"] for o in buy_orders + sell_orders}
+    banned_user_matches += [(b, s) for b in users for s in users if b[0] != s[0]]
+
+    solvers = ["networkx"]
+    if numpy is not None:
+        solvers.append("assignment")
+    for solver in solvers:
+        assert (
+            match_buyers_and_sellers(
+                buy_orders,
+                sell_orders,
+                banned_user_matches,
+                solver=solver,
+                max_workers=2,
+            )
+            == match_result
+        )
+
+
+def test_choose_solver(monkeypatch):
+    pytest.importorskip("numpy")
+    buy_orders, sell_orders = get_order_books(*deepcopy(POPULATED_MARKET_CASE[:2]))
+    components = [[(0, 0, 1), (1, 0, 1), (1, 1, 1)], [(2, 2, 1)]]
+
+    solver, reasons = choose_solver(buy_orders, sell_orders, components)
+    assert solver == "networkx"
+    assert "2 components, the largest with 3 pairs and 4 cost matrix cells" in reasons
+
+    monkeypatch.setattr("src.match.AUTO_NETWORKX_MAX_EDGES", 2)
+    assert choose_solver(buy_orders, sell_orders, components)[0] == "assignment"
+
+    monkeypatch.setattr("src.match.AUTO_ASSIGNMENT_MAX_CELLS", 3)
+    assert choose_solver(buy_orders, sell_orders, components)[0] == "greedy"
+
+
+def test_choose_solver__without_numpy(monkeypatch):
+    monkeypatch.setattr("src.match.np", None)
+    buy_orders, sell_orders = get_order_books(*deepcopy(POPULATED_MARKET_CASE[:2]))
+    components = [[(0, 0, 1), (1, 0, 1), (1, 1, 1)], [(2, 2, 1)]]
+    assert choose_solver(buy_orders, sell_orders, components)[0] == "networkx"
+
+    # Larger rounds are still matched exactly
+    monkeypatch.setattr("src.match.AUTO_NETWORKX_MAX_EDGES", 2)
+    monkeypatch.setattr("src.match.AUTO_ASSIGNMENT_MAX_CELLS", 4)
+    solver, reasons = choose_solver(buy_orders, sell_orders, components)
+    assert solver == "flow"
+    assert any("needs NumPy, which is not installed" in reason for reason in reasons)
+
+
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches,match_result", TEST_CASES
+)
+def test_match_buyers_and_sellers__auto_solver(
+    buy_orders, sell_orders, banned_user_matches, match_result
+):
+    stats = {}
+    assert (
+        match_buyers_and_sellers(
+            buy_orders, sell_orders, banned_user_matches, solver="auto", stats=stats
+        )
+        == match_result
+    )
+    assert stats["solver"] == "networkx"
+    assert stats["solver_reasons"]
+
+
+def test_match_buyers_and_sellers__phase_stats():
+    buy_orders, sell_orders, banned_user_matches, _ = POPULATED_MARKET_CASE
+
+    stats = {}
+    match_buyers_and_sellers(buy_orders, sell_orders, banned_user_matches, stats=stats)
+
+    assert stats["buy_orders"] == 9
+    assert stats["sell_orders"] == 3
+    # b1 is below every sell order
+    assert stats["nodes"] == 11
+    assert stats["edges"] == 8 + 6 + 4
+    assert stats["remaining_buy_orders"] == 6
+    # The last pass over the sell orders finds no more buy orders for them
+    assert stats["distribute_passes"] == 4
+    assert stats["leftover_buy_orders"] == 1
+    assert set(stats["seconds"]) == {
+        "order_books",
+        "graph_build",
+        "solve",
+        "distribute",
+    }
+    assert all(seconds >= 0 for seconds in stats["seconds"].values())
+
+
+def test_match_buyers_and_sellers__auto_solver_greedy(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr("src.match.AUTO_NETWORKX_MAX_EDGES", 0)
+    monkeypatch.setattr("src.match.AUTO_ASSIGNMENT_MAX_CELLS", 0)
+    buy_orders, sell_orders, banned_user_matches, _ = POPULATED_MARKET_CASE
+
+    stats = {}
+    match_buyers_and_sellers(
+        buy_orders, sell_orders, banned_user_matches, solver="auto", stats=stats
+    )
+
+    assert stats["solver"] == "greedy"
+    assert not stats["optimal"]
+    assert stats["greedy_components"] == stats["components"]
+
+
+def test_solve_greedily():
+    edges = [(0, 0, 1), (0, 1, 0), (1, 1, 2)]
+    # The cheapest pair is taken first, which leaves buy order 1 unmatched
+    assert solve_greedily(edges) == {(0, 1)}
+    assert solve_with_networkx(edges) == {(0, 0), (1, 1)}
+
+
+def test_solve_greedily__without_numpy(monkeypatch):
+    monkeypatch.setattr("src.match.np", None)
+    # Ties are taken in the order of the edges
+    edges = [(0, 0, 1), (1, 1, 0), (1, 0, 0), (0, 1, 2)]
+    assert solve_greedily(edges) == {(1, 1), (0, 0)}
+
+
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches,match_result", TEST_CASES
+)
+def test_match_buyers_and_sellers__deadline(
+    buy_orders, sell_orders, banned_user_matches, match_result
+):
+    stats = {}
+    assert (
+        match_buyers_and_sellers(
+            buy_orders,
+            sell_orders,
+            banned_user_matches,
+            deadline=time() + 60,
+            stats=stats,
+        )
+        == match_result
+    )
+    assert stats["optimal"]
+    assert stats["greedy_components"] == 0
+    assert stats["max_matches"] == stats["matches"]
+
+
+def test_match_buyers_and_sellers__deadline_passed():
+    buy_orders, sell_orders, banned_user_matches, _ = POPULATED_MARKET_CASE
+
+    stats = {}
+    result = match_buyers_and_sellers(
+        buy_orders, sell_orders, banned_user_matches, deadline=time(), stats=stats
+    )
+
+    assert not stats["optimal"]
+    assert stats["greedy_components"] == stats["components"] > 0
+    assert stats["matches"] <= stats["max_matches"]
+    buy_order_ids = [buy_order_id for buy_order_id, _ in result]
+    assert len(buy_order_ids) == len(set(buy_order_ids))
+
+
+def solve_slowly(edges):
+    sleep(60)
+
+
+def test_match_buyers_and_sellers__deadline_stops_solver(monkeypatch):
+    monkeypatch.setitem(SOLVERS, "slow", solve_slowly)
+    buy_orders, sell_orders, banned_user_matches, _ = POPULATED_MARKET_CASE
+
+    start = time()
+    stats = {}
+    match_buyers_and_sellers(
+        buy_orders,
+        sell_orders,
+        banned_user_matches,
+        solver="slow",
+        deadline=start + 0.5,
+        stats=stats,
+    )
+
+    assert time() - start < 10
+    assert not stats["optimal"]
+
+
+def distribute_remaining_buyers_by_rescanning(
+    buy_orders, sell_orders, banned_user_matches
+):
+    """
+    The original quadratic implementation of distribute_remaining_buyers.
+    """
+    result = set()
+    sorted_sell_orders = sorted(
+        sell_orders, key=lambda o: (o["price"], -o["number_of_shares"])
+    )
+    while len(sorted_sell_orders) > 0:
+        unmatched_sell_orders = []
+        for sell_order in sorted_sell_orders:
+            eligible_buy_orders = [
+                buy_order
+                for buy_order in buy_orders
+                if (buy_order["price"] >= sell_order["price"])
+                and (
+                    (buy_order["user_id"], sell_order["user_id"])
+                    not in banned_user_matches
+                )
+            ]
+            if len(eligible_buy_orders) == 0:
+                unmatched_sell_orders.append(sell_order)
+                continue
+            buy_order = min(
+                eligible_buy_orders,
+                key=lambda o: (
+                    -o["price"],
+                    abs(sell_order["number_of_shares"] - o["number_of_shares"]),
+                ),
+            )
+            result.add((buy_order["id"], sell_order["id"]))
+            buy_orders.remove(buy_order)
+        for sell_order in unmatched_sell_orders:
+            sorted_sell_orders.remove(sell_order)
+    return result
+
+
+@pytest.mark.parametrize(
+    "buy_orders,sell_orders,banned_user_matches",
+    [case[:3] for case in TEST_CASES] + [generate_random_case(i) for i in range(50)],
+)
+def test_distribute_remaining_buyers(buy_orders, sell_orders, banned_user_matches):
+    expected = distribute_remaining_buyers_by_rescanning(
+        deepcopy(buy_orders), sell_orders, banned_user_matches
+    )
+
+    buy_orders, sell_orders, banned_user_matches = get_matching_params(
+        buy_orders, sell_orders, banned_user_matches
+    )
+    result = distribute_remaining_buyers(
+        buy_orders, sell_orders, banned_user_matches, range(len(buy_orders))
+    )
+    assert {
+        (buy_orders.orders.ids[b], sell_orders.orders.ids[s]) for b, s in result
+    } == expected
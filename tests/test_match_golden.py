@@ -0,0 +1,103 @@
+"""
+Regression tests of the matching engine on a corpus of real-sized order books, recorded with
+benchmarks/record_golden_corpus.py. Every exact solver must find the expected matching, or one
+with a first matching of the same size and cost, within the time and memory budgets of the book.
+"""
+import json
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import pytest
+
+from src.match import SOLVERS, match_buyers_and_sellers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CORPUS_DIR = Path(__file__).parent / "golden"
+
+# Solvers that are not expected to find an optimal first matching
+APPROXIMATE_SOLVERS = {"greedy"}
+# Solvers that need NumPy, which is optional
+NUMPY_SOLVERS = {"assignment"}
+
+
+def load_book(path):
+    with open(path) as f:
+        book = json.load(f)
+    buy_orders, sell_orders = (
+        [
+            {"id": id, "user_id": user_id, "number_of_shares": shares, "price": price}
+            for id, user_id, shares, price in book[side]
+        ]
+        for side in ("buy_orders", "sell_orders")
+    )
+    params = (buy_orders, sell_orders, {tuple(pair) for pair in book["banned_pairs"]})
+    return params, book["expected"], book["budgets"]
+
+
+BOOKS = {path.stem: load_book(path) for path in sorted(CORPUS_DIR.glob("*.json"))}
+
+
+def get_cases():
+    """
+    Every book with every exact solver. New solvers get the budget of "auto" on books they were
+    not recorded on, and solvers left out of a book when it was recorded are skipped as too slow
+    for its size. Solvers that need NumPy are skipped without it.
+    """
+    for name, (_, _, budgets) in BOOKS.items():
+        for solver in sorted(set(SOLVERS) - APPROXIMATE_SOLVERS) + ["auto"]:
+            marks = []
+            if solver in NUMPY_SOLVERS and numpy is None:
+                marks = [pytest.mark.skip(reason="NumPy is not installed")]
+            elif solver not in budgets and solver in SOLVERS:
+                marks = [pytest.mark.skip(reason="too slow")]
+            yield pytest.param(name, solver, id=f"{name}-{solver}", marks=marks)
+
+
+def measure_peak_memory(params, solver):
+    tracemalloc.start()
+    match_buyers_and_sellers(*params, solver=solver)
+    _size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+@pytest.mark.parametrize("name,solver", list(get_cases()))
+def test_golden_corpus(name, solver):
+    params, expected, budgets = BOOKS[name]
+
+    stats = {}
+    start = perf_counter()
+    results = match_buyers_and_sellers(*params, solver=solver, stats=stats)
+    seconds = perf_counter() - start
+
+    assert stats["matches"] == expected["first_matching"]["matches"]
+    assert stats["cost"] == pytest.approx(expected["first_matching"]["cost"])
+    # The remaining buyers are distributed deterministically, so the matches can only differ
+    # when the first matching is another one of the same cost
+    if results != {tuple(pair) for pair in expected["matches"]}:
+        assert len(results) == len(expected["matches"])
+
+    budget = budgets.get(solver, budgets["auto"])
+    if solver == "auto" and numpy is None:
+        # The budget of auto was recorded with NumPy, without which it picks another solver
+        budget = budgets.get(stats["solver"])
+        if budget is None:
+            pytest.skip(
+                f"no budget for {stats['solver']}, which auto picks without NumPy"
+            )
+
+    assert seconds <= budget["seconds"], (
+        f"{solver} took {seconds:.2f}s to match {name}, "
+        f"{seconds / budget['seconds']:.1f}x its budget of {budget['seconds']}s"
+    )
+    peak = measure_peak_memory(params, solver)
+    assert peak <= budget["peak_memory_bytes"], (
+        f"{solver} peaked at {peak / 2 ** 20:.1f} MiB to match {name}, "
+        f"{peak / budget['peak_memory_bytes']:.1f}x its budget of "
+        f"{budget['peak_memory_bytes'] / 2 ** 20:.1f} MiB"
+    )
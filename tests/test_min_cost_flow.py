@@ -0,0 +1,95 @@
+import json
+import random
+
+import pytest
+
+from src.match import solve_with_networkx
+from src.min_cost_flow import MinCostMatching, solve_with_min_cost_flow
+
+
+def get_size_and_cost(edges, matching):
+    costs = {(buy_order, sell_order): cost for buy_order, sell_order, cost in edges}
+    return len(matching), sum(costs[pair] for pair in matching)
+
+
+def generate_edges(rng, number_of_orders=12, density=0.4):
+    return [
+        (b, s, float(rng.randint(0, 20)))
+        for b in range(rng.randint(0, number_of_orders))
+        for s in range(rng.randint(0, number_of_orders))
+        if rng.random() < density
+    ]
+
+
+def edit_edges(rng, edges):
+    costs = {(b, s): cost for b, s, cost in edges}
+    for _ in range(rng.randint(1, 3)):
+        action = rng.random()
+        if action < 0.3 and costs:
+            del costs[rng.choice(list(costs))]
+        elif action < 0.6:
+            costs[(rng.randrange(15), rng.randrange(15))] = float(rng.randint(0, 20))
+        elif costs:
+            costs[rng.choice(list(costs))] = float(rng.randint(0, 20))
+    return [(b, s, cost) for (b, s), cost in costs.items()]
+
+
+def test_solve_with_min_cost_flow():
+    edges = [("b1", "s1", 1), ("b1", "s2", 0), ("b2", "s2", 2)]
+    # Cardinality comes before cost
+    assert solve_with_min_cost_flow(edges) == {("b1", "s1"), ("b2", "s2")}
+    assert solve_with_min_cost_flow([]) == set()
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_min_cost_matching__warm_start(seed):
+    rng = random.Random(seed)
+    edges = generate_edges(rng)
+    matching = MinCostMatching()
+
+    for _ in range(5):
+        warm_matching = matching.solve(edges)
+        size, cost = get_size_and_cost(edges, warm_matching)
+        networkx_size, networkx_cost = get_size_and_cost(
+            edges, solve_with_networkx(edges)
+        )
+        assert size == networkx_size
+        assert cost == pytest.approx(networkx_cost)
+
+        edges = edit_edges(rng, edges)
+
+
+def test_min_cost_matching__warm_start_repairs_changed_orders_only():
+    rng = random.Random(0)
+    edges = [
+        (b, s, float(rng.randint(0, 100)))
+        for b in range(100)
+        for s in range(100)
+        if rng.random() < 0.2
+    ]
+    matching = MinCostMatching()
+    matching.solve(edges)
+    assert matching.searches > 90
+
+    # A new buy order, and another one whose edges all change
+    edges = [(b, s, cost + 50 if b == 0 else cost) for b, s, cost in edges]
+    edges += [(100, s, 0.0) for s in range(0, 100, 10)]
+    warm_matching = matching.solve(edges)
+
+    assert matching.repriced_orders == 2
+    assert matching.searches < 10
+    assert get_size_and_cost(edges, warm_matching) == pytest.approx(
+        get_size_and_cost(edges, solve_with_min_cost_flow(edges))
+    )
+
+
+def test_min_cost_matching__state():
+    rng = random.Random(0)
+    edges = generate_edges(rng)
+    matching = MinCostMatching()
+    matching.solve((str(b), str(s), cost) for b, s, cost in edges)
+
+    edges = [(str(b), str(s), cost) for b, s, cost in edit_edges(rng, edges)]
+    restored = MinCostMatching.from_state(json.loads(json.dumps(matching.get_state())))
+    assert restored.solve(edges) == matching.solve(edges)
+    assert restored.searches == matching.searches
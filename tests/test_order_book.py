@@ -0,0 +1,64 @@
+from array import array
+
+from src.order_book import BannedPairIndex, EdgeList, Interner, OrderBook
+
+
+def test_interner():
+    interner = Interner()
+    assert interner.intern("a") == 0
+    assert interner.intern("b") == 1
+    assert interner.intern("a") == 0
+    assert interner.ids == ["a", "b"]
+    assert len(interner) == 2
+
+
+def test_order_book():
+    orders = [
+        {"id": "b1", "user_id": "X", "number_of_shares": 20.0, "price": 5.0},
+        {"id": "b2", "user_id": "Y", "number_of_shares": 15.0, "price": 6.0},
+        {"id": "b1", "user_id": "X", "number_of_shares": 20.0, "price": 5.0},
+    ]
+    book = OrderBook.from_dicts(orders)
+
+    assert len(book) == 3
+    assert list(book) == orders
+    assert list(book.order) == [0, 1, 0]
+    assert list(book.user) == [0, 1, 0]
+
+
+def test_order_book__shared_users():
+    buy_orders = OrderBook()
+    sell_orders = OrderBook(users=buy_orders.users)
+    buy_orders.append(id="b1", user_id="X", price=5, number_of_shares=20)
+    sell_orders.append(id="s1", user_id="Y", price=5, number_of_shares=20)
+    sell_orders.append(id="s2", user_id="X", price=5, number_of_shares=20)
+
+    assert list(sell_orders.order) == [0, 1]
+    assert list(sell_orders.user) == [1, 0]
+
+
+def test_edge_list():
+    edges = EdgeList([(0, 1, 2.5), (1, 0, 3.0)])
+    edges.append(2, 2, 0.5)
+    edges.frombytes(
+        array("i", [3]).tobytes(), array("i", [1]).tobytes(), array("d", [1]).tobytes()
+    )
+
+    assert len(edges) == 4
+    assert list(edges) == [(0, 1, 2.5), (1, 0, 3.0), (2, 2, 0.5), (3, 1, 1.0)]
+    assert list(edges.take([3, 0])) == [(3, 1, 1.0), (0, 1, 2.5)]
+
+
+def test_banned_pair_index():
+    book = OrderBook.from_dicts(
+        [
+            {"id": "b1", "user_id": "X", "number_of_shares": 20, "price": 5},
+            {"id": "b2", "user_id": "Y", "number_of_shares": 20, "price": 5},
+        ]
+    )
+    index = BannedPairIndex.from_pairs(book.users, [("X", "Y"), ("X", "Z")])
+
+    assert len(index) == 1
+    assert (0, 1) in index
+    assert (1, 0) not in index
+    assert list(index) == [("X", "Y")]
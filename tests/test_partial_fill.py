@@ -0,0 +1,161 @@
+import random
+from collections import Counter
+
+import networkx as nx
+import pytest
+
+from src.partial_fill import match_with_partial_fills
+
+
+def get_traded_shares(trades):
+    buy_shares, sell_shares = Counter(), Counter()
+    for buy_order, sell_order, number_of_shares, _ in trades:
+        buy_shares[buy_order] += number_of_shares
+        sell_shares[sell_order] += number_of_shares
+    return buy_shares, sell_shares
+
+
+def get_total_and_cost(buy_orders, sell_orders, trades):
+    prices = {order["id"]: order["price"] for order in buy_orders + sell_orders}
+    return (
+        sum(number_of_shares for _, _, number_of_shares, _ in trades),
+        sum(
+            (prices[buy_order] - prices[sell_order]) * number_of_shares
+            for buy_order, sell_order, number_of_shares, _ in trades
+        ),
+    )
+
+
+def solve_densely(buy_orders, sell_orders, banned_user_matches):
+    """
+    Same optimum as match_with_partial_fills, with an edge for every compatible pair.
+    """
+    graph = nx.DiGraph()
+    graph.add_nodes_from(["source", "sink"])
+    for order in sell_orders:
+        graph.add_edge("source", order["id"], capacity=order["number_of_shares"])
+    for order in buy_orders:
+        graph.add_edge(order["id"], "sink", capacity=order["number_of_shares"])
+    for buy_order in buy_orders:
+        for sell_order in sell_orders:
+            if (
+                buy_order["price"] >= sell_order["price"]
+                and (buy_order["user_id"], sell_order["user_id"])
+                not in banned_user_matches
+            ):
+                graph.add_edge(
+                    sell_order["id"],
+                    buy_order["id"],
+                    weight=round((buy_order["price"] - sell_order["price"]) * 100),
+                )
+    flow = nx.max_flow_min_cost(graph, "source", "sink")
+    return [
+        (buy_order, sell_order["id"], number_of_shares, None)
+        for sell_order in sell_orders
+        for buy_order, number_of_shares in flow[sell_order["id"]].items()
+        if number_of_shares > 0
+    ]
+
+
+def generate_orders(rng, number_of_orders=10):
+    def generate(prefix, prices):
+        return [
+            {
+                "id": f"{prefix}{i}",
+                "user_id": f"u{rng.randrange(number_of_orders)}",
+                "number_of_shares": rng.randint(1, 50),
+                "price": rng.choice(prices),
+            }
+            for i in range(rng.randint(0, number_of_orders))
+        ]
+
+    buy_orders = generate("b", [4, 5, 5.5, 6, 7])
+    sell_orders = generate("s", [4, 5, 5.25, 6, 8])
+    users = sorted({order["user_id"] for order in buy_orders + sell_orders})
+    banned_user_matches = {
+        (rng.choice(users), rng.choice(users)) for _ in range(rng.randint(0, 6))
+    }
+    return buy_orders, sell_orders, banned_user_matches
+
+
+def test_match_with_partial_fills():
+    buy_orders = [
+        {"id": "b1", "user_id": "A", "number_of_shares": 30, "price": 6},
+        {"id": "b2", "user_id": "B", "number_of_shares": 30, "price": 7},
+        {"id": "b3", "user_id": "C", "number_of_shares": 60, "price": 5},
+    ]
+    sell_orders = [
+        {"id": "s1", "user_id": "D", "number_of_shares": 100, "price": 5},
+        {"id": "s2", "user_id": "E", "number_of_shares": 10, "price": 8},
+    ]
+
+    # A large seller clears against every buyer, nearest prices first, so the buyer with the
+    # furthest price only gets what is left
+    assert match_with_partial_fills(buy_orders, sell_orders, []) == {
+        ("b1", "s1", 30, 5.5),
+        ("b2", "s1", 10, 6),
+        ("b3", "s1", 60, 5),
+    }
+
+
+def test_match_with_partial_fills__banned_pairs():
+    buy_orders = [
+        {"id": "b1", "user_id": "A", "number_of_shares": 10, "price": 6},
+        {"id": "b2", "user_id": "B", "number_of_shares": 10, "price": 6},
+    ]
+    sell_orders = [
+        {"id": "s1", "user_id": "C", "number_of_shares": 15, "price": 5},
+        {"id": "s2", "user_id": "D", "number_of_shares": 5, "price": 6},
+    ]
+
+    assert match_with_partial_fills(buy_orders, sell_orders, {("A", "C")}) == {
+        ("b1", "s2", 5, 6),
+        ("b2", "s1", 10, 5.5),
+    }
+
+
+def test_match_with_partial_fills__orders_in_several_rows():
+    buy_orders = [{"id": "b1", "user_id": "A", "number_of_shares": 20, "price": 6}]
+    sell_orders = [{"id": "s1", "user_id": "B", "number_of_shares": 5.5, "price": 5}]
+
+    # Doubled sell orders are only sold once
+    assert match_with_partial_fills(buy_orders, sell_orders * 2, []) == {
+        ("b1", "s1", 5.5, 5.5)
+    }
+
+
+def test_match_with_partial_fills__no_trades():
+    buy_orders = [{"id": "b1", "user_id": "A", "number_of_shares": 20, "price": 4}]
+    sell_orders = [{"id": "s1", "user_id": "B", "number_of_shares": 20, "price": 5}]
+
+    assert match_with_partial_fills(buy_orders, sell_orders, []) == set()
+    assert match_with_partial_fills([], sell_orders, []) == set()
+    assert match_with_partial_fills(buy_orders, [], []) == set()
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_match_with_partial_fills__optimal(seed):
+    rng = random.Random(seed)
+    buy_orders, sell_orders, banned_user_matches = generate_orders(rng)
+
+    trades = match_with_partial_fills(buy_orders, sell_orders, banned_user_matches)
+
+    orders = {order["id"]: order for order in buy_orders + sell_orders}
+    for buy_order, sell_order, _, price in trades:
+        assert orders[buy_order]["price"] >= orders[sell_order]["price"]
+        assert (
+            orders[buy_order]["user_id"],
+            orders[sell_order]["user_id"],
+        ) not in banned_user_matches
+        assert price == (orders[buy_order]["price"] + orders[sell_order]["price"]) / 2
+    for traded_shares in get_traded_shares(trades):
+        for order, number_of_shares in traded_shares.items():
+            assert number_of_shares <= orders[order]["number_of_shares"]
+
+    assert get_total_and_cost(buy_orders, sell_orders, trades) == pytest.approx(
+        get_total_and_cost(
+            buy_orders,
+            sell_orders,
+            solve_densely(buy_orders, sell_orders, banned_user_matches),
+        )
+    )